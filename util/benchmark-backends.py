@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+
+from webapps import SEP_COLUMNS, get_app_paths, has_bokeh, load_app
+
+import viraly
+
+from viraly_backend import run_simulation_backend, BACKENDS
+
+# per run latency of run_simulation_web and of each backend of viraly_backend.py, on the defaults of every web app
+#
+# each app is run headless (bokeh must be installed) with run_simulation_web wrapped to record the parameters of
+# its first simulation, which are then timed on every engine; the first call of each backend is not timed, so a
+# JIT compilation shows up on the compile column only
+
+# best time of repeat runs, in milliseconds
+
+def get_latency ( function, args, kwargs, repeat ):
+
+    best = float('inf')
+
+    for k in range(0, repeat):
+        start = time.perf_counter()
+        function ( *args, **kwargs )
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+def main ( argv ):
+
+    parser = argparse.ArgumentParser(description='Time run_simulation_web and the viraly_backend.py backends on the defaults of the web apps.')
+    parser.add_argument('apps', nargs='*', help='web app files (all of web/ by default)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='runs per engine, the best one is reported')
+
+    args = parser.parse_args(argv)
+
+    if not has_bokeh ( 'the web apps are' ):
+        return 0
+
+    backends = list(BACKENDS)
+    print('backends:', ', '.join(backends), '(numba is not installed)' if 'numba' not in BACKENDS else '')
+    print(SEP_COLUMNS.join([ 'app', 'tmax', 'reference ms' ] + [ name + ' ms' for name in backends ] + [ name + ' compile ms' for name in backends ]))
+
+    for app in get_app_paths ( args.apps ):
+        namespace, call, data_call = load_app ( app )
+        if call is None:
+            continue
+        params, kwargs = call
+
+        row = [ os.path.basename(app), str(params[8]), '{:.3f}'.format(get_latency ( viraly.run_simulation_web, params, kwargs, args.repeat )) ]
+
+        latencies = []
+        compiles  = []
+        for name in backends:
+            compiles.append('{:.1f}'.format(get_latency ( run_simulation_backend, params, dict(kwargs, backend=name), 1 )))
+            latencies.append('{:.3f}'.format(get_latency ( run_simulation_backend, params, dict(kwargs, backend=name), args.repeat )))
+
+        print(SEP_COLUMNS.join(row + latencies + compiles), flush=True)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy
+
+from webapps import SEP_COLUMNS, get_app_paths, load_app
+
+from bokeh.document import Document
+from bokeh.io.doc import set_curdoc
+from bokeh.models import Slider
+from bokeh.protocol import Protocol
+
+# latency of the slider callbacks of every web app, as seen by a user, and the size of the updates they send
+#
+# each app is loaded into its own bokeh Document, without a server or a browser, and every slider is moved one
+# step (and back) the way a browser does it: a PATCH-DOC with the new value and value_throttled applied to the
+# document by a client session, which runs the update_data of the app (simulation, derived series, data source
+# assignments); the callback time is the time of that patch, and the serialization time and the size are those of
+# the PATCH-DOC that the server would send back with the resulting changes (JSON content plus binary buffers)
+#
+# the report has one row per app with the number of moves, the median and largest callback time, the median
+# serialization time and the median and largest patch size; -o also writes every move as JSON
+
+PROTOCOL = Protocol()
+
+# the client session that moves the sliders (the changes it sets are not sent back to it)
+
+class Client:
+
+    pass
+
+# a new document with an app, and the sliders of the app
+
+def load_document ( path ):
+
+    document = Document()
+    set_curdoc(document)
+    load_app ( path )
+
+    sliders = sorted(document.select({ 'type' : Slider }), key=lambda slider : slider.title)
+
+    return document, sliders
+
+# the next value of a slider: one step up, or down at the end of its range
+
+def get_next_value ( slider ):
+
+    value = slider.value + slider.step
+    if value > slider.end:
+        value = slider.value - slider.step
+
+    return value
+
+# moves a slider to a value as a browser does, returns the callback time, the serialization time and the patch size
+
+def move_slider ( document, slider, value ):
+
+    client = Client()
+    events = []
+
+    patch = { 'events' : [ { 'kind' : 'ModelChanged', 'model' : { 'id' : slider.id }, 'attr' : attr, 'new' : value } for attr in [ 'value', 'value_throttled' ] ],
+              'references' : [] }
+
+    document.on_change(events.append)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            document.apply_json_patch(patch, setter=client)
+            callback = time.perf_counter() - start
+    finally:
+        document.remove_on_change(events.append)
+
+    start   = time.perf_counter()
+    message = PROTOCOL.create('PATCH-DOC', [ event for event in events if event.setter is not client ])
+    size    = len(message.content_json) + sum([ len(payload) for header, payload in message.buffers ])
+    serialization = time.perf_counter() - start
+
+    return callback, serialization, size
+
+def main ( argv ):
+
+    parser = argparse.ArgumentParser(description='Time the slider callbacks of the web apps on headless bokeh documents.')
+    parser.add_argument('apps', nargs='*', help='web app files (all of web/ by default)')
+    parser.add_argument('-r', '--repeat', type=int, default=2, help='moves of each slider (one step and back each)')
+    parser.add_argument('-o', '--output', help='JSON file for every move')
+
+    args = parser.parse_args(argv)
+
+    # every app has sliders, including the ones without a simulation over days
+    apps = get_app_paths ( args.apps, skipped = [] )
+
+    print(SEP_COLUMNS.join([ 'app', 'moves', 'median ms', 'max ms', 'serialization ms', 'median bytes', 'max bytes', 'slowest slider' ]))
+
+    report = {}
+
+    for app in apps:
+        document, sliders = load_document ( app )
+
+        moves = []
+        for slider in sliders:
+            original = slider.value
+            for k in range(0, args.repeat):
+                for value in [ get_next_value ( slider ), original ]:
+                    callback, serialization, size = move_slider ( document, slider, value )
+                    moves.append({ 'slider' : slider.title, 'value' : value, 'callback' : callback, 'serialization' : serialization, 'bytes' : size })
+
+        name = os.path.basename(app)
+        report[name] = moves
+        if len(moves) == 0:
+            print(SEP_COLUMNS.join([ name, '0' ]))
+            continue
+
+        callbacks = numpy.array([ move['callback'] for move in moves ]) * 1000
+        sizes     = numpy.array([ move['bytes'] for move in moves ])
+        slowest   = moves[int(numpy.argmax(callbacks))]['slider']
+
+        print(SEP_COLUMNS.join([ name, str(len(moves)), '{:.1f}'.format(numpy.median(callbacks)), '{:.1f}'.format(callbacks.max()),
+                                 '{:.1f}'.format(1000 * numpy.median([ move['serialization'] for move in moves ])),
+                                 str(int(numpy.median(sizes))), str(sizes.max()), slowest ]), flush=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
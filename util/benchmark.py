@@ -0,0 +1,243 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import numpy
+
+from webapps import SEP_COLUMNS, get_app_paths, has_bokeh, load_app, get_simulation_params
+
+from viraly import get_older_model4, get_next_model34, get_parameters, get_accumulated, run_simulation, run_simulation_web, EngineConfig, INCIDENCE_WINDOW
+from viraly_batch import run_simulation_batch
+
+# benchmark suite of the engine, with scaling curves and a regression gate
+#
+# each benchmark is timed over a range of sizes (the horizon in days, or the number of scenarios of a batch) and
+# its empirical complexity is the slope of log(time) over log(size); a slope above the expected order of the
+# benchmark by more than COMPLEXITY_MARGIN is flagged, which is how an accidental O(n^2) shows up
+#
+# the results can be stored as JSON (-o) and compared with a stored baseline (-b): a benchmark that got slower
+# than the baseline by more than the threshold (-t, a fraction) on any size is a regression; the script exits
+# with 1 on a regression or a complexity flag
+#
+# model 4 scans the whole history of new cases on every day, so the benchmarks that run it are O(n^2) by design
+# and only run on the horizons up to --max-quadratic-days; the web apps are run headless (bokeh must be installed)
+# to record the arguments of their get_data, which is then timed with the tmax of each horizon
+
+HORIZONS    = [ 180, 365, 720, 1095, 3650 ]
+BATCH_SIZES = [ 1, 10, 100, 1000 ]
+BATCH_DAYS  = 365
+
+MAX_QUADRATIC_DAYS = 365
+COMPLEXITY_MARGIN  = 0.4
+THRESHOLD          = 0.5
+
+# shortest timed run, in seconds: faster functions are called as many times as needed and the time is per call
+# functions slower than MAX_REPEAT_SECONDS are only run once per size
+MIN_RUN_SECONDS    = 0.02
+MAX_REPEAT_SECONDS = 1
+
+# parameters of the README example, with the contention at a third of the horizon
+
+def get_args ( days, L = 0 ):
+
+    return ( 4, 0.1145, 15, L, 1, 2, 0.02, days // 3, days, 10276617, 4, 0.03, False, 0, 0, 0, 0, 0 )
+
+# a history of new cases over the days (the shape does not matter for the timings)
+
+def get_history ( days ):
+
+    return list(numpy.linspace(1, 1000, days + 1))
+
+# the loop of the engines over the days, on one of the helpers
+
+def run_model34 ( days, L ):
+
+    history = get_history ( days )
+    m       = 10276617.0
+
+    for t in range(1, days + 1):
+        get_next_model34 ( history[t - 1], 4, 0.1145, t, history, m, 10276617, 15, L, L > 0 )
+
+def run_parameters ( days ):
+
+    for t in range(0, days + 1):
+        get_parameters ( 4, 0.1145, 2, 0.02, t, days // 3, True, 14, 3, 0.05, 2 * days // 3, 14 )
+
+# the 14 day incidence per 100 000 people, as computed by the web apps (see their get_data)
+
+def get_incidence ( nc_history, population ):
+
+    ic_history = []
+    for j in range (0, len(nc_history)):
+        if ( j < INCIDENCE_WINDOW ):
+            my_incidence = 0
+        else:
+            my_incidence = numpy.array( nc_history[ j - ( INCIDENCE_WINDOW + 1 ) : j-1 ] ).sum() / ( population / 0.1 )
+        ic_history.append( my_incidence )
+
+    return ic_history
+
+# whether a benchmark is selected by the -k texts (all of them when there are none)
+
+def is_selected ( name, select ):
+
+    return len(select) == 0 or any([ text in name for text in select ])
+
+# the selected benchmarks: name -> ( size variable, sizes, expected order, function of the size returning the timed function )
+
+def get_benchmarks ( select ):
+
+    benchmarks = {}
+
+    benchmarks['get_older_model4']           = ( 'days', HORIZONS, 1, lambda n : ( lambda history=get_history ( n ) : get_older_model4 ( n, history, 10276617, 15, 3 ) ) )
+    benchmarks['get_next_model34 L=0']       = ( 'days', HORIZONS, 1, lambda n : ( lambda : run_model34 ( n, 0 ) ) )
+    benchmarks['get_next_model34 L=3']       = ( 'days', HORIZONS, 2, lambda n : ( lambda : run_model34 ( n, 3 ) ) )
+    benchmarks['get_parameters']             = ( 'days', HORIZONS, 1, lambda n : ( lambda : run_parameters ( n ) ) )
+    benchmarks['run_simulation']             = ( 'days', HORIZONS, 2, lambda n : ( lambda : run_simulation ( *get_args ( n ) ) ) )
+    benchmarks['run_simulation_web L=0']     = ( 'days', HORIZONS, 1, lambda n : ( lambda : run_simulation_web ( *get_args ( n ) ) ) )
+    benchmarks['run_simulation_web L=3']     = ( 'days', HORIZONS, 2, lambda n : ( lambda : run_simulation_web ( *get_args ( n, 3 ), config=EngineConfig ( prefer_mod4 = True ) ) ) )
+    benchmarks['run_simulation_web model 5'] = ( 'days', HORIZONS, 1, lambda n : ( lambda : run_simulation_web ( *get_args ( n, 3 ), config=EngineConfig ( erlang = True ) ) ) )
+    benchmarks['get_accumulated']            = ( 'days', HORIZONS, 1, lambda n : ( lambda history=get_history ( n ) : get_accumulated ( history ) ) )
+    benchmarks['incidence']                  = ( 'days', HORIZONS, 1, lambda n : ( lambda history=get_history ( n ) : get_incidence ( history, 10.2 ) ) )
+
+    batch_params = lambda size : dict(zip([ 'h', 'p', 'T', 'L', 'I', 'h2', 'p2', 'tint' ], get_args ( BATCH_DAYS )), p=numpy.linspace(0.05, 0.15, size), M=10276617, N0=4, DR=0.03)
+
+    benchmarks['run_simulation_batch scenarios'] = ( 'scenarios', BATCH_SIZES, 1, lambda n : ( lambda : run_simulation_batch ( batch_params ( n ), BATCH_DAYS ) ) )
+    benchmarks['run_simulation_batch days']      = ( 'days', HORIZONS, 1, lambda n : ( lambda : run_simulation_batch ( dict(batch_params ( 100 ), tint=n // 3), n ) ) )
+
+    benchmarks = { name : benchmark for name, benchmark in benchmarks.items() if is_selected ( name, select ) }
+    benchmarks.update(get_app_benchmarks ( select ))
+
+    return benchmarks
+
+# a function without its terminal output (get_data prints the CLI string of the simulation)
+
+def run_quiet ( function, kwargs ):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function ( **kwargs )
+
+# the get_data of every web app, with the arguments of its first call (its default widget values)
+
+def get_app_benchmarks ( select ):
+
+    paths = [ path for path in get_app_paths ( ) if is_selected ( 'get_data ' + os.path.basename(path), select ) ]
+    if len(paths) == 0 or not has_bokeh ( 'the web apps are' ):
+        return {}
+
+    benchmarks = {}
+
+    for path in paths:
+
+        namespace, simulation, args = load_app ( path, get_data = True )
+        if args is None:
+            continue
+
+        # model 4 (the one that scans the whole history) is what the app actually ran: the standard deviation of
+        # the infectious period alone does not tell, as some apps run model 5 with it
+        params = get_simulation_params ( simulation ) if simulation is not None else {}
+        order  = 2 if params.get('prefer_mod4', False) and not params.get('erlang', False) else 1
+
+        get_data = namespace['get_data']
+        benchmarks['get_data ' + os.path.basename(path)] = ( 'days', HORIZONS, order, lambda n, get_data=get_data, args=args : ( lambda : run_quiet ( get_data, dict(args, tmax=n) ) ) )
+
+    return benchmarks
+
+# time per call of a function, in seconds: best of repeat runs of enough calls to last MIN_RUN_SECONDS
+
+def get_time ( function, repeat ):
+
+    start = time.perf_counter()
+    function ( )
+    elapsed = time.perf_counter() - start
+
+    if elapsed > MAX_REPEAT_SECONDS:
+        return elapsed
+
+    number = max(1, int(MIN_RUN_SECONDS / max(elapsed, 1e-9)))
+    best   = elapsed if number == 1 else float('inf')
+
+    for k in range(0, repeat - 1 if number == 1 else repeat):
+        start = time.perf_counter()
+        for j in range(0, number):
+            function ( )
+        best = min(best, (time.perf_counter() - start) / number)
+
+    return best
+
+# slope of log(time) over log(size), None with a single size
+
+def get_order ( sizes, seconds ):
+
+    if len(sizes) < 2:
+        return None
+
+    return float(numpy.polyfit(numpy.log(sizes), numpy.log(seconds), 1)[0])
+
+def main ( argv ):
+
+    parser = argparse.ArgumentParser(description='Benchmark the engine over horizons and batch sizes, with a regression gate against a stored baseline.')
+    parser.add_argument('-k', '--select', action='append', default=[], help='only the benchmarks whose name contains this text, may be repeated')
+    parser.add_argument('-d', '--days', help='comma separated horizons (default: ' + ','.join([ str(days) for days in HORIZONS ]) + ')')
+    parser.add_argument('-q', '--max-quadratic-days', type=int, default=MAX_QUADRATIC_DAYS, help='longest horizon of the O(n^2) benchmarks')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per size, the best one is kept')
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('-b', '--baseline', help='JSON file of stored results to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD, help='allowed slowdown against the baseline, as a fraction')
+
+    args = parser.parse_args(argv)
+
+    horizons   = HORIZONS if args.days is None else [ int(days) for days in args.days.split(',') ]
+    benchmarks = get_benchmarks ( args.select )
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as stored:
+            baseline = json.load(stored)['benchmarks']
+
+    results = {}
+    flags   = []
+
+    print(SEP_COLUMNS.join([ 'benchmark', 'variable', 'order', 'expected', 'ms per size' ]))
+
+    for name in benchmarks:
+        variable, sizes, expected, factory = benchmarks[name]
+        if variable == 'days':
+            sizes = [ days for days in horizons if expected < 2 or days <= args.max_quadratic_days ]
+
+        seconds = [ get_time ( factory ( size ), args.repeat ) for size in sizes ]
+        order   = get_order ( sizes, seconds )
+
+        results[name] = { 'variable' : variable, 'sizes' : sizes, 'seconds' : seconds, 'order' : order, 'expected_order' : expected }
+
+        notes = []
+        if order is not None and order > expected + COMPLEXITY_MARGIN:
+            notes.append('complexity')
+            flags.append(( name, 'order {:.2f} above the expected {}'.format(order, expected) ))
+
+        if baseline is not None and name in baseline:
+            stored = dict(zip(baseline[name]['sizes'], baseline[name]['seconds']))
+            for size, value in zip(sizes, seconds):
+                if size in stored and value > stored[size] * (1 + args.threshold):
+                    notes.append('regression')
+                    flags.append(( name, '{} {}: {:.3f} ms, baseline {:.3f} ms'.format(size, variable, value * 1000, stored[size] * 1000) ))
+
+        timings = ' '.join([ '{}:{:.3f}'.format(size, value * 1000) for size, value in zip(sizes, seconds) ])
+        print(SEP_COLUMNS.join([ name, variable, '-' if order is None else '{:.2f}'.format(order), str(expected), timings ] + sorted(set(notes))), flush=True)
+
+    print('flags:', len(flags))
+    for name, reason in flags:
+        print('  ' + name + ': ' + reason)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump({ 'python' : platform.python_version(), 'machine' : platform.machine(), 'benchmarks' : results }, output, indent=1)
+
+    return 1 if len(flags) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
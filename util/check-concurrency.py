@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import concurrent.futures
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from viraly import run_simulation_web, get_legacy_schedule, EngineConfig
+from viraly_batch import run_simulation_batch
+
+# runs many simulations on a thread pool, as a bokeh serve process does with its sessions, and checks that every
+# result is identical to the one of the same simulation run serially
+#
+# the scenarios mix the models (through their EngineConfig), the stages, N-stage schedules and seasonal
+# attenuation, so that the cached kernels and schedules are shared by the threads; exits with 1 on a mismatch
+
+BASE = { 'h' : 10, 'p' : 0.02, 'T' : 14, 'L' : 0, 'I' : 1, 'h2' : 5, 'p2' : 0.02, 'tint' : 30, 'tmax' : 90, 'M' : 1e7, 'N0' : 10, 'DR' : 0.01,
+         'progressive' : False, 'ttime' : 0, 'h3' : 8, 'p3' : 0.02, 'tint2' : 0, 'ttime2' : 0 }
+
+CONFIGS = [ EngineConfig(), EngineConfig ( prefer_mod4 = True ), EngineConfig ( erlang = True ) ]
+
+# the simulations: ( keyword arguments of run_simulation_web ) for every combination of the variations
+
+def get_scenarios ( count ):
+
+    scenarios = []
+
+    for k, ( config, L, tint, saa ) in enumerate(itertools.product(CONFIGS, [ 0, 3 ], [ 20, 40, 60 ], [ 0, 0.3 ])):
+        params = dict(BASE, L=L, tint=tint, saa=saa, config=config)
+        if k % 2 == 1:
+            params['progressive'] = True
+            params['ttime']       = 14
+        if k % 3 == 0:
+            params['schedule'] = get_legacy_schedule ( params['h'], params['p'], params['h2'], params['p2'], tint, params['progressive'], params['ttime'],
+                                                       params['h3'], params['p3'], params['tint2'], params['ttime2'], params['tmax'] )
+        scenarios.append(params)
+
+    return list(itertools.islice(itertools.cycle(scenarios), count))
+
+# a run_simulation_web simulation or, for every fourth scenario, a batch of its L variations
+
+def run ( k, params ):
+
+    if k % 4 == 3:
+        batch  = { name : value for name, value in params.items() if name not in [ 'config', 'tmax' ] }
+        batch.update(L=[ 0, 2, 4 ], prefer_mod4=params['config'].prefer_mod4, erlang=params['config'].erlang)
+        result = run_simulation_batch ( batch, params['tmax'] )
+        return [ result.active, result.new, result.rt ]
+
+    return run_simulation_web ( **params )
+
+def is_same ( a, b ):
+
+    return all([ numpy.array_equal(numpy.asarray(x), numpy.asarray(y)) for x, y in zip(a, b) ])
+
+def main ( argv ):
+
+    parser = argparse.ArgumentParser(description='Check that concurrent simulations give the same results as serial ones.')
+    parser.add_argument('-n', '--count', type=int, default=144, help='number of simulations')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='number of threads')
+
+    args = parser.parse_args(argv)
+
+    scenarios = get_scenarios ( args.count )
+
+    start  = time.perf_counter()
+    serial = [ run ( k, params ) for k, params in enumerate(scenarios) ]
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        concurrent_results = list(executor.map(run, range(0, len(scenarios)), scenarios))
+    concurrent_time = time.perf_counter() - start
+
+    mismatches = [ k for k in range(0, len(scenarios)) if not is_same ( serial[k], concurrent_results[k] ) ]
+
+    print('simulations:', len(scenarios), 'threads:', args.workers)
+    print('serial: {:.2f} s, concurrent: {:.2f} s'.format(serial_time, concurrent_time))
+    print('mismatches:', len(mismatches), mismatches[0:10])
+
+    return 1 if len(mismatches) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy
+import scipy.sparse
+
+from webapps import ROOT, SEP_COLUMNS, get_app_paths, has_bokeh, load_app, get_simulation_params
+
+import viraly
+
+from viraly import get_params, get_summary_from_dataset, SUMMARY_NAMES
+from viraly_batch import run_simulation_batch
+from viraly_backend import run_simulation_backend, BACKENDS
+from viraly_meta import run_simulation_meta, get_total_dataset as get_meta_dataset
+from viraly_age import run_simulation_age, get_total_dataset as get_age_dataset
+from viraly_policy import get_prefix_checkpoints
+
+# runs a corpus of parameter sets through every engine and checks that each one agrees with run_simulation_web
+#
+# the corpus has the defaults of the web apps (recorded by running them headless, when bokeh is installed), the
+# CLI examples of the README, edge cases and seeded random draws; each engine runs the cases it supports and its
+# results are compared with those of the reference, series by series (a dataset) or value by value (a summary)
+#
+# the error of a series is the largest difference with the reference over its days, divided by the largest
+# value of the reference series (or 1, if smaller); the recovered and deaths series are rounded by the engines,
+# so a difference of one unit on a day (a value on the rounding boundary) is not counted, on them and on their
+# accumulations; the days of the summary must match exactly
+#
+# the report has one row per engine with the number of cases, the largest error, its tolerance and the time
+# spent, and the cases that failed; exits with 1 when any case fails
+
+# tolerances of each engine: the exact ones only differ from the reference by floating point summation order,
+# fast forward jumps over the linear phase with a tolerance of FAST_FORWARD_TOLERANCE of M (see viraly_batch.py)
+EXACT_TOLERANCE        = 1e-9
+FAST_FORWARD_TOLERANCE = 1e-6
+TOLERANCES = { 'batch-fast-forward' : 1e-4 }
+
+# dataset series that the engines round to whole numbers -> the series accumulated from them
+ROUNDED_SERIES = { 2 : 6, 3 : 7 }
+
+# model 4 evaluates the normal cdf on every day for every day, so its random draws are kept short
+RANDOM_TMAX_MOD4 = 240
+
+# a case: name and the keyword arguments of run_simulation_web
+
+def get_case ( name, params ):
+
+    case = { 'h2' : 0, 'p2' : 0, 'progressive' : False, 'ttime' : 0, 'h3' : 0, 'p3' : 0, 'tint2' : 0, 'ttime2' : 0 }
+    case.update(params)
+
+    # the engine configuration becomes explicit parameters, which every engine takes
+    config = case.pop('config', viraly.DEFAULT_CONFIG)
+    case.pop('silent', None)
+    for option in [ 'prefer_mod4', 'erlang' ]:
+        if case.get(option) is None:
+            case[option] = getattr(config, option)
+
+    return ( name, case )
+
+# the parameters of the first simulation of each web app, with its default widget values
+
+def get_app_cases ( ):
+
+    if not has_bokeh ( 'the web app defaults are' ):
+        return []
+
+    cases = []
+
+    for path in get_app_paths ( ):
+        namespace, simulation, data_call = load_app ( path )
+        if simulation is not None:
+            cases.append(get_case ( os.path.basename(path), get_simulation_params ( simulation ) ))
+
+    return cases
+
+# the CLI examples of the README (subcommands excluded)
+
+def get_readme_cases ( ):
+
+    cases = []
+
+    with open(os.path.join(ROOT, 'README.md')) as readme:
+        for line in readme:
+            # the usage lines have the parameter names instead of values
+            if not line.startswith('python3 viraly.py "') or 'h,p' in line:
+                continue
+            params = get_params ( line.split('"')[1].replace(' ', '') )
+            if params is not None:
+                cases.append(get_case ( 'README ' + line.split('"')[1][0:40], params ))
+
+    return cases
+
+# the boundaries of the parameters
+
+def get_edge_cases ( ):
+
+    base = { 'h' : 4, 'p' : 0.1145, 'T' : 15, 'L' : 0, 'I' : 1, 'h2' : 2, 'p2' : 0.02, 'tint' : 40, 'tmax' : 180, 'M' : 10276617, 'N0' : 4, 'DR' : 0.03 }
+
+    edges = { 'I=1 L=0'               : {},
+              'I=6'                   : { 'I' : 6 },
+              'L=3 model 4'           : { 'L' : 3, 'prefer_mod4' : True },
+              'model 5'               : { 'L' : 3, 'erlang' : True },
+              'tint=tmax'             : { 'tint' : 180 },
+              'tint=0'                : { 'tint' : 0 },
+              'tint<T'                : { 'tint' : 5 },
+              'tint<T L=5 model 4'    : { 'tint' : 20, 'L' : 5, 'prefer_mod4' : True },
+              'tint<T L=5 model 5'    : { 'tint' : 20, 'L' : 5, 'erlang' : True },
+              'full pre immunity'     : { 'I0' : 10276617 - 4 },
+              'half pre immunity'     : { 'I0' : 5e6 },
+              'no transmission'       : { 'p' : 0 },
+              'hpT=1'                 : { 'h' : 1, 'p' : 1 / 15 },
+              'T=1'                   : { 'T' : 1 },
+              'DR=1'                  : { 'DR' : 1 },
+              'tiny population'       : { 'M' : 100, 'N0' : 1 },
+              'three stages'          : { 'progressive' : True, 'ttime' : 10, 'h3' : 3, 'p3' : 0.05, 'tint2' : 100, 'ttime2' : 20 },
+              'seasonal'              : { 'tmax' : 730, 'tint' : 730, 'p' : 0.03, 'ddy' : 30, 'saa' : 0.4, 'bat' : 0.1 },
+              'triggers'              : { 'tint' : 180, 'ton' : 200, 'toff' : 50 },
+              'gamma incubation'      : { 'I' : 5, 'incubation' : ( 'gamma', 2 ) },
+              'schedule'              : { 'schedule' : '0:4:0.1145;20:4:0.1145:linear;38:2:0.02;75:2:0.02:smooth;105:3:0.05' } }
+
+    return [ get_case ( 'edge ' + name, dict(base, **edge) ) for name, edge in edges.items() ]
+
+# seeded random draws over the usual ranges, with hpT between 0.5 and 4
+
+def get_random_cases ( count, seed ):
+
+    rng   = numpy.random.RandomState(seed)
+    cases = []
+
+    for k in range(0, count):
+        mod4 = rng.rand() < 0.3
+        tmax = int(rng.randint(60, RANDOM_TMAX_MOD4 if mod4 else 1000))
+        T    = int(rng.randint(3, 25))
+        h    = float(rng.uniform(0.5, 10))
+        tint = int(rng.randint(0, tmax + 1))
+
+        params = { 'h' : h, 'p' : float(rng.uniform(0.5, 4)) / (h * T), 'T' : T, 'L' : int(rng.randint(1, 5)) if mod4 else 0,
+                   'I' : int(rng.randint(1, 7)), 'h2' : float(rng.uniform(0, h)), 'p2' : float(rng.uniform(0, 0.05)),
+                   'tint' : tint, 'tmax' : tmax, 'M' : float(10**rng.uniform(3, 8)), 'N0' : float(rng.randint(1, 100)),
+                   'DR' : float(rng.uniform(0, 0.05)), 'prefer_mod4' : mod4, 'I0' : float(rng.choice([ 0, 1000 ])),
+                   'saa' : float(rng.choice([ 0, 0, rng.uniform(0, 0.5) ])), 'ddy' : int(rng.randint(0, 365)) }
+
+        if rng.rand() < 0.3 and tint < tmax:
+            params.update(progressive=True, ttime=int(rng.randint(1, tmax - tint + 1)))
+
+        cases.append(get_case ( 'random ' + str(k), params ))
+
+    return cases
+
+# the engines: name -> ( whether it supports a case, run returning a dataset or a summary, summary or not )
+
+def is_plain ( case ):
+
+    return case.get('ton', 0) <= 0 and case.get('incubation') is None
+
+def get_batch_params ( case ):
+
+    return { name : value for name, value in case.items() if name not in [ 'tmax', 'incubation' ] }
+
+def run_batch ( case, **options ):
+
+    return run_simulation_batch ( get_batch_params ( case ), case['tmax'], incubation=case.get('incubation'), **options )
+
+def run_resumed ( case ):
+
+    day    = max(1, case['tmax'] // 2)
+    prefix = run_batch ( case, summary_only=True, checkpoints={ day }, stop=day )
+
+    return run_batch ( case, summary_only=True, resume=prefix.checkpoints[day] ).get_summary ( 0 )
+
+# the policy optimizer resumes the candidates of a tint from the free expansion up to it (see viraly_policy.py)
+
+def is_policy ( case ):
+
+    return is_plain ( case ) and case.get('schedule') is None and 0 < case['tint'] < case['tmax']
+
+def run_policy_resumed ( case ):
+
+    day    = case['tint']
+    prefix = get_prefix_checkpoints ( get_batch_params ( case ), case['tmax'], [ day ] )
+
+    return run_batch ( case, summary_only=True, resume=prefix[day] ).get_summary ( 0 )
+
+def run_meta ( case ):
+
+    return get_meta_dataset ( run_simulation_meta ( get_batch_params ( case ), scipy.sparse.identity(1, format='csr'), case['tmax'] ) )
+
+def run_age ( case ):
+
+    return get_age_dataset ( run_simulation_age ( get_batch_params ( case ), [ [ 1.0 ] ], case['tmax'] ) )
+
+def get_engines ( ):
+
+    engines = {}
+
+    for backend in BACKENDS:
+        engines['backend-' + backend] = ( lambda case : True, lambda case, backend=backend : run_simulation_backend ( **case, backend=backend ), False )
+
+    engines['batch']              = ( lambda case : True, lambda case : run_batch ( case ).get_dataset ( 0 ), False )
+    engines['batch-summary']      = ( lambda case : True, lambda case : run_batch ( case, summary_only=True ).get_summary ( 0 ), True )
+    engines['batch-resume']       = ( lambda case : case['tmax'] > 1, run_resumed, True )
+    engines['policy-resume']      = ( is_policy, run_policy_resumed, True )
+    engines['batch-fast-forward'] = ( lambda case : True, lambda case : run_batch ( case, summary_only=True, fast_forward=FAST_FORWARD_TOLERANCE ).get_summary ( 0 ), True )
+    engines['meta']               = ( is_plain, run_meta, False )
+    engines['age']                = ( is_plain, run_age, False )
+
+    return engines
+
+# largest error of a dataset or a summary against the reference (see above)
+
+def get_dataset_error ( dataset, reference ):
+
+    error = 0
+    slack = {}
+
+    for k, ( values, expected ) in enumerate(zip(dataset, reference)):
+        values   = numpy.asarray(values, dtype=float)
+        expected = numpy.asarray(expected, dtype=float)
+
+        difference = numpy.abs(values - expected)
+        if k in ROUNDED_SERIES:
+            boundary   = numpy.abs(difference - 1) < 1e-6
+            difference = numpy.where(boundary, 0, difference)
+            slack[ROUNDED_SERIES[k]] = numpy.cumsum(boundary)
+        if k in slack:
+            difference = numpy.maximum(difference - slack[k], 0)
+
+        error = max(error, difference.max() / max(1, numpy.abs(expected).max()))
+
+    return error
+
+def get_summary_error ( summary, reference ):
+
+    error = 0
+
+    for name in SUMMARY_NAMES:
+        if name.endswith('_day'):
+            error = max(error, 0 if summary[name] == reference[name] else float('inf'))
+        else:
+            error = max(error, abs(summary[name] - reference[name]) / max(1, abs(reference[name])))
+
+    return error
+
+def main ( argv ):
+
+    parser = argparse.ArgumentParser(description='Check every engine against run_simulation_web on a corpus of parameter sets.')
+    parser.add_argument('-n', '--random', type=int, default=40, help='number of random draws')
+    parser.add_argument('-s', '--seed', type=int, default=1, help='seed of the random draws')
+    parser.add_argument('-e', '--engine', action='append', default=[], help='engine to check (all by default), may be repeated')
+    parser.add_argument('-o', '--output', help='JSON file for the report')
+
+    args = parser.parse_args(argv)
+
+    cases   = get_app_cases ( ) + get_readme_cases ( ) + get_edge_cases ( ) + get_random_cases ( args.random, args.seed )
+    engines = get_engines ( )
+    names   = args.engine if len(args.engine) > 0 else list(engines)
+
+    for name in names:
+        if name not in engines:
+            print('unknown engine:', name, 'available:', ', '.join(engines))
+            return 1
+
+    report   = { name : { 'cases' : 0, 'skipped' : 0, 'error' : 0, 'tolerance' : TOLERANCES.get(name, EXACT_TOLERANCE), 'seconds' : 0 } for name in [ 'reference' ] + names }
+    failures = []
+
+    for case_name, case in cases:
+        start     = time.perf_counter()
+        reference = viraly.run_simulation_web ( **case )
+        report['reference']['seconds'] += time.perf_counter() - start
+        report['reference']['cases']   += 1
+
+        reference_summary = get_summary_from_dataset ( reference, case['M'] )
+
+        for name in names:
+            supports, run, summary = engines[name]
+            if not supports ( case ):
+                report[name]['skipped'] += 1
+                continue
+
+            start  = time.perf_counter()
+            result = run ( case )
+            report[name]['seconds'] += time.perf_counter() - start
+            report[name]['cases']   += 1
+
+            error = get_summary_error ( result, reference_summary ) if summary else get_dataset_error ( result, reference )
+            report[name]['error'] = max(report[name]['error'], error)
+            if not error <= report[name]['tolerance']:
+                failures.append(( name, case_name, error ))
+
+    print(SEP_COLUMNS.join([ 'engine', 'cases', 'skipped', 'max error', 'tolerance', 'total s', 'per case ms' ]))
+    for name, row in report.items():
+        print(SEP_COLUMNS.join([ name, str(row['cases']), str(row['skipped']), '{:.2e}'.format(row['error']), '{:.0e}'.format(row['tolerance']),
+                                 '{:.3f}'.format(row['seconds']), '{:.3f}'.format(1000 * row['seconds'] / max(1, row['cases'])) ]))
+
+    print('failures:', len(failures))
+    for name, case_name, error in failures:
+        print('  ' + name + ': ' + case_name + ' (error {:.2e})'.format(error))
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump({ 'engines' : report, 'failures' : [ list(failure) for failure in failures ] }, output, indent=1)
+
+    return 1 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,33 +1,36 @@
+import os
+import sys
 import math
 import numpy
-from scipy.special import lambertw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from viraly_analytic import get_lambertw, get_growth_rate
 
 # parameters for R
 increment = 0.005
 limit = 1.5
 base = 1 + increment
-current = base
-
-# increment the current value of R until the limit is reached
-while current < limit:
-    argument = - current / math.exp(current)
-    lambert = numpy.real(lambertw(argument))
 
-    # the exacti value for lambda * T
-    value = current + lambert
+# all the values of R until the limit is reached
+current = numpy.arange(base, limit, increment)
 
-    ## estimations for lambda * T
+argument = - current / numpy.exp(current)
+lambert  = get_lambertw(argument)
 
-    # this estimation was empirical at first but it is also an agressive simplification of the estimation below
-    estimation  = (current-1)*2
+# the exact value for lambda * T
+value = get_growth_rate(current, 1)
 
-    # this estimation comes from https://link.springer.com/article/10.1007/s10444-017-9530-3 , equation 3
-    estimation2 = current - 1 + math.sqrt(2)*math.sqrt(1 + math.exp(1)*argument)
+## estimations for lambda * T
 
-    ratio  = estimation / value
-    ratio2 = estimation2 / value
+# this estimation was empirical at first but it is also an agressive simplification of the estimation below
+estimation  = (current-1)*2
 
-    print( current, estimation, estimation2, lambert, value, ratio, ratio2 )
+# this estimation comes from https://link.springer.com/article/10.1007/s10444-017-9530-3 , equation 3
+estimation2 = current - 1 + math.sqrt(2)*numpy.sqrt(1 + math.exp(1)*argument)
 
-    current = current + increment
+ratio  = estimation / value
+ratio2 = estimation2 / value
 
+for row in zip(current, estimation, estimation2, lambert, value, ratio, ratio2):
+    print( *row )
@@ -0,0 +1,100 @@
+import io
+import os
+import sys
+import glob
+import runpy
+import inspect
+import contextlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import viraly
+
+# the web apps as the scripts of util/ run them: headless (bokeh must be installed, there is no server nor
+# browser), from their own directory and with their terminal output silenced; loading an app records the first
+# call of run_simulation_web and, optionally, of the get_data of the app, which have the parameters of its
+# default widget values
+
+# apps whose get_data does not run a simulation over days (they do not call run_simulation_web)
+SKIPPED_APPS = [ 'viral-sensitivity.py' ]
+
+# column separator of the reports of the scripts
+SEP_COLUMNS = ' ; '
+
+# the given app files or every app of web/, as absolute paths, without the skipped ones
+
+def get_app_paths ( apps = None, skipped = SKIPPED_APPS ):
+
+    paths = apps if apps else sorted(glob.glob(os.path.join(ROOT, 'web', 'viral*.py')))
+
+    return [ os.path.abspath(path) for path in paths if os.path.basename(path) not in skipped ]
+
+# whether bokeh is installed (the apps need it), saying what is skipped otherwise
+
+def has_bokeh ( skipped ):
+
+    try:
+        import bokeh
+    except ImportError:
+        print('bokeh is not installed, ' + skipped + ' skipped')
+        return False
+
+    return True
+
+# runs an app on the current bokeh document; returns its namespace, the first run_simulation_web call as
+# ( args, kwargs ) and, with get_data = True, the arguments of the first call of its get_data (None for a call
+# that did not happen)
+
+def load_app ( path, get_data = False ):
+
+    simulations = []
+    data_calls  = []
+    original    = viraly.run_simulation_web
+
+    def record_simulation ( *args, **kwargs ):
+        if len(simulations) == 0:
+            simulations.append(( args, kwargs ))
+        return original ( *args, **kwargs )
+
+    # get_data is defined by the app itself, so its calls are caught with a profile hook
+    def record_get_data ( frame, event, arg ):
+        if event == 'call' and len(data_calls) == 0 and frame.f_code.co_name == 'get_data' and frame.f_code.co_filename == path:
+            data_calls.append(dict(frame.f_locals))
+
+    # the apps import run_simulation_web from viraly when they are loaded
+    viraly.run_simulation_web = record_simulation
+    cwd = os.getcwd()
+    if get_data:
+        sys.setprofile(record_get_data)
+    try:
+        os.chdir(os.path.dirname(path))
+        # the apps print their CLI strings
+        with contextlib.redirect_stdout(io.StringIO()):
+            namespace = runpy.run_path(path, run_name='bokeh_app')
+    finally:
+        if get_data:
+            sys.setprofile(None)
+        os.chdir(cwd)
+        viraly.run_simulation_web = original
+
+    simulation = simulations[0] if len(simulations) > 0 else None
+    data_call  = data_calls[0] if len(data_calls) > 0 else None
+
+    return namespace, simulation, data_call
+
+# the keyword arguments of a run_simulation_web call, with the engine configuration turned into the explicit
+# prefer_mod4 and erlang arguments (the ones that select the model)
+
+def get_simulation_params ( simulation ):
+
+    args, kwargs = simulation
+    params = dict(inspect.signature(viraly.run_simulation_web).bind(*args, **kwargs).arguments)
+
+    config = params.pop('config', viraly.DEFAULT_CONFIG)
+    params.pop('silent', None)
+    for option in [ 'prefer_mod4', 'erlang' ]:
+        if params.get(option) is None:
+            params[option] = getattr(config, option)
+
+    return params
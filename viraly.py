@@ -6,9 +6,14 @@ import scipy.stats
 import numpy
 import json
 import math
+import bisect
+import functools
+import dataclasses
+import importlib
 import matplotlib.pyplot as plt 
 from distutils.util import strtobool
 from collections import deque
+from viraly_profile import Profiler, PROFILE_FILE
 
 # misc parameters
 E_OK  = 0
@@ -24,13 +29,77 @@ PREFER_MOD4 = False
 # shall we output the other models to the terminal?
 OUTPUT_ALL = False
 
+# engine configuration: which model runs and what goes to the terminal
+# it is immutable and the engines take it as an argument (explicit arguments such as prefer_mod4 take precedence
+# over it), so runs on many threads can share a configuration without any module level state being changed
+#
+# prefer_mod4 - model 4 instead of model 3
+# erlang      - model 5 (run_simulation_web only, prefer_mod4 is then ignored)
+# output_all  - print the exponential and logistic models too (run_simulation only)
+# silent      - no terminal output nor plots
+# profiler    - a viraly_profile.Profiler that times the phases of the runs (None, the default, costs nothing)
+#               the profiler is the one member that changes (it accumulates the runs), and it is thread safe
+
+@dataclasses.dataclass(frozen=True)
+class EngineConfig:
+
+    prefer_mod4 : bool = PREFER_MOD4
+    erlang      : bool = False
+    output_all  : bool = OUTPUT_ALL
+    silent      : bool = True
+    profiler    : object = None
+
+DEFAULT_CONFIG = EngineConfig()
+
+# names of the parameters accepted on the comma separated CLI string, in order
+PARAM_NAMES = [ 'h', 'p', 'T', 'L', 'I', 'h2', 'p2', 'tint', 'tmax', 'M', 'N0', 'DR', 'progressive', 'ttime', 'h3', 'p3', 'tint2', 'ttime2', 'prefer_mod4' ]
+
+# extra run_simulation_web parameters which are only available to external tools
+# I0 is the number of pre immunized, ddy, saa and bat are the seasonal / baseline attenuation parameters
+# erlang selects model 5, ton, toff, twin are the adaptive trigger thresholds and window and schedule is an
+# N-stage schedule (see Schedule) which replaces the stages of h, p, h2, p2, ... when given
+PARAM_NAMES_WEB = PARAM_NAMES + [ 'I0', 'ddy', 'saa', 'bat', 'erlang', 'ton', 'toff', 'twin', 'schedule' ]
+
+# subcommands: name -> ( module, main function ), the main function takes the remaining arguments
+SUBCOMMANDS = { 'sweep' : ( 'viraly_sweep', 'main_sweep' ),
+                'fit'   : ( 'viraly_fit',   'main_fit'   ),
+                'sensitivity' : ( 'viraly_sensitivity', 'main_sensitivity' ),
+                'policy'      : ( 'viraly_policy', 'main_policy' ) }
+
+# incubation period distributions, see get_incubation_kernel
+INCUBATION_DISTRIBUTIONS = [ 'fixed', 'gamma', 'lognormal', 'pmf' ]
+
+# probability mass that is left out of the delay kernels of the continuous distributions (incubation, burden)
+DELAY_TAIL = 1e-9
+
+# incidence of the adaptive triggers: new cases of the last INCIDENCE_WINDOW days (default) per INCIDENCE_UNIT people
+INCIDENCE_WINDOW = 14
+INCIDENCE_UNIT   = 100000
+
+# transitions between the breakpoints of a Schedule
+SCHEDULE_TRANSITIONS = [ 'constant', 'linear', 'smooth' ]
+
+# entries of each of the caches of kernels and schedules: plenty for the values that a session goes through,
+# while keeping a long running bokeh serve process, where every slider move can add an entry, in bounded memory
+CACHE_SIZE = 256
+
+# keys of the summary returned by run_simulation_web in summary_only mode
+SUMMARY_NAMES = [ 'peak_day', 'peak_active', 'total_transmissions', 'total_deaths', 'final_susceptible', 'rt_day' ]
+
 ### functions ###
 
 def print_usage ():
     basename = os.path.basename(sys.argv[0])
     print()
     print( 'Usage:\n\npython3 ' + basename + ' \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR\"')
-    print( 'python3 ' + basename + ' \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,progressive,ttime\"\n')
+    print( 'python3 ' + basename + ' \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,progressive,ttime\"')
+    print( 'python3 ' + basename + ' \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,schedule=day:h:p[:transition];...\"')
+    print( 'python3 ' + basename + ' sweep [options] \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,...\"  (see ' + basename + ' sweep --help)')
+    print( 'python3 ' + basename + ' fit   [options] \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,...\"  (see ' + basename + ' fit --help)')
+    print( 'python3 ' + basename + ' sensitivity [options] \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,...\"  (see ' + basename + ' sensitivity --help)')
+    print( 'python3 ' + basename + ' policy [options] \"h,p,T,L,I,h2,p2,tint,tmax,M,N0,DR,...\"  (see ' + basename + ' policy --help)')
+    print( 'python3 ' + basename + ' --profile[=FILE] ...  (any of the above, with a phase report and collapsed stacks, ' + PROFILE_FILE + ' by default;')
+    print( '                                    with sweep only the parent process is profiled, not the pool workers)\n')
 
 # An empiric seasonal attenuation function that takes the following parameters:
 # time - present day
@@ -121,17 +190,47 @@ def get_older_model4 ( time, history, M, T, L ):
 
     return count
 
-# common to models 3 and 4
+# model 5 - temporary infection with an Erlang (discrete gamma) duration of average T and stdev L, finite population corrections
+#
+# the infected go through a chain of k stages and leave each stage with a daily probability r = k/T (linear chain trick)
+# each stage takes 1/r days on average with variance (1 - r)/r^2, so the whole chain has average T and variance
+# T^2/k - T, which gives k = T^2/(L^2 + T); k is limited to [1, T] so that r <= 1
+# for L = 0 we get k = T and r = 1, every stage takes exactly one day and this is model 3
+#
+# unlike model 4 there is no scan of the history: each day costs O(k) and there is no residue of infections
+
+def get_erlang_stages ( T, L ):
+
+    k = round ( T*T / (L*L + T) )
+    k = min ( max ( k, 1 ), T )
+
+    return k, k / T
+
+# stages holds the cases on each stage of the chain and is updated in place, the outgoing cases are returned
+
+def get_older_model5 ( stages, rate ):
+
+    moving = stages * rate
+
+    stages     -= moving
+    stages[1:] += moving[:-1]
+
+    return float(moving[-1])
+
+# common to models 3, 4 and 5
 # ddy is day of the year, saa is seasonal attenuation amplitude, bat is the baseline attenuation
-def get_next_model34 ( current, h, p, time, nc_history, m, M, T, L, gaussian = False, ddy = 0, saa = 0, bat = 0):
+# erlang is None or the ( stages, rate ) of model 5, in which case gaussian is ignored
+def get_next_model34 ( current, h, p, time, nc_history, m, M, T, L, gaussian = False, ddy = 0, saa = 0, bat = 0, erlang = None):
 
     # we get the outgoing cases (recoveries, deaths) from the gaussian
     # outgoers are computed from the history of new cases either with
     # a batch recovery after T units of time (gaussian = False) or with
     # a recovery spread over moments controlled by normal distribution of
-    # parameters T and L
+    # parameters T and L, or from the stages of the erlang chain
 
-    if gaussian:
+    if erlang is not None:
+        outgoing = get_older_model5 ( *erlang )
+    elif gaussian:
         outgoing = get_older_model4 ( time, nc_history, M, T, L )
     else:
         outgoing = get_older_model3 ( time, nc_history, T )
@@ -242,6 +341,324 @@ def get_parameters ( h, p, h2, p2, t, tint, progressive = False, delta = 14, h3
             #print ("debug:", t, h2, p2, h2*p2, 'contention')
             return h2,p2
 
+# cached helpers for engines that precompute what run_simulation_web evaluates day by day
+
+# recovery kernel: k[d] is the fraction of the new cases of a given day that go out d days later (k[0] = 0),
+# which is exactly what get_older_model3 and get_older_model4 apply to the history of new cases (and what the
+# stages of get_older_model5 add up to, up to the truncation at size);
+# trailing zeros are dropped so the kernel size is the maximum delay that matters (at most size - 1)
+# the returned array is shared between callers and therefore read only
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_recovery_kernel ( T, L, gaussian, size, erlang = False ):
+
+    kernel = numpy.zeros(size)
+
+    if erlang:
+        # negative binomial: the sum of the k geometric stage durations of model 5
+        k, rate = get_erlang_stages ( T, L )
+        d = numpy.arange(k, size)
+        kernel[k:] = scipy.stats.nbinom.pmf( d - k, k, rate )
+    elif gaussian:
+        if L == 0:
+            L_effective = 1
+        else:
+            L_effective = L
+        d = numpy.arange(1, size)
+        kernel[1:] = scipy.stats.norm.cdf( d, T, L_effective ) - scipy.stats.norm.cdf( d - 1, T, L_effective )
+    elif T < size:
+        kernel[T] = 1
+
+    nonzero = numpy.nonzero(kernel)[0]
+    if len(nonzero) > 0:
+        kernel = kernel[0:nonzero[-1] + 1]
+    else:
+        kernel = kernel[0:1]
+
+    kernel.setflags(write=False)
+
+    return kernel
+
+# incubation kernel: q[d] is the fraction of the cases exposed on a given day that become infectious d days later
+#
+# incubation is a tuple (so that it can be cached) with one of the INCUBATION_DISTRIBUTIONS:
+#   ( 'fixed', )              - every case takes I - 1 days, as the incubator deque of run_simulation_web
+#   ( 'gamma', stdev )        - discretized gamma with average I - 1 days and the given standard deviation
+#   ( 'lognormal', stdev )    - likewise for a lognormal
+#   ( 'pmf', q0, q1, ... )    - empirical probabilities of becoming infectious 0, 1, ... days later (I is ignored)
+#
+# the continuous distributions are discretized with q[d] = F(d + 1/2) - F(d - 1/2) (q[0] = F(1/2)), the kernel is
+# cut where less than DELAY_TAIL is left (or at size) and normalized so that no case is lost
+# the returned array is shared between callers and therefore read only
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_incubation_kernel ( I, incubation, size ):
+
+    distribution = incubation[0]
+    mean         = I - 1
+
+    if distribution not in INCUBATION_DISTRIBUTIONS:
+        raise ValueError('incubation distribution must be one of ' + str(INCUBATION_DISTRIBUTIONS))
+
+    if distribution == 'pmf':
+        kernel = numpy.array(incubation[1:size + 1], dtype=float)
+        if kernel.sum() <= 0:
+            raise ValueError('incubation probabilities must not all be zero')
+        kernel = kernel / kernel.sum()
+        kernel.setflags(write=False)
+        return kernel
+
+    if distribution == 'fixed':
+        return get_delay_kernel ( 'fixed', mean, 0, size )
+
+    return get_delay_kernel ( distribution, mean, incubation[1], size )
+
+# delay kernel: discretized distribution of a delay of the given average and standard deviation, in days
+# distribution is 'fixed', 'gamma' or 'lognormal' (a zero average or standard deviation gives a fixed delay)
+# shared by the incubation kernels and the downstream burden (viraly_burden.py); read only, as the other kernels
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_delay_kernel ( distribution, mean, stdev, size ):
+
+    if distribution == 'fixed' or mean <= 0 or stdev <= 0:
+        kernel = numpy.zeros(int(round(mean)) + 1)
+        kernel[-1] = 1
+        kernel.setflags(write=False)
+        return kernel
+
+    if distribution == 'gamma':
+        shape  = mean*mean / (stdev*stdev)
+        frozen = scipy.stats.gamma( shape, scale=mean / shape )
+    else:
+        sigma2 = math.log ( 1 + stdev*stdev / (mean*mean) )
+        frozen = scipy.stats.lognorm( math.sqrt(sigma2), scale=math.exp( math.log(mean) - sigma2 / 2 ) )
+
+    edges  = numpy.arange(0, size) + 0.5
+    cdf    = frozen.cdf(edges)
+    kernel = numpy.diff(numpy.concatenate([ [ 0 ], cdf ]))
+    kernel = kernel[0:max(1, numpy.searchsorted(cdf, 1 - DELAY_TAIL) + 1)]
+
+    kernel = kernel / kernel.sum()
+    kernel.setflags(write=False)
+
+    return kernel
+
+# parameter schedule: the h and p values that the recurrence of run_simulation_web uses on each day
+# index t holds the values used on day t ( index 0 holds the initial values )
+# note: get_parameters is fed with its own previous output, so the progressive transitions are replicated as they are
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax ):
+
+    h_schedule = numpy.zeros(tmax + 1)
+    p_schedule = numpy.zeros(tmax + 1)
+
+    h_schedule[0] = h
+    p_schedule[0] = p
+
+    for t in range (1, tmax + 1):
+        h_schedule[t] = h
+        p_schedule[t] = p
+        h, p = get_parameters( h,p, h2, p2, t, tint, progressive, ttime, h3, p3, tint2, ttime2)
+
+    h_schedule.setflags(write=False)
+    p_schedule.setflags(write=False)
+
+    return h_schedule, p_schedule
+
+# every branch of get_parameters is linear on the stage values, so for given stage times the schedule of h
+# (and likewise of p) is basis @ ( h, h2, h3 ); the basis only depends on the stage times and is shared by
+# all the scenarios that differ only on the stage values
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_schedule_basis ( tint, progressive, ttime, tint2, ttime2, tmax ):
+
+    basis = numpy.zeros((tmax + 1, 3))
+
+    for k in range(0, 3):
+        unit = [ 0, 0, 0 ]
+        unit[k] = 1
+        basis[:, k], p_schedule = get_schedule ( unit[0], unit[0], unit[1], unit[1], tint, progressive, ttime, unit[2], unit[2], tint2, ttime2, tmax )
+
+    basis.setflags(write=False)
+
+    return basis
+
+# N-stage parameter schedule: a sorted list of breakpoints ( day, h, p, transition ) where the transition, one
+# of SCHEDULE_TRANSITIONS, is how the values go from the breakpoint to the next one:
+#   constant - the values of the breakpoint are kept until the next one
+#   linear   - linear interpolation to the values of the next breakpoint
+#   smooth   - smoothstep interpolation (3x^2 - 2x^3), with no slope jumps at the breakpoints
+# the values of the first breakpoint hold before it and the ones of the last breakpoint hold after it
+# as on get_schedule, the values of day t are the ones that the recurrence uses on day t
+#
+# get gives the values of a day with a binary search on the breakpoints, compile gives the dense arrays of
+# every day up to tmax (read only, from the cache of compile_schedule); schedules are immutable and hashable
+# the string form is day:h:p[:transition] items separated by ; (ex: 0:10:0.046;30:10:0.046:linear;44:4:0.03)
+
+class Schedule:
+
+    def __init__ ( self, breakpoints ):
+
+        items = []
+        for breakpoint in breakpoints:
+            transition = breakpoint[3] if len(breakpoint) > 3 else 'constant'
+            if transition not in SCHEDULE_TRANSITIONS:
+                raise ValueError('schedule transition must be one of ' + str(SCHEDULE_TRANSITIONS))
+            items.append(( int(breakpoint[0]), float(breakpoint[1]), float(breakpoint[2]), transition ))
+
+        if len(items) == 0:
+            raise ValueError('schedule needs at least one breakpoint')
+
+        items.sort(key=lambda item: item[0])
+
+        self.days        = tuple([ item[0] for item in items ])
+        self.h           = tuple([ item[1] for item in items ])
+        self.p           = tuple([ item[2] for item in items ])
+        self.transitions = tuple([ item[3] for item in items ])
+
+        if len(set(self.days)) != len(self.days):
+            raise ValueError('schedule breakpoints must be on different days')
+
+    def __eq__ ( self, other ):
+
+        return isinstance(other, Schedule) and self.get_key() == other.get_key()
+
+    def __hash__ ( self ):
+
+        return hash(self.get_key())
+
+    def __str__ ( self ):
+
+        items = []
+        for day, h, p, transition in zip(self.days, self.h, self.p, self.transitions):
+            item = '{}:{}:{}'.format(day, h, p)
+            if transition != 'constant':
+                item = item + ':' + transition
+            items.append(item)
+
+        return SEP.join(items)
+
+    def get_key ( self ):
+
+        return ( self.days, self.h, self.p, self.transitions )
+
+    # weight of the next breakpoint at the fraction x of the way to it
+
+    def get_weight ( self, transition, x ):
+
+        if transition == 'linear':
+            return x
+
+        if transition == 'smooth':
+            return x*x*(3 - 2*x)
+
+        return 0*x
+
+    # h and p of day t
+
+    def get ( self, t ):
+
+        k = bisect.bisect_right(self.days, t) - 1
+
+        if k < 0:
+            return self.h[0], self.p[0]
+
+        if k == len(self.days) - 1 or self.transitions[k] == 'constant':
+            return self.h[k], self.p[k]
+
+        w = self.get_weight ( self.transitions[k], (t - self.days[k]) / (self.days[k + 1] - self.days[k]) )
+
+        return self.h[k] + w*(self.h[k + 1] - self.h[k]), self.p[k] + w*(self.p[k + 1] - self.p[k])
+
+    # h and p of every day from 0 to tmax, as on get_schedule
+
+    def compile ( self, tmax ):
+
+        return compile_schedule ( self, tmax )
+
+# dense arrays of a Schedule (see Schedule.compile), cached per schedule and tmax and read only
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile_schedule ( schedule, tmax ):
+
+    t    = numpy.arange(0, tmax + 1)
+    days = numpy.array(schedule.days)
+    last = len(days) - 1
+
+    k = numpy.clip(numpy.searchsorted(days, t, side='right') - 1, 0, last)
+    x = numpy.zeros(tmax + 1)
+    w = numpy.zeros(tmax + 1)
+
+    inside    = (t >= days[k]) & (k < last)
+    x[inside] = (t[inside] - days[k[inside]]) / (days[k[inside] + 1] - days[k[inside]])
+
+    for transition in SCHEDULE_TRANSITIONS:
+        selected    = inside & (numpy.array(schedule.transitions)[k] == transition)
+        w[selected] = schedule.get_weight ( transition, x[selected] )
+
+    h_values = numpy.array(schedule.h)
+    p_values = numpy.array(schedule.p)
+    k_next   = numpy.minimum(k + 1, last)
+
+    h_schedule = h_values[k] + w*(h_values[k_next] - h_values[k])
+    p_schedule = p_values[k] + w*(p_values[k_next] - p_values[k])
+
+    h_schedule.setflags(write=False)
+    p_schedule.setflags(write=False)
+
+    return h_schedule, p_schedule
+
+# schedule from its string form (see Schedule), cached so that the same string gives the same compiled schedule
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_schedule_from_string ( schedule_str ):
+
+    breakpoints = []
+
+    for item in schedule_str.split(SEP):
+        fields = item.strip().split(':')
+        if len(fields) not in [ 3, 4 ]:
+            raise ValueError('invalid schedule breakpoint: ' + item)
+        breakpoints.append(( int(fields[0]), float(fields[1]), float(fields[2]) ) + tuple(fields[3:]))
+
+    return Schedule ( breakpoints )
+
+# a Schedule given as such or in its string form (None is kept)
+
+def get_schedule_object ( schedule ):
+
+    if schedule is None or isinstance(schedule, Schedule):
+        return schedule
+
+    return get_schedule_from_string ( str(schedule) )
+
+# the 3-stage schedule of get_parameters as a Schedule, one constant breakpoint on each change of the values,
+# so that it compiles to exactly the arrays of get_schedule (the progressive transitions included)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax ):
+
+    h_schedule, p_schedule = get_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
+
+    changes = numpy.flatnonzero((numpy.diff(h_schedule) != 0) | (numpy.diff(p_schedule) != 0)) + 1
+    days    = [ 0 ] + changes.tolist()
+
+    return Schedule ( [ ( day, h_schedule[day], p_schedule[day] ) for day in days ] )
+
+# the schedule typed on a web app, in its string form: ( Schedule, None ), ( None, None ) when there is none
+# (the app runs its stages) or ( None, error ) when it is not valid
+
+def get_schedule_input ( schedule_str ):
+
+    if schedule_str is None or schedule_str.strip() == '':
+        return None, None
+
+    try:
+        return get_schedule_from_string ( schedule_str.strip() ), None
+    except ValueError as error:
+        return None, str(error)
+
 # plotting
 
 # data is a list of lists of data
@@ -290,9 +707,40 @@ def print_output ( t, x1, x2, x3_data, x4_data , prefer_x4 = False, output_all =
     else:
         print (t, SEP, x_data[0], SEP, x_data[1], SEP, x_data[2], SEP, x_data[3], SEP, x_data[4])
 
+# running sums of a history, as a list (the value of day j is the sum of the days 0 to j)
+
+def get_accumulated ( history ):
+
+    return list(numpy.cumsum(history))
+
+# runs an engine under the profiler of its configuration, if there is one and it is not already running
+
+def profiled ( engine ):
+
+    @functools.wraps(engine)
+    def run_engine ( *args, **kwargs ):
+
+        profiler = kwargs.get('config', DEFAULT_CONFIG).profiler
+        if profiler is None or profiler.active:
+            return engine ( *args, **kwargs )
+
+        return profiler.run ( engine, *args, **kwargs )
+
+    return run_engine
+
 # main simulation function
 
-def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4 = PREFER_MOD4 ):
+@profiled
+def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent = None, prefer_mod4 = None, schedule = None, config = DEFAULT_CONFIG ):
+
+    silent      = config.silent if silent is None else silent
+    prefer_mod4 = config.prefer_mod4 if prefer_mod4 is None else prefer_mod4
+
+    # an N-stage schedule replaces the stages
+    schedule = get_schedule_object ( schedule )
+    if schedule is not None:
+        h_schedule, p_schedule = schedule.compile ( tmax )
+        h, p = float(h_schedule[0]), float(p_schedule[0])
 
     # initial infections
     n1 = N0
@@ -341,10 +789,12 @@ def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive,
     sp = p
 
     # initial situation
-    print_output (0, n1, n2, n3_data, n4_data, prefer_mod4, OUTPUT_ALL, silent )
+    print_output (0, n1, n2, n3_data, n4_data, prefer_mod4, config.output_all, silent )
 
     # we simulate tmax days, but the result contains the extra initial condition day at position 0
     for t in range (1, tmax + 1):
+        if schedule is not None:
+            h, p = float(h_schedule[t]), float(p_schedule[t])
         # get new cases for the dummy models (new cases = active cases as there are no outgoers here)
         n1 = get_next_model1 (n1, h, p, M)
         n2 = get_next_model2 (n2, h, p, M)
@@ -352,7 +802,8 @@ def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive,
         nc3i, o3, rt3 = get_next_model34 (n3, h, p, t, nc3_history, m3, M, T, L, False)
         nc4i, o4, rt4 = get_next_model34 (n4, h, p, t, nc4_history, m4, M, T, L, True)
         # update simulation parameters over time
-        h, p = get_parameters( h,p, h2, p2, t, tint, progressive, ttime, h3, p3, tint2, ttime2)
+        if schedule is None:
+            h, p = get_parameters( h,p, h2, p2, t, tint, progressive, ttime, h3, p3, tint2, ttime2)
 
         # but nc3i and nc4i go for incubation still and we need to fetch the ones that are ready to infect
         # in the SIER model incubation cases are called "Exposed" - they are infected but not infectious
@@ -395,7 +846,7 @@ def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive,
 
         n3_data = [ n3, nc3, o3, m3, rt3 ]
         n4_data = [ n4, nc4, o4, m4, rt4 ]
-        print_output (t, n1, n2, n3_data, n4_data, prefer_mod4, OUTPUT_ALL, silent )
+        print_output (t, n1, n2, n3_data, n4_data, prefer_mod4, config.output_all, silent )
 
     # deaths vs recoveries
 
@@ -437,19 +888,9 @@ def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive,
 
     # prepare some acumulated data
 
-    j = 1
-    na_history = []
-    da_history = []
-    ra_history = []
-
-    for value in n_history:
-        na = numpy.array(nc_history[0:j]).sum()
-        da = numpy.array(d_history[0:j]).sum()
-        ra = numpy.array(r_history[0:j]).sum()
-        na_history.append(na)
-        da_history.append(da)
-        ra_history.append(ra)
-        j=j+1
+    na_history = get_accumulated ( nc_history )
+    da_history = get_accumulated ( d_history )
+    ra_history = get_accumulated ( r_history )
 
     # plot time
 
@@ -511,8 +952,30 @@ def run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive,
 
 # optimized version only to be used by the web interface:
 # runs model 4 and is silent
+#
+# with erlang = True model 5 is used instead (prefer_mod4 is ignored); both default to the ones of config
+#
+# incubation selects a distributed incubation period (see get_incubation_kernel), which is applied as an online
+# convolution over the exposed cases; the default is the fixed I - 1 days of the incubator deque
+#
+# with ton > 0 the stages follow an adaptive trigger instead of tint, tint2 and the transitions: h2, p2 apply
+# from the day after the incidence of the last twin days (per INCIDENCE_UNIT people) reaches ton until the day
+# after it drops to toff or below, and h, p apply otherwise; the incidence is a running sum, O(1) per day
+#
+# with summary_only = True the per day histories are not kept (except for the new cases, which the
+# recurrence needs) and a dictionary with the keys in SUMMARY_NAMES is returned instead of the dataset
+
+@profiled
+def run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent = None, prefer_mod4 = None, I0 = 0, ddy = 0, saa = 0, bat = 0, summary_only = False, erlang = None, incubation = None, ton = 0, toff = 0, twin = INCIDENCE_WINDOW, schedule = None, config = DEFAULT_CONFIG ):
 
-def run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent = True, prefer_mod4 = PREFER_MOD4, I0 = 0, ddy = 0, saa = 0, bat = 0 ):
+    prefer_mod4 = config.prefer_mod4 if prefer_mod4 is None else prefer_mod4
+    erlang      = config.erlang if erlang is None else erlang
+
+    # an N-stage schedule replaces the stages (the adaptive triggers take precedence, as over the stage times)
+    schedule = get_schedule_object ( schedule ) if ton <= 0 else None
+    if schedule is not None:
+        h_schedule, p_schedule = schedule.compile ( tmax )
+        h, p = float(h_schedule[0]), float(p_schedule[0])
 
     n4 = N0
     i4 = I0 + N0
@@ -524,6 +987,15 @@ def run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressi
     # fifos for cases in incubation
     incubator4 = deque([0]*(I-1))
 
+    # or, for a distributed incubation, the cases that become infectious on each of the next K days (ring buffer)
+    if incubation is not None and incubation[0] != 'fixed':
+        q_kernel  = get_incubation_kernel ( I, tuple(incubation), tmax + 1 )
+        q_size    = len(q_kernel)
+        q_offsets = numpy.arange(0, q_size)
+        q_pending = numpy.zeros(q_size)
+    else:
+        q_kernel  = None
+
     # history of outgoing numbers
     o4_history = [ 0 ]
 
@@ -543,20 +1015,52 @@ def run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressi
     # Rt history
     rt4_history = [ R0 ]
 
+    # running values for the summary mode
+    peak_day   = 0
+    peak_value = N0
+    t_deaths   = 0
+    rt_day     = 0 if R0 < 1 else -1
+
+    # stages of the erlang chain of model 5, the initial infections start on the first one
+    chain = None
+    if erlang:
+        k, rate   = get_erlang_stages ( T, L )
+        stages    = numpy.zeros(k)
+        stages[0] = N0
+        chain     = ( stages, rate )
+
+    # adaptive trigger state: free stage values, running sum of the new cases of the window and contention flag
+    h1, p1     = h, p
+    window_sum = N0
+    contained  = False
+
     # we simulate tmax days, but the result contains the extra initial condition day at position 0
     for t in range (1, tmax + 1):
 
+        if schedule is not None:
+            h, p = float(h_schedule[t]), float(p_schedule[t])
+
         # get new cases, outgoing and rt; ddy and ssa are seasonal parameters
-        nc4i, o4, rt4 = get_next_model34 (n4, h, p, t, nc4_history, m4, M, T, L, prefer_mod4, ddy, saa, bat)
+        nc4i, o4, rt4 = get_next_model34 (n4, h, p, t, nc4_history, m4, M, T, L, prefer_mod4, ddy, saa, bat, chain)
         # update simulation parameters over time
-        h, p = get_parameters( h,p, h2, p2, t, tint, progressive, ttime, h3, p3, tint2, ttime2)
+        if ton <= 0 and schedule is None:
+            h, p = get_parameters( h,p, h2, p2, t, tint, progressive, ttime, h3, p3, tint2, ttime2)
 
         # but nc3i and nc4i go for incubation still and we need to fetch the ones that are ready to infect
         # in the SIER model incubation cases are called "Exposed" - they are infected but not infectious
         # note: we need to append before popping to support the case where the incubation time is 1
         # which recovers the tried and tested behaviour we had before introducing this parameter
-        incubator4.appendleft(nc4i)
-        nc4 = incubator4.pop()
+        if q_kernel is None:
+            incubator4.appendleft(nc4i)
+            nc4 = incubator4.pop()
+        else:
+            # the exposed cases of today are spread over the next days, and we collect the ones due today
+            q_pending[(t + q_offsets) % q_size] += nc4i * q_kernel
+            nc4 = float(q_pending[t % q_size])
+            q_pending[t % q_size] = 0
+
+        if erlang:
+            stages[0] += nc4
 
         # new current - it sometimes goes negative by a very small value
         n4 = max(n4 + nc4 - o4,0)
@@ -564,25 +1068,55 @@ def run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressi
         # new cases that appeared at time t
         nc4_history.append(nc4)
 
+        # the adaptive trigger decides the parameters of the next day from the incidence up to today
+        if ton > 0:
+            window_sum = window_sum + nc4
+            if t - twin >= 0:
+                window_sum = window_sum - nc4_history[t - twin]
+            incidence = window_sum * INCIDENCE_UNIT / M
+            if contained:
+                contained = incidence > toff
+            else:
+                contained = incidence >= ton
+            if contained:
+                h, p = h2, p2
+            else:
+                h, p = h1, p1
+
+        # neither the outgoing nor the exposed (i.e. in incubation) are available targets for new infections
+        # but the infected are still causing new infections
+        # note: we remove the cases for the susceptibles pool as soon as they are exposed (nc3i instead of nc3, etc)
+        m4 = max(m4 - nc4i, 0)
+
+        # immunity takes into account the new infected cases that won't die, since they are removed from the pool of susceptibles
+        # immune != recovered, those who don't die will recover later
+        i4 = i4 + nc4i * (1-DR)
+
+        if summary_only:
+            if n4 > peak_value:
+                peak_day   = t
+                peak_value = n4
+            if rt_day < 0 and rt4 < 1:
+                rt_day = t
+            # same rounding as the deaths history below
+            t_deaths = t_deaths + round(o4 * DR)
+            continue
+
         # cases that went out at time t
         o4_history.append(o4)
 
         # number of active cases at time t
         n4_history.append(n4)
 
-        # neither the outgoing nor the exposed (i.e. in incubation) are available targets for new infections
-        # but the infected are still causing new infections
-        # note: we remove the cases for the susceptibles pool as soon as they are exposed (nc3i instead of nc3, etc)
-        m4 = max(m4 - nc4i, 0)
         m4_history.append(m4)
 
         rt4_history.append(rt4)
 
-        # immunity takes into account the new infected cases that won't die, since they are removed from the pool of susceptibles
-        # immune != recovered, those who don't die will recover later
-        i4 = i4 + nc4i * (1-DR)
         i4_history.append(i4)
 
+    if summary_only:
+        return get_summary ( peak_day, peak_value, sum(nc4_history[1:]), t_deaths, m4 / M, rt_day )
+
     # deaths vs recoveries
 
     # we need to round for the limiting immunization cases
@@ -601,96 +1135,91 @@ def run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressi
 
     # prepare some acumulated data
 
-    j = 1
-    na_history = []
-    da_history = []
-    ra_history = []
-
-    for value in n_history:
-        na = numpy.array(nc_history[0:j]).sum()
-        da = numpy.array(d_history[0:j]).sum()
-        ra = numpy.array(r_history[0:j]).sum()
-        na_history.append(na)
-        da_history.append(da)
-        ra_history.append(ra)
-        j=j+1
+    na_history = get_accumulated ( nc_history )
+    da_history = get_accumulated ( d_history )
+    ra_history = get_accumulated ( r_history )
 
     # the list cast is only to uniformized because some of the elements were converted to numpy arrays
     dataset = [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history, i_history ]
 
     return dataset
 
-def main():
+# compact summary of a simulation, as returned by the summary_only mode
+#
+# peak_day, peak_active - day and value of the maximum of active cases
+# total_transmissions   - new cases after the initial condition (as on the stats of the web apps)
+# total_deaths          - total deaths
+# final_susceptible     - fraction of the population which is still susceptible at the end
+# rt_day                - first day on which Rt < 1, or -1 if it never happens
 
-    # the silent mode is for integration with external tools, it only exports dataset
-    silent = False
+def get_summary ( peak_day, peak_active, total_transmissions, total_deaths, final_susceptible, rt_day ):
 
-    # parse input
+    return { 'peak_day' : int(peak_day), 'peak_active' : float(peak_active), 'total_transmissions' : float(total_transmissions), 'total_deaths' : float(total_deaths),
+             'final_susceptible' : float(final_susceptible), 'rt_day' : int(rt_day) }
 
-    if len(sys.argv) < 2:
-        print_usage()
-        exit(E_OK)
+# the same summary computed from a full dataset of run_simulation_web
 
-    if len(sys.argv) > 2:
-        silent=True
+def get_summary_from_dataset ( dataset, M ):
 
-    # simulation parameters
+    n_history  = dataset[0]
+    rt_history = dataset[8]
 
-    # We accept all the CLI arguments in a single comma separated string. Check the documentation for examples.
+    peak_day = int(numpy.argmax(n_history))
+    below    = numpy.nonzero(numpy.array(rt_history) < 1)[0]
+    rt_day   = int(below[0]) if len(below) > 0 else -1
+
+    return get_summary ( peak_day, n_history[peak_day], sum(dataset[1][1:]), dataset[7][-1], dataset[4][-1] / M, rt_day )
+
+# parse the comma separated CLI string into a dictionary of run_simulation_web parameters
+# returns None if there are not enough parameters
+
+def get_params ( myparams_str ):
 
-    myparams_str  = sys.argv[1]
     myparams_list = myparams_str.split(',')
 
-    if len(myparams_list) < 12:
-        print_usage()
-        exit(E_OK)
+    # keyed items (name=value) can go anywhere, only schedule=... (see Schedule) is available for now
+    myoptions_list = [ item for item in myparams_list if '=' in item ]
+    myparams_list  = [ item for item in myparams_list if '=' not in item ]
 
-    h     = float(myparams_list[0])  # average number of contacts per unit of time
-    p     = float(myparams_list[1])  # probability of transmission during a contact
-    T     = int  (myparams_list[2])  # average duration of infection
-    L     = int  (myparams_list[3])  # standard deviation of the normal distribution
-    I     = int  (myparams_list[4])  # incubation time
-    h2    = float(myparams_list[5])  # average number of contacts per unit of time under contention
-    p2    = float(myparams_list[6])  # probability of transmission during a contact under contention
-    tint  = int  (myparams_list[7])  # time with initial parameters (i.e., before contention)
-    tmax  = int  (myparams_list[8])  # total time
-    M     = float(myparams_list[9])  # population size
-    N0    = float(myparams_list[10]) # initial number of infections
-    DR    = float(myparams_list[11]) # death rate
+    if len(myparams_list) < 12:
+        return None
+
+    params = {}
+
+    params['h']     = float(myparams_list[0])  # average number of contacts per unit of time
+    params['p']     = float(myparams_list[1])  # probability of transmission during a contact
+    params['T']     = int  (myparams_list[2])  # average duration of infection
+    params['L']     = int  (myparams_list[3])  # standard deviation of the normal distribution
+    params['I']     = int  (myparams_list[4])  # incubation time
+    params['h2']    = float(myparams_list[5])  # average number of contacts per unit of time under contention
+    params['p2']    = float(myparams_list[6])  # probability of transmission during a contact under contention
+    params['tint']  = int  (myparams_list[7])  # time with initial parameters (i.e., before contention)
+    params['tmax']  = int  (myparams_list[8])  # total time
+    params['M']     = float(myparams_list[9])  # population size
+    params['N0']    = float(myparams_list[10]) # initial number of infections
+    params['DR']    = float(myparams_list[11]) # death rate
 
     if len(myparams_list) > 12:
-        progressive = strtobool(myparams_list[12])
+        params['progressive'] = bool(strtobool(myparams_list[12]))
     else:
-        progressive = False
+        params['progressive'] = False
 
     if len(myparams_list) > 13:
-        ttime = int(myparams_list[13])
+        params['ttime'] = int(myparams_list[13])
     else:
-        ttime = 0
+        params['ttime'] = 0
 
     # bonus: stage 3
     if len(myparams_list) > 17:
-        h3     = float(myparams_list[14])  # average number of contacts per unit of time after contention
-        p3     = float(myparams_list[15])  # probability of transmission during a contact after contention
-        tint2  = int(myparams_list[16])    # time at which we start the second transition
-        ttime2 = int(myparams_list[17])    # x2 -> x3 parameters transition duration
+        params['h3']     = float(myparams_list[14])  # average number of contacts per unit of time after contention
+        params['p3']     = float(myparams_list[15])  # probability of transmission during a contact after contention
+        params['tint2']  = int(myparams_list[16])    # time at which we start the second transition
+        params['ttime2'] = int(myparams_list[17])    # x2 -> x3 parameters transition duration
     else:
-        h3     = 0
-        p3     = 0
-        tint2  = 0
-        ttime2 = 0
-
-    if tint > tmax:
-        print('tint2 must be smaller than', tmax)
-        exit(E_ERR)
-
-    if tint2 > 0 and tint2 > tmax:
-        print('tint2 must be smaller than', tmax)
-        exit(E_ERR)
-
-    if tint2 > 0 and tint2 < tint + ttime:
-        print('tint2 must be greater than', tint, '+', ttime)
-        exit(E_ERR)
+        params['h3']     = 0
+        params['p3']     = 0
+        params['tint2']  = 0
+        params['ttime2'] = 0
 
     # this is another bonus for external tools integration which does not break the historical CLI usage:
     #   we allow the model selection to be done as a function of the value of L:
@@ -699,16 +1228,109 @@ def main():
     #
     # NOTE: model4 is much much slower than model3
 
-    # simulation
     if len(myparams_list) > 18:
-        if L == 0:
-            prefer_mod4 = False
-        else:
-            prefer_mod4 = True
+        params['prefer_mod4'] = params['L'] != 0
     else:
-        prefer_mod4 = PREFER_MOD4
+        params['prefer_mod4'] = DEFAULT_CONFIG.prefer_mod4
+
+    # the N-stage schedule is kept in its string form (it is parsed again, from a cache, by the engines)
+    for item in myoptions_list:
+        name, value = [ x.strip() for x in item.split('=', 1) ]
+        if name != 'schedule':
+            raise ValueError('unknown keyed parameter: ' + name)
+        get_schedule_from_string ( value )
+        params['schedule'] = value
+
+    return params
+
+# check the consistency of the stage times, returns an error string or None
+
+def check_params ( params ):
+
+    tmax  = params['tmax']
+    tint  = params['tint']
+    tint2 = params['tint2']
+    ttime = params['ttime']
+
+    if tint > tmax:
+        return 'tint must be smaller than {}'.format(tmax)
+
+    if tint2 > 0 and tint2 > tmax:
+        return 'tint2 must be smaller than {}'.format(tmax)
+
+    if tint2 > 0 and tint2 < tint + ttime:
+        return 'tint2 must be greater than {} + {}'.format(tint, ttime)
+
+    return None
+
+# removes the --profile[=FILE] option from the arguments, returns the collapsed stack file or None without it
+
+def get_profile_option ( argv ):
+
+    for arg in list(argv[1:]):
+        if arg == '--profile' or arg.startswith('--profile='):
+            argv.remove(arg)
+            path = arg[len('--profile='):]
+            return path if len(path) > 0 else PROFILE_FILE
+
+    return None
+
+def main():
+
+    profile_file = get_profile_option ( sys.argv )
+
+    if profile_file is None:
+        run_main()
+        return
+
+    # the whole run is profiled, the report goes to stderr so that the silent mode output is still a dataset
+    profiler = Profiler()
+    try:
+        profiler.run ( run_main )
+    finally:
+        profiler.write_collapsed ( profile_file )
+        print(profiler.get_report(), file=sys.stderr)
+        print('\ncollapsed stacks written to ' + profile_file, file=sys.stderr)
+
+def run_main ():
+
+    # the silent mode is for integration with external tools, it only exports dataset
+    silent = False
+
+    # parse input
+
+    if len(sys.argv) < 2:
+        print_usage()
+        exit(E_OK)
+
+    # subcommands are handled by their own modules
+    if sys.argv[1] in SUBCOMMANDS:
+        module_name, function_name = SUBCOMMANDS[sys.argv[1]]
+        module = importlib.import_module(module_name)
+        exit(getattr(module, function_name)(sys.argv[2:]))
+
+    if len(sys.argv) > 2:
+        silent=True
+
+    # simulation parameters
+
+    # We accept all the CLI arguments in a single comma separated string. Check the documentation for examples.
+
+    params = get_params ( sys.argv[1] )
+
+    if params is None:
+        print_usage()
+        exit(E_OK)
+
+    error = check_params ( params )
+
+    if error:
+        print(error)
+        exit(E_ERR)
+
+    h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, prefer_mod4 = [ params[name] for name in PARAM_NAMES ]
 
-    dataset = run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4 )
+    dataset = run_simulation ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4, params.get('schedule') )
     #print(dataset)
  
 ### Main block ###
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+# Age structured engine for viraly: age groups coupled by a contact matrix
+#
+# C[a, b] is the number of daily contacts of a person of group a with people of group b. The new exposed
+# cases of group a are
+#
+#   h * p * sigma_a * attenuation * ( C @ ( n / M ) )_a * m_a
+#
+# where sigma_a is the relative susceptibility of the group and h scales the whole contact matrix (h2 and h3
+# on the later stages, as usual). With a single group, C = [[ 1 ]] and sigma = 1 this is the run_simulation_web
+# recurrence (h is already applied to C, so C = [[ h ]] would count it twice). T, L, I, DR, M, N0 and I0 can
+# differ per group, the stage schedule is common to all groups.
+#
+# The Rt of the aggregate is the spectral radius of the next generation matrix (on full runs only, it is not
+# kept on summary only runs), the Rt of each group is the number of cases caused by one of its infectious.
+
+import numpy
+
+from viraly_batch import BatchResult, get_batch_params, get_batch_schedules, get_batch_kernels, get_initial_summary, get_initial_series, get_day_values, get_running_summary, get_final_summary, get_series_summary, check_fixed_stages, BATCH_SERIES
+from viraly_meta import get_total_dataset as get_meta_total_dataset
+
+# parameters which can differ per age group, the others must be scalars
+AGE_PARAMS = [ 'T', 'L', 'I', 'M', 'N0', 'DR', 'I0', 'prefer_mod4', 'erlang' ]
+
+### functions ###
+
+# next generation matrix: K[a, b] is the number of cases of group a caused by one infectious of group b
+
+def get_next_generation ( contacts, susceptibility, T, M, m ):
+
+    return (susceptibility * m)[:, None] * contacts * (T / M)[None, :]
+
+def get_spectral_radius ( K ):
+
+    return float(numpy.max(numpy.abs(numpy.linalg.eigvals(K))))
+
+# run the age groups for tmax days
+#
+# params maps run_simulation_web parameter names to values; the ones in AGE_PARAMS can be sequences with
+# one value per group; contacts is the ( groups x groups ) contact matrix and susceptibility the relative
+# susceptibility of each group (1 by default)
+# the result is a BatchResult with one "scenario" per group and, on full runs, the aggregate Rt on total_rt
+# (None with summary_only); the adaptive triggers and the distributed incubation are not available (ValueError)
+
+def run_simulation_age ( params, contacts, tmax, susceptibility = None, summary_only = False ):
+
+    check_fixed_stages ( params, 'age structured' )
+    params = { name : value for name, value in params.items() if name != 'incubation' }
+
+    contacts = numpy.asarray(contacts, dtype=float)
+    size     = contacts.shape[0]
+
+    if contacts.shape != (size, size):
+        raise ValueError('contact matrix must be square')
+
+    for name, value in params.items():
+        if name not in AGE_PARAMS and numpy.size(value) != 1:
+            raise ValueError('parameter ' + name + ' must be the same on every age group')
+
+    if susceptibility is None:
+        susceptibility = numpy.ones(size)
+    susceptibility = numpy.broadcast_to(numpy.asarray(susceptibility, dtype=float), (size,))
+
+    # all the parameters are broadcast to one value per group
+    group_params = { name : numpy.broadcast_to(value, (size,)) for name, value in params.items() }
+
+    p_ = get_batch_params ( group_params, tmax )
+
+    h_schedules, p_schedules = get_batch_schedules ( p_, tmax )
+    reversed_kernels         = get_batch_kernels ( p_, tmax )
+
+    D     = reversed_kernels.shape[1]
+    every = numpy.arange(0, size)
+
+    M   = p_['M']
+    N0  = p_['N0']
+    T   = p_['T'].astype(float)
+    DR  = p_['DR']
+    ddy = p_['ddy'][0]
+    saa = p_['saa'][0]
+    baf = 1 - p_['bat'][0]
+
+    delay     = p_['I'] - 1
+    E         = max(1, int(delay.max()) + 1)
+    incubator = numpy.zeros((size, E))
+    nc_buffer = numpy.zeros((size, 2*D))
+
+    n = N0.copy()
+    i = p_['I0'] + N0
+    m = numpy.maximum(M - N0 - p_['I0'], 0)
+
+    nc_buffer[:, 0] = N0
+    nc_buffer[:, D] = N0
+
+    K0 = get_next_generation ( contacts, susceptibility, T, M, M ) * h_schedules[0, 0] * p_schedules[0, 0]
+    R0 = K0.sum(axis=0)
+
+    peak_day, peak_value, transmissions, deaths, rt_day = get_initial_summary ( N0, R0 )
+
+    # the eigenvalues are the most expensive part of a day, so the aggregate Rt is left out of summary only runs
+    total_rt = None
+    if not summary_only:
+        series   = get_initial_series ( tmax, N0, m, R0, i )
+        total_rt = numpy.zeros(tmax + 1)
+        total_rt[0] = get_spectral_radius ( K0 )
+
+    for t in range (1, tmax + 1):
+
+        # the schedule is common to all groups
+        h = h_schedules[t, 0]
+        p = p_schedules[t, 0]
+
+        pos      = t % D
+        outgoing = numpy.einsum('ij,ij->i', nc_buffer[:, pos:pos + D], reversed_kernels)
+
+        saf      = 1 - 0.5 * saa * ( numpy.cos ( 2 * numpy.pi / 365 * (t - 182 - ddy) ) + 1 )
+        bg_noise = numpy.minimum(1, m) if saa != 0 else 0
+        atf      = saf * baf
+
+        # one matrix-vector product for the contacts of every group with the infectious of every group
+        force = h * p * atf * susceptibility * (contacts @ (n / M))
+
+        nci = numpy.minimum(force*m, m) + bg_noise
+
+        K  = get_next_generation ( contacts, susceptibility, T, M, m ) * h * p * atf
+        rt = K.sum(axis=0)
+
+        incubator[:, t % E] = nci
+        nc = numpy.where(t - delay >= 1, incubator[every, (t - delay) % E], 0)
+
+        n = numpy.maximum(n + nc - outgoing, 0)
+        m = numpy.maximum(m - nci, 0)
+        i = i + nci * (1 - DR)
+
+        nc_buffer[:, pos]     = nc
+        nc_buffer[:, pos + D] = nc
+
+        values = get_day_values ( n, nc, outgoing, DR, m, rt, i )
+
+        if summary_only:
+            peak_day, peak_value, transmissions, deaths, rt_day = get_running_summary ( t, values, peak_day, peak_value, transmissions, deaths, rt_day )
+            continue
+
+        total_rt[t] = get_spectral_radius ( K )
+
+        for name in BATCH_SERIES:
+            series[name][t] = values[name]
+
+    if summary_only:
+        result = BatchResult ( p_, tmax, get_final_summary ( M, m, peak_day, peak_value, transmissions, deaths, rt_day ) )
+        result.total_rt = total_rt
+        return result
+
+    series, summary = get_series_summary ( series, M )
+
+    result = BatchResult ( p_, tmax, summary, series )
+    result.total_rt = total_rt
+
+    return result
+
+# aggregate of all the age groups of a full result, in the run_simulation_web dataset layout
+# (the dataset of each group is result.get_dataset(a))
+
+def get_total_dataset ( result ):
+
+    dataset    = get_meta_total_dataset ( result )
+    dataset[8] = list(result.total_rt)
+
+    return dataset
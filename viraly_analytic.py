@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+# Analytic estimates for viraly: final size, herd immunity threshold and early growth rate
+#
+# With R0 = h * p * T and a fraction f of the population immune from the start, the closed forms are
+#
+#   final size       z = s0 + W( -R s0 e^(-R s0) ) / R      with s0 = 1 - f, R = R0 (0 when R s0 <= 1)
+#   herd immunity    1 - 1/R0
+#   growth rate      lambda T = Re + W( -Re e^(-Re) )         with Re = R0 s0
+#
+# where W is the principal branch of the Lambert W function. The final size is the fraction of the whole
+# population that is infected during the epidemic (z = s0 ( 1 - e^(-R z) )) and the growth rate is the one of
+# an infectious period of fixed duration T (model 3), as in util/lamba-RT.py. All the functions take scalars
+# or arrays, so that whole parameter grids are estimated at once without running the simulation.
+#
+# The critical thresholds are the ones of the discrete recurrence itself. Linearized around m = M s, the new
+# cases of run_simulation_web follow the renewal equation
+#
+#   nc[t] = b * sum_j S[j] * nc[t - I - j]        with b = h p s attenuation
+#
+# where S[j] is the fraction of the cases still active j days after becoming infectious (one minus the
+# cumulative recovery kernel). Its characteristic equation b * sum_j S[j] r^-(I + j) = 1 has a single positive
+# root r, the daily growth factor, and r = 1 when b * sum_j S[j] = 1: the critical hp is 1 / sum_j S[j], which
+# is 1/T for model 3 and slightly lower for model 4, whose discretized normal recovery has an average of
+# about T + 1/2 days (the tiny fraction that the normal places before day 1 is counted as recovering on day 1,
+# the first day of the kernel, so that the thresholds do not depend on how far the kernel is summed).
+
+import functools
+import numpy
+import scipy.special
+
+from viraly import get_recovery_kernel, CACHE_SIZE
+
+# support of the recovery kernels used for the critical thresholds, in days
+CRITICAL_SIZE = 1000
+
+# bisection steps of the growth factor root finding (on log r, over [ -GROWTH_BRACKET, GROWTH_BRACKET ])
+GROWTH_STEPS   = 60
+GROWTH_BRACKET = 5
+
+### functions ###
+
+# principal branch of the Lambert W function, real part (the arguments used here are >= -1/e)
+
+def get_lambertw ( x ):
+
+    return numpy.real(scipy.special.lambertw(x))
+
+# fraction of the population infected during the whole epidemic, with a fraction immune of pre immunity
+
+def get_final_size ( R0, immune = 0 ):
+
+    R0 = numpy.asarray(R0, dtype=float)
+    s0 = numpy.clip(1 - numpy.asarray(immune, dtype=float), 0, 1)
+    Re = R0 * s0
+
+    # the exact argument is never below -1/e, rounding can push it there when Re is close to 1
+    argument = numpy.maximum(-Re * numpy.exp(-Re), -numpy.exp(-1))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        size = s0 + get_lambertw ( argument ) / R0
+
+    return numpy.where(Re > 1, numpy.clip(size, 0, s0), 0.0)
+
+# fraction of the population that must be immune so that the epidemic does not grow
+
+def get_herd_immunity_threshold ( R0 ):
+
+    R0 = numpy.asarray(R0, dtype=float)
+
+    with numpy.errstate(divide='ignore'):
+        return numpy.maximum(1 - 1/R0, 0)
+
+# daily exponential growth rate of the early phase, with a fraction immune of pre immunity
+# (zero when the effective reproduction number is not above 1)
+
+def get_growth_rate ( R0, T, immune = 0 ):
+
+    Re = numpy.asarray(R0, dtype=float) * numpy.clip(1 - numpy.asarray(immune, dtype=float), 0, 1)
+
+    argument = numpy.maximum(-Re * numpy.exp(-Re), -numpy.exp(-1))
+    rate     = (Re + get_lambertw ( argument )) / numpy.asarray(T, dtype=float)
+
+    return numpy.where(Re > 1, numpy.maximum(rate, 0), 0.0)
+
+# days for the number of cases to double during the early phase (inf when there is no growth)
+
+def get_doubling_time ( R0, T, immune = 0 ):
+
+    rate = get_growth_rate ( R0, T, immune )
+
+    with numpy.errstate(divide='ignore'):
+        return numpy.where(rate > 0, numpy.log(2) / rate, numpy.inf)
+
+# all the estimates for run_simulation_web parameters (scalars or arrays with one value per scenario)
+# returns a dictionary with R0, the herd immunity threshold, the final size (as a fraction of M), the
+# expected transmissions, the growth rate and the doubling time
+
+def get_estimates ( h, p, T, M, I0 = 0 ):
+
+    M      = numpy.asarray(M, dtype=float)
+    R0     = numpy.asarray(h, dtype=float) * numpy.asarray(p, dtype=float) * numpy.asarray(T, dtype=float)
+    immune = numpy.asarray(I0, dtype=float) / M
+    size   = get_final_size ( R0, immune )
+
+    return { 'R0'             : R0,
+             'threshold'      : get_herd_immunity_threshold ( R0 ),
+             'final_size'     : size,
+             'transmissions'  : size * M,
+             'growth_rate'    : get_growth_rate ( R0, T, immune ),
+             'doubling_time'  : get_doubling_time ( R0, T, immune ) }
+
+# fraction of the cases still active on each day after becoming infectious, S[j] above (read only, cached)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_survival ( T, L, gaussian, erlang ):
+
+    kernel   = get_recovery_kernel ( T, L, gaussian, CRITICAL_SIZE, erlang )
+    # the mass the kernel misses (before day 1 on model 4) recovers on day 1 instead of never
+    residue  = 1 - kernel.sum()
+    survival = numpy.maximum(1 - numpy.cumsum(kernel) - residue * (numpy.arange(0, len(kernel)) >= 1), 0)
+    survival.setflags(write=False)
+
+    return survival
+
+# survival arrays for arrays of T and L, padded with zeros to a common length; the model is chosen by L as
+# on the CLI (model 4 when L != 0) unless gaussian is given, erlang selects model 5
+# returns the survival matrix, of shape broadcast shape + ( days, )
+
+def get_survival_matrix ( T, L, gaussian = None, erlang = False ):
+
+    T, L, erlang = numpy.broadcast_arrays(numpy.asarray(T), numpy.asarray(L), numpy.asarray(erlang, dtype=bool))
+    gaussian     = L != 0 if gaussian is None else numpy.broadcast_to(numpy.asarray(gaussian, dtype=bool), T.shape)
+
+    keys     = list(zip(numpy.round(T).astype(int).ravel().tolist(), numpy.round(L).astype(int).ravel().tolist(),
+                        gaussian.ravel().tolist(), erlang.ravel().tolist()))
+    unique   = { key : get_survival ( *key ) for key in set(keys) }
+    size     = max([ len(survival) for survival in unique.values() ])
+
+    matrix = numpy.zeros((len(keys), size))
+    for k, key in enumerate(keys):
+        matrix[k, 0:len(unique[key])] = unique[key]
+
+    return matrix.reshape(T.shape + (size,))
+
+# expected number of days a case is infectious (sum_j S[j])
+
+def get_infectious_days ( T, L = 0, gaussian = None, erlang = False ):
+
+    return get_survival_matrix ( T, L, gaussian, erlang ).sum(axis=-1)
+
+# hp at which the infections neither grow nor decrease (with no immunity), for an attenuation factor (1 - bat)
+
+def get_critical_beta ( T, L = 0, gaussian = None, erlang = False, attenuation = 1 ):
+
+    return 1 / (numpy.asarray(attenuation, dtype=float) * get_infectious_days ( T, L, gaussian, erlang ))
+
+# fraction of pre immunized needed so that the infections do not grow with the given hp
+
+def get_critical_immunity ( beta, T, L = 0, gaussian = None, erlang = False, attenuation = 1 ):
+
+    reproduction = numpy.asarray(beta, dtype=float) * numpy.asarray(attenuation, dtype=float) * get_infectious_days ( T, L, gaussian, erlang )
+
+    with numpy.errstate(divide='ignore'):
+        return numpy.maximum(1 - 1/reproduction, 0)
+
+# daily growth factor r of the new cases during the early phase: the root of the characteristic equation of
+# the renewal equation above, found by bisection on log r for all the elements at once
+
+def get_growth_factor ( beta, T, L = 0, I = 1, gaussian = None, erlang = False, attenuation = 1, immune = 0 ):
+
+    survival = get_survival_matrix ( T, L, gaussian, erlang )
+    b        = numpy.asarray(beta, dtype=float) * numpy.asarray(attenuation, dtype=float) * (1 - numpy.asarray(immune, dtype=float))
+
+    shape    = numpy.broadcast_shapes(numpy.shape(b), numpy.shape(I), survival.shape[:-1])
+    survival = numpy.broadcast_to(survival, shape + survival.shape[-1:])
+    b        = numpy.broadcast_to(b, shape)[..., None]
+    I        = numpy.broadcast_to(numpy.asarray(I, dtype=float), shape)[..., None]
+    j        = numpy.arange(0, survival.shape[-1])
+
+    low  = numpy.full(shape + (1,), -float(GROWTH_BRACKET))
+    high = numpy.full(shape + (1,),  float(GROWTH_BRACKET))
+
+    # the left side decreases with r: above 1 the root is further right
+    for step in range(0, GROWTH_STEPS):
+        middle = (low + high) / 2
+        value  = (b * survival * numpy.exp(-middle * (I + j))).sum(axis=-1, keepdims=True)
+        above  = value > 1
+        low    = numpy.where(above, middle, low)
+        high   = numpy.where(above, high, middle)
+
+    return numpy.exp((low + high) / 2)[..., 0]
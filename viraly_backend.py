@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+# Backends for the core recurrence of viraly
+#
+# get_model compiles the parameters of run_simulation_web into arrays: the h and p of every day (from the stages
+# or an N-stage schedule), the attenuation factor of every day (seasonal and baseline), the recovery kernel and
+# the incubation kernel. run_recurrence then runs the daily recurrence on those arrays with a plain loop over
+# floats and two dot products per day (the recoveries and the incubation), so that nothing in the loop depends
+# on Python objects and the very same function can be compiled to machine code.
+#
+# BACKENDS maps the backend names to implementations of run_recurrence:
+#
+#   python - run_recurrence as it is, interpreted (NumPy for the dot products)
+#   numba  - run_recurrence compiled by numba.njit, only when numba is installed
+#
+# 'auto' picks numba when it is available and falls back to python otherwise. The results match
+# run_simulation_web up to floating point summation order (model 5 uses its recovery kernel, as the batched
+# engine, instead of the stages of the chain).
+
+import numpy
+
+from viraly import get_recovery_kernel, get_incubation_kernel, get_schedule_basis, get_schedule_object, get_summary, DEFAULT_CONFIG, INCIDENCE_WINDOW, INCIDENCE_UNIT
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND_DEFAULT = 'auto'
+
+### functions ###
+
+# the recurrence of run_simulation_web on the compiled arrays of get_model (see there)
+# returns the active, new, outgoing, susceptible, Rt and immune values of every day, from 0 to tmax
+
+def run_recurrence ( h, p, atf, noise, kernel, q_kernel, M, N0, I0, T, DR, ton, toff, twin, h2, p2, tmax ):
+
+    D = len(kernel)
+    Q = len(q_kernel)
+    P = max(D, Q)
+
+    # the kernels are reversed so that the weights of the last days are a contiguous slice of the histories,
+    # which are padded with P zeros before day 0
+    r_kernel = kernel[::-1].copy()
+    r_q      = q_kernel[::-1].copy()
+
+    nc_padded  = numpy.zeros(tmax + 1 + P)
+    nci_padded = numpy.zeros(tmax + 1 + P)
+
+    n_history  = numpy.zeros(tmax + 1)
+    o_history  = numpy.zeros(tmax + 1)
+    m_history  = numpy.zeros(tmax + 1)
+    rt_history = numpy.zeros(tmax + 1)
+    i_history  = numpy.zeros(tmax + 1)
+
+    n = N0
+    m = max(M - N0 - I0, 0.0)
+    i = I0 + N0
+
+    nc_padded[P]  = N0
+    n_history[0]  = n
+    m_history[0]  = m
+    rt_history[0] = h[0]*p[0]*T
+    i_history[0]  = i
+
+    window_sum = N0
+    contained  = False
+
+    for t in range(1, tmax + 1):
+
+        ht = h[t]
+        pt = p[t]
+        if contained:
+            ht = h2
+            pt = p2
+
+        # the cases of the last D days that go out today (the weight of today is kernel[0] = 0)
+        outgoing = numpy.dot(r_kernel, nc_padded[P + t - D + 1:P + t + 1])
+
+        correction = max(1 - (M - m)/M, 0.0)
+        bg_noise   = min(1.0, m) if noise else 0.0
+
+        nci = min(n*ht*pt*atf[t]*correction, m) + bg_noise
+        rt  = ht*pt*T*correction*atf[t]
+
+        # the exposed cases of the last Q days, today included, that become infectious today
+        nci_padded[P + t] = nci
+        nc = numpy.dot(r_q, nci_padded[P + t - Q + 1:P + t + 1])
+
+        n = max(n + nc - outgoing, 0.0)
+        nc_padded[P + t] = nc
+
+        # the adaptive trigger decides the parameters of the next day from the incidence up to today
+        if ton > 0:
+            window_sum = window_sum + nc
+            if t - twin >= 0:
+                window_sum = window_sum - nc_padded[P + t - twin]
+            incidence = window_sum * INCIDENCE_UNIT / M
+            if contained:
+                contained = incidence > toff
+            else:
+                contained = incidence >= ton
+
+        m = max(m - nci, 0.0)
+        i = i + nci * (1 - DR)
+
+        n_history[t]  = n
+        o_history[t]  = outgoing
+        m_history[t]  = m
+        rt_history[t] = rt
+        i_history[t]  = i
+
+    return n_history, nc_padded[P:].copy(), o_history, m_history, rt_history, i_history
+
+BACKENDS = { 'python' : run_recurrence }
+
+if numba is not None:
+    BACKENDS['numba'] = numba.njit(cache=True)(run_recurrence)
+
+# implementation of a backend, 'auto' being the fastest one available
+
+def get_backend ( name = BACKEND_DEFAULT ):
+
+    if name == 'auto':
+        name = 'numba' if 'numba' in BACKENDS else 'python'
+
+    if name not in BACKENDS:
+        raise ValueError('backend ' + name + ' is not available, available: ' + str(list(BACKENDS)))
+
+    return BACKENDS[name]
+
+# the arrays of a run_simulation_web run: h, p and atf of every day from 0 to tmax, the recovery and incubation
+# kernels (with at least two days, so that every backend gets the same shapes) and whether there is background noise
+
+def get_model ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, prefer_mod4 = DEFAULT_CONFIG.prefer_mod4, I0 = 0, ddy = 0, saa = 0, bat = 0, erlang = False, incubation = None, ton = 0, schedule = None ):
+
+    # the adaptive triggers switch between the free and the h2, p2 values, an N-stage schedule replaces the stages
+    schedule = get_schedule_object ( schedule ) if ton <= 0 else None
+    if ton > 0:
+        h_schedule = numpy.full(tmax + 1, float(h))
+        p_schedule = numpy.full(tmax + 1, float(p))
+    elif schedule is not None:
+        h_schedule, p_schedule = schedule.compile ( tmax )
+    else:
+        basis      = get_schedule_basis ( tint, progressive, ttime, tint2, ttime2, tmax )
+        h_schedule = basis @ numpy.array([ h, h2, h3 ], dtype=float)
+        p_schedule = basis @ numpy.array([ p, p2, p3 ], dtype=float)
+
+    t   = numpy.arange(0, tmax + 1)
+    atf = (1 - 0.5 * saa * ( numpy.cos ( 2 * numpy.pi / 365 * (t - 182 - ddy) ) + 1 )) * (1 - bat)
+
+    recovery = get_recovery_kernel ( T, L, prefer_mod4, tmax + 1, erlang )
+    q        = get_incubation_kernel ( I, ( 'fixed', ) if incubation is None else tuple(incubation), tmax + 1 )
+
+    kernel   = numpy.zeros(max(len(recovery), 2))
+    q_kernel = numpy.zeros(max(len(q), 2))
+    kernel[0:len(recovery)] = recovery
+    q_kernel[0:len(q)]      = q
+
+    return { 'h' : numpy.ascontiguousarray(h_schedule, dtype=float), 'p' : numpy.ascontiguousarray(p_schedule, dtype=float),
+             'atf' : atf, 'noise' : saa != 0, 'kernel' : kernel, 'q_kernel' : q_kernel }
+
+# same parameters and results (dataset or summary) as run_simulation_web, computed by a backend
+
+def run_simulation_backend ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent = None, prefer_mod4 = None, I0 = 0, ddy = 0, saa = 0, bat = 0, summary_only = False, erlang = None, incubation = None, ton = 0, toff = 0, twin = INCIDENCE_WINDOW, schedule = None, config = DEFAULT_CONFIG, backend = BACKEND_DEFAULT ):
+
+    prefer_mod4 = config.prefer_mod4 if prefer_mod4 is None else prefer_mod4
+    erlang      = config.erlang if erlang is None else erlang
+
+    model = get_model ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, prefer_mod4, I0, ddy, saa, bat, erlang, incubation, ton, schedule )
+
+    n_history, nc_history, o_history, m_history, rt_history, i_history = get_backend ( backend ) (
+        model['h'], model['p'], model['atf'], model['noise'], model['kernel'], model['q_kernel'],
+        float(M), float(N0), float(I0), float(T), float(DR), float(ton), float(toff), int(twin), float(h2), float(p2), int(tmax) )
+
+    d_history = numpy.round(o_history * DR, 0)
+    r_history = numpy.round(o_history * (1 - DR), 0)
+
+    if summary_only:
+        below = rt_history < 1
+        return get_summary ( numpy.argmax(n_history), n_history.max(), nc_history[1:].sum(), d_history.sum(), m_history[-1] / M,
+                             numpy.argmax(below) if below.any() else -1 )
+
+    n_history = list(n_history)
+
+    return [ n_history, list(nc_history), list(r_history), list(d_history), list(m_history), n_history, list(numpy.cumsum(r_history)),
+             list(numpy.cumsum(d_history)), list(rt_history), list(numpy.cumsum(nc_history)), list(i_history) ]
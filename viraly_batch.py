@@ -0,0 +1,749 @@
+#!/usr/bin/python3
+
+# Batched engine for viraly: runs many scenarios of the run_simulation_web recurrence at once
+#
+# Every state variable is a numpy array over the scenarios of the batch, so each simulated day costs
+# a handful of vectorized operations no matter how many scenarios there are. The recoveries are
+# computed with the cached recovery kernels of viraly.py (a dot product over the kernel support instead
+# of the day by day normal cdf evaluations of model 4) and the parameter schedules are compiled once
+# per distinct set of stage times.
+#
+# The results match run_simulation_web up to floating point summation order.
+
+import numpy
+
+from viraly import get_recovery_kernel, get_incubation_kernel, get_schedule_basis, get_schedule_object, get_summary, DELAY_TAIL, PARAM_NAMES_WEB, DEFAULT_CONFIG, SUMMARY_NAMES, INCIDENCE_WINDOW, INCIDENCE_UNIT
+from viraly_burden import get_burden
+
+# parameters that are not mandatory and their defaults (same as run_simulation_web, a single stage by default)
+BATCH_DEFAULTS = { 'L' : 0, 'I' : 1, 'h2' : 0, 'p2' : 0, 'DR' : 0, 'progressive' : False, 'ttime' : 0,
+                   'h3' : 0, 'p3' : 0, 'tint2' : 0, 'ttime2' : 0, 'prefer_mod4' : DEFAULT_CONFIG.prefer_mod4,
+                   'I0' : 0, 'ddy' : 0, 'saa' : 0, 'bat' : 0, 'erlang' : False, 'ton' : 0, 'toff' : 0, 'twin' : INCIDENCE_WINDOW,
+                   'schedule' : None }
+
+# parameters which hold integer numbers of days
+BATCH_INT_PARAMS = [ 'T', 'L', 'I', 'tint', 'ttime', 'tint2', 'ttime2', 'twin' ]
+
+# parameters that define the stage times of the schedule of h and p
+SCHEDULE_TIMES = [ 'tint', 'progressive', 'ttime', 'tint2', 'ttime2' ]
+
+# state of a summary only batch at the end of a day, as saved on checkpoints (see run_simulation_batch)
+BATCH_STATE = [ 'n', 'm', 'i', 'nc_buffer', 'incubator', 'q_pending', 'contained', 'window', 'window_sum', 'contention',
+                'peak_day', 'peak_value', 'transmissions', 'deaths', 'rt_day' ]
+
+# series of a full (not summary only) batch result, shape ( scenarios, tmax + 1 ) (one value per step, see
+# run_simulation_batch); the flows are totals over the step, the other series are values at the end of the step
+BATCH_SERIES = [ 'active', 'new', 'outgoing', 'recovered', 'deaths', 'susceptible', 'rt', 'immune' ]
+BATCH_FLOWS  = [ 'new', 'outgoing', 'recovered', 'deaths' ]
+
+### functions ###
+
+# results of a batch; the series are None in summary only mode
+# step is the time step of the run, in days, and days holds the day of each value of the series
+
+class BatchResult:
+
+    def __init__ ( self, params, tmax, summary, series = None, step = 1 ):
+
+        self.params  = params
+        self.tmax    = tmax
+        self.size    = len(params['h'])
+        self.summary = summary
+        self.step    = step
+
+        for name in BATCH_SERIES:
+            setattr(self, name, None if series is None else series[name])
+
+        self.days = None if series is None else numpy.arange(0, series['active'].shape[1]) * step
+
+    # series of every scenario with one value per day, from day 0 to tmax: the flows of each step are spread
+    # evenly over its days (which keeps their totals) and the other series are interpolated linearly
+
+    def get_daily ( self, name ):
+
+        values = getattr(self, name)
+        if self.step == 1:
+            return values
+
+        if name in BATCH_FLOWS:
+            daily = numpy.repeat(values[:, 1:] / self.step, self.step, axis=1)
+            return numpy.hstack([ values[:, 0:1], daily ])[:, 0:self.tmax + 1]
+
+        days = numpy.arange(0, self.tmax + 1)
+
+        return numpy.vstack([ numpy.interp(days, self.days, row) for row in values ])
+
+    # summary of one scenario, as returned by run_simulation_web in summary only mode
+
+    def get_summary ( self, j ):
+
+        return get_summary ( *[ self.summary[name][j] for name in SUMMARY_NAMES ] )
+
+    # dataset of one scenario, in the same layout as run_simulation_web (daily, see get_daily)
+
+    def get_dataset ( self, j ):
+
+        series = { name : self.get_daily ( name )[j] for name in BATCH_SERIES }
+
+        n_history  = list(series['active'])
+        nc_history = list(series['new'])
+        r_history  = list(series['recovered'])
+        d_history  = list(series['deaths'])
+
+        na_history = list(numpy.cumsum(nc_history))
+        ra_history = list(numpy.cumsum(r_history))
+        da_history = list(numpy.cumsum(d_history))
+
+        return [ n_history, nc_history, r_history, d_history, list(series['susceptible']), n_history, ra_history, da_history, list(series['rt']), na_history, list(series['immune']) ]
+
+    # downstream burden (admissions, hospital and ICU occupancy, delayed deaths) of every scenario, see viraly_burden.py
+
+    def get_burden ( self, options = None ):
+
+        return get_burden ( self.get_daily ( 'new' ), self.params['DR'], options )
+
+# normalize the parameters of a batch: every value becomes an array with one element per scenario
+# scalars are broadcast, 'tint' defaults to tmax (no stage change) and the other defaults are in BATCH_DEFAULTS
+
+def get_batch_params ( params, tmax ):
+
+    for name in params:
+        if name not in PARAM_NAMES_WEB or name == 'tmax':
+            raise ValueError('unknown batch parameter: ' + name)
+
+    for name in [ 'h', 'p', 'T', 'M', 'N0' ]:
+        if name not in params:
+            raise ValueError('missing batch parameter: ' + name)
+
+    all_params = dict(BATCH_DEFAULTS)
+    all_params['tint'] = tmax
+    all_params.update(params)
+
+    size = max([ 1 if isinstance(value, str) else numpy.size(value) for value in all_params.values() ])
+
+    batch_params = {}
+    for name, value in all_params.items():
+        # schedules (see viraly.Schedule, None for the stages) are kept on a list
+        if name == 'schedule':
+            if value is None or isinstance(value, str) or numpy.ndim(value) == 0:
+                value = [ value ] * size
+            elif len(value) != size:
+                raise ValueError('batch parameter ' + name + ' has ' + str(len(value)) + ' values, expected ' + str(size))
+            batch_params[name] = [ get_schedule_object ( schedule ) for schedule in value ]
+            continue
+        value = numpy.asarray(value)
+        if name in BATCH_INT_PARAMS:
+            value = numpy.round(value).astype(int)
+        elif name in [ 'progressive', 'prefer_mod4', 'erlang' ]:
+            value = value.astype(bool)
+        else:
+            value = value.astype(float)
+        if value.ndim == 0:
+            value = numpy.full(size, value)
+        elif len(value) != size:
+            raise ValueError('batch parameter ' + name + ' has ' + str(len(value)) + ' values, expected ' + str(size))
+        batch_params[name] = value
+
+    return batch_params
+
+# schedules for every scenario, compiled once per distinct combination of stage times
+
+def get_batch_schedules ( batch_params, tmax ):
+
+    size = len(batch_params['h'])
+
+    h_schedules = numpy.zeros((tmax + 1, size))
+    p_schedules = numpy.zeros((tmax + 1, size))
+
+    h_values = numpy.vstack([ batch_params['h'], batch_params['h2'], batch_params['h3'] ])
+    p_values = numpy.vstack([ batch_params['p'], batch_params['p2'], batch_params['p3'] ])
+
+    groups = {}
+    for j, key in enumerate(zip(*[ batch_params[name].tolist() for name in SCHEDULE_TIMES ])):
+        groups.setdefault(key, []).append(j)
+
+    for key, columns in groups.items():
+        basis = get_schedule_basis ( *key, tmax )
+        h_schedules[:, columns] = basis @ h_values[:, columns]
+        p_schedules[:, columns] = basis @ p_values[:, columns]
+
+    # N-stage schedules replace the stages of their scenarios (each one is compiled once), but not the triggers
+    for j, schedule in enumerate(batch_params['schedule']):
+        if schedule is not None and batch_params['ton'][j] <= 0:
+            h_schedules[:, j], p_schedules[:, j] = schedule.compile ( tmax )
+
+    return h_schedules, p_schedules
+
+# kernel of a delay in days turned into a kernel of a delay in steps of step days: the weight of a delay of d days
+# is split between the steps just before and just after d / step, so that the average delay is kept (a case which
+# is active for T days is active for T / step steps on average, which is what keeps R0 = h p T with coarse steps)
+
+def get_step_kernel ( kernel, step, shift = 0 ):
+
+    lag      = numpy.maximum(numpy.arange(0, len(kernel)) - shift, 0) / step
+    low      = numpy.floor(lag).astype(int)
+    fraction = lag - low
+
+    stepped = numpy.zeros(low[-1] + 2)
+    numpy.add.at(stepped, low, kernel * (1 - fraction))
+    numpy.add.at(stepped, low + 1, kernel * fraction)
+
+    nonzero = numpy.nonzero(stepped)[0]
+
+    return stepped[0:nonzero[-1] + 1] if len(nonzero) > 0 else stepped[0:1]
+
+# recovery kernels for every scenario, in steps of step days (the delays are counted from the middle of the step of
+# the new cases, where they become infectious on average)
+
+def get_batch_recovery_kernels ( batch_params, tmax, step = 1 ):
+
+    keys    = list(zip(batch_params['T'].tolist(), batch_params['L'].tolist(), batch_params['prefer_mod4'].tolist(), batch_params['erlang'].tolist()))
+    kernels = [ get_recovery_kernel ( T, L, gaussian, tmax + 1, erlang ) for T, L, gaussian, erlang in keys ]
+
+    if step > 1:
+        kernels = [ get_step_kernel ( kernel, step, (step - 1) / 2 ) for kernel in kernels ]
+
+    return kernels
+
+# first day from which the schedules of every scenario are constant (the day after the last stage change or the
+# last breakpoint), rounded up to a multiple of step and at most days; the schedules are only kept up to it, so
+# that their memory does not grow with tmax
+
+def get_schedule_horizon ( batch_params, days, step = 1 ):
+
+    # the stage changes that start before the end (tint defaults to tmax, no change)
+    first   = numpy.where(batch_params['tint'] < days, batch_params['tint'] + batch_params['ttime'], 0)
+    second  = numpy.where(( batch_params['tint2'] > 0 ) & ( batch_params['tint2'] < days ), batch_params['tint2'] + batch_params['ttime2'], 0)
+    horizon = max(int(numpy.maximum(first, second).max()), 0) + 2
+
+    for schedule in batch_params['schedule']:
+        if schedule is not None:
+            horizon = max(horizon, schedule.days[-1] + 1)
+
+    return min(-(-horizon // step) * step, days)
+
+# recovery kernels for every scenario, reversed and padded to a common support of D days (or steps):
+# column i holds the weight of the new cases of D - i days ago
+
+def get_batch_kernels ( batch_params, tmax, step = 1 ):
+
+    kernels = get_batch_recovery_kernels ( batch_params, tmax, step )
+
+    D = max(1, max([ len(kernel) - 1 for kernel in kernels ]))
+
+    reversed_kernels = numpy.zeros((len(kernels), D))
+    for j, kernel in enumerate(kernels):
+        if len(kernel) > 1:
+            reversed_kernels[j, D - len(kernel) + 1:] = kernel[:0:-1]
+
+    return reversed_kernels
+
+# weight of the recovery kernels on the step of the new cases themselves (the recoveries which are less than a
+# step away, which only happen for steps of more than one day)
+
+def get_batch_same_step ( batch_params, tmax, step ):
+
+    return numpy.array([ kernel[0] for kernel in get_batch_recovery_kernels ( batch_params, tmax, step ) ])
+
+# incubation kernels for every scenario (see viraly.get_incubation_kernel), padded to a common support of K days
+# (or steps)
+
+def get_batch_incubation_kernels ( batch_params, tmax, incubation, step = 1 ):
+
+    kernels = [ get_incubation_kernel ( I, tuple(incubation), tmax + 1 ) for I in batch_params['I'].tolist() ]
+
+    if step > 1:
+        kernels = [ get_step_kernel ( kernel, step ) for kernel in kernels ]
+
+    K = max([ len(kernel) for kernel in kernels ])
+
+    padded = numpy.zeros((len(kernels), K))
+    for j, kernel in enumerate(kernels):
+        padded[j, 0:len(kernel)] = kernel
+
+    return padded
+
+# days on the h2, p2 stage: counted for the triggered scenarios, from tint to tint2 (or the end) for the others
+# and, for the scenarios with an N-stage schedule, the days with a lower h * p than on day 0
+
+def get_contention_days ( batch_params, tmax, triggered, contention ):
+
+    start = numpy.clip(batch_params['tint'], 0, tmax)
+    end   = numpy.where(batch_params['tint2'] > 0, numpy.clip(batch_params['tint2'], 0, tmax), tmax)
+    days  = numpy.maximum(end - start, 0)
+
+    for j, schedule in enumerate(batch_params['schedule']):
+        if schedule is not None and not triggered[j]:
+            # the values are constant after the last breakpoint
+            horizon = min(tmax, max(schedule.days[-1], 0) + 1)
+            h_schedule, p_schedule = schedule.compile ( horizon )
+            beta    = h_schedule * p_schedule
+            days[j] = numpy.count_nonzero(beta[1:] < beta[0]) + (tmax - horizon) * (beta[-1] < beta[0])
+
+    return numpy.where(triggered, contention, days)
+
+# values of a ( days + 1, scenarios ) array averaged over each step of step days: row 0 is day 0 and row k is
+# the average of the days ( k - 1 ) step + 1 to k step
+
+def get_step_average ( values, step ):
+
+    steps = (len(values) - 1) // step
+
+    return numpy.vstack([ values[0:1], values[1:].reshape(steps, step, -1).mean(axis=1) ])
+
+# copy of the state of a batch, with the names of BATCH_STATE (q_pending is left out when there is none)
+
+def get_batch_state ( *values ):
+
+    return { name : value.copy() for name, value in zip(BATCH_STATE, values) if value is not None }
+
+# the day by day bookkeeping shared by the engines that run the recurrence on arrays (this one, viraly_meta.py
+# and viraly_age.py): the initial summary and series, the values of a day, the running summary of summary only
+# runs and the summary of full runs
+
+# running summary on day 0: peak day and value, transmissions, deaths and first day with Rt < 1 (-1 if none yet)
+
+def get_initial_summary ( N0, R0 ):
+
+    size = len(N0)
+
+    return numpy.zeros(size, dtype=int), N0.copy(), numpy.zeros(size), numpy.zeros(size), numpy.where(R0 < 1, 0, -1)
+
+# series of a full run with room for steps steps, with the values of day 0
+
+def get_initial_series ( steps, N0, m, R0, i ):
+
+    series = { name : numpy.zeros((steps + 1, len(N0))) for name in BATCH_SERIES }
+    series['active'][0]      = N0
+    series['new'][0]         = N0
+    series['susceptible'][0] = m
+    series['rt'][0]          = R0
+    series['immune'][0]      = i
+
+    return series
+
+# values of the BATCH_SERIES at the end of a day; the outgoing cases are split in recovered and deaths, rounded
+
+def get_day_values ( n, nc, outgoing, DR, m, rt, i ):
+
+    return { 'active' : n, 'new' : nc, 'outgoing' : outgoing, 'recovered' : numpy.round(outgoing * (1 - DR), 0),
+             'deaths' : numpy.round(outgoing * DR, 0), 'susceptible' : m, 'rt' : rt, 'immune' : i }
+
+# running summary updated with the values of day t
+
+def get_running_summary ( t, values, peak_day, peak_value, transmissions, deaths, rt_day ):
+
+    rising     = values['active'] > peak_value
+    peak_day   = numpy.where(rising, t, peak_day)
+    peak_value = numpy.where(rising, values['active'], peak_value)
+    rt_day     = numpy.where((rt_day < 0) & (values['rt'] < 1), t, rt_day)
+
+    return peak_day, peak_value, transmissions + values['new'], deaths + values['deaths'], rt_day
+
+# summary of a summary only run, from its running summary and its final susceptibles
+
+def get_final_summary ( M, m, peak_day, peak_value, transmissions, deaths, rt_day ):
+
+    return { 'peak_day' : peak_day, 'peak_active' : peak_value, 'total_transmissions' : transmissions,
+             'total_deaths' : deaths, 'final_susceptible' : m / M, 'rt_day' : rt_day }
+
+# series of a full run with one row per scenario, and their summary (days are multiples of step)
+
+def get_series_summary ( series, M, step = 1 ):
+
+    series = { name : numpy.ascontiguousarray(values.T) for name, values in series.items() }
+
+    active    = series['active']
+    below     = series['rt'] < 1
+    peak_step = numpy.argmax(active, axis=1)
+
+    summary = { 'peak_day'            : peak_step * step,
+                'peak_active'         : active[numpy.arange(0, len(M)), peak_step],
+                'total_transmissions' : series['new'][:, 1:].sum(axis=1),
+                'total_deaths'        : series['deaths'].sum(axis=1),
+                'final_susceptible'   : series['susceptible'][:, -1] / M,
+                'rt_day'              : numpy.where(below.any(axis=1), numpy.argmax(below, axis=1) * step, -1) }
+
+    return series, summary
+
+# raises ValueError when the parameters use what an engine does not implement: the adaptive triggers (ton, toff
+# and twin away from their defaults) or a distributed incubation (an 'incubation' entry, I is used otherwise)
+
+def check_fixed_stages ( params, engine ):
+
+    if params.get('incubation') is not None:
+        raise ValueError('distributed incubation is not available on the ' + engine + ' engine')
+
+    for name in [ 'ton', 'toff', 'twin' ]:
+        if name in params and numpy.any(numpy.asarray(params[name]) != BATCH_DEFAULTS[name]):
+            raise ValueError('adaptive triggers (' + name + ') are not available on the ' + engine + ' engine')
+
+# fast forward of the early phase: while the susceptibles stay close to their initial value the recurrence is
+# linear on the state ( last D new cases, last E exposed cases, active cases and the running sums ), so each
+# scenario has a companion matrix A and the state after t days is A^t applied to the initial state; A^t is
+# built with O(log t) matrix products (exponentiation by squaring) and the days are taken greedily, from the
+# largest power down, while the susceptibles of every scenario went down by at most tolerance * M
+#
+# all the scenarios jump to the same day, which is limited by the first change of their h, p schedules; there
+# is no jump if any scenario has adaptive triggers, seasonal attenuation or a reproduction number h p T <= 1
+# (its peak could be on the skipped days) and there is none for a distributed incubation either
+# returns the state at the end of the jump, in the checkpoint format of run_simulation_batch, or None; the
+# deaths of the skipped days are rounded on their total instead of day by day
+
+def get_fast_forward ( batch_params, h_schedules, p_schedules, reversed_kernels, E, tmax, tolerance ):
+
+    size  = reversed_kernels.shape[0]
+    every = numpy.arange(0, size)
+
+    M   = batch_params['M']
+    N0  = batch_params['N0']
+    DR  = batch_params['DR']
+    m0  = numpy.maximum(M - N0 - batch_params['I0'], 0)
+    b   = h_schedules[1] * p_schedules[1] * (1 - batch_params['bat']) * m0 / M
+
+    # last day with the parameters of day 1
+    changed = (h_schedules[1:] != h_schedules[1]) | (p_schedules[1:] != p_schedules[1])
+    limit   = numpy.where(changed.any(axis=0), numpy.argmax(changed, axis=0), tmax)
+
+    if tmax < 2 or ( batch_params['ton'] > 0 ).any() or ( batch_params['saa'] != 0 ).any() or ( b * batch_params['T'] <= 1 ).any():
+        return None
+
+    limit = int(limit.min())
+    if limit < 2:
+        return None
+
+    # the kernels are followed up to the delay after which less than DELAY_TAIL of them is left, so that the long
+    # tails of models 4 and 5 do not blow up the size of the matrices (the older new cases are left out)
+    tails = numpy.cumsum(reversed_kernels, axis=1)
+    D     = max(1, int(( tails > DELAY_TAIL ).sum(axis=1).max()))
+
+    # state layout: new cases of t, t - 1, ... (D), exposed cases of t, t - 1, ... (E), active, sums of the exposed, new and outgoing
+    S      = D + E + 4
+    ACTIVE = D + E
+    delay  = batch_params['I'] - 1
+
+    A = numpy.zeros((size, S, S))
+
+    # new cases of the next day: the exposed of delay days ago (or b times the active ones when delay is 0)
+    new_row = numpy.zeros((size, S))
+    new_row[every, numpy.where(delay > 0, D + delay - 1, ACTIVE)] = numpy.where(delay > 0, 1, b)
+
+    out_row = numpy.zeros((size, S))
+    out_row[:, 0:D] = reversed_kernels[:, :-D - 1:-1]
+
+    A[:, 0] = new_row
+    A[:, D, ACTIVE] = b
+    for d in range(1, D):
+        A[:, d, d - 1] = 1
+    for e in range(1, E):
+        A[:, D + e, D + e - 1] = 1
+
+    A[:, ACTIVE]          = new_row - out_row
+    A[:, ACTIVE, ACTIVE] += 1
+    A[:, ACTIVE + 1, ACTIVE + 1] = 1
+    A[:, ACTIVE + 1, ACTIVE]     = b
+    A[:, ACTIVE + 2]             = new_row
+    A[:, ACTIVE + 2, ACTIVE + 2] = 1
+    A[:, ACTIVE + 3]             = out_row
+    A[:, ACTIVE + 3, ACTIVE + 3] = 1
+
+    x = numpy.zeros((size, S))
+    x[:, 0]      = N0
+    x[:, ACTIVE] = N0
+
+    powers = [ A ]
+    while 2 ** len(powers) <= limit:
+        powers.append(powers[-1] @ powers[-1])
+
+    t = 0
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        for k in range(len(powers) - 1, -1, -1):
+            if t + 2 ** k > limit:
+                continue
+            candidate = numpy.einsum('jab,jb->ja', powers[k], x)
+            if ( candidate[:, ACTIVE + 1] <= tolerance * M ).all():
+                x = candidate
+                t = t + 2 ** k
+
+    if t == 0:
+        return None
+
+    n = x[:, ACTIVE]
+    m = m0 - x[:, ACTIVE + 1]
+
+    K         = reversed_kernels.shape[1]
+    nc_buffer = numpy.zeros((size, 2*K))
+    incubator = numpy.zeros((size, E))
+    for d in range(0, min(D, t + 1)):
+        nc_buffer[:, (t - d) % K]     = x[:, d]
+        nc_buffer[:, (t - d) % K + K] = x[:, d]
+    for e in range(0, min(E, t)):
+        incubator[:, (t - e) % E] = x[:, D + e]
+
+    rising = n > N0
+    last   = len(h_schedules) - 1
+    rt     = h_schedules[min(t, last)] * p_schedules[min(t, last)] * batch_params['T'] * (1 - batch_params['bat']) * m / M
+
+    state = { 'n'             : n,
+              'm'             : m,
+              'i'             : batch_params['I0'] + N0 + x[:, ACTIVE + 1] * (1 - DR),
+              'nc_buffer'     : nc_buffer,
+              'incubator'     : incubator,
+              'contained'     : numpy.zeros(size, dtype=bool),
+              'window'        : numpy.zeros((size, int(numpy.maximum(batch_params['twin'], 1).max()) + 1)),
+              'window_sum'    : N0.copy(),
+              'contention'    : numpy.zeros(size, dtype=int),
+              'peak_day'      : numpy.where(rising, t, 0),
+              'peak_value'    : numpy.where(rising, n, N0),
+              'transmissions' : x[:, ACTIVE + 2],
+              'deaths'        : numpy.round(x[:, ACTIVE + 3] * DR, 0),
+              'rt_day'        : numpy.where(rt < 1, t, -1),
+              't'             : t }
+
+    return state
+
+# run a batch of scenarios for tmax days
+#
+# params maps run_simulation_web parameter names to scalars or to sequences with one value per scenario
+# scenarios with ton > 0 follow the adaptive trigger of run_simulation_web, so that many threshold choices run
+# in one batch; the summary has an extra contention_days entry with the number of days on the h2, p2 stage
+# (for the other scenarios, the days from tint to tint2 or to the end)
+# with summary_only = True only the summary (see viraly.get_summary) is kept, and the memory needed
+# does not depend on tmax: new cases are kept on a ring buffer sized to the recovery kernel support
+# incubation selects a distributed incubation period for all the scenarios, as on run_simulation_web
+#
+# in summary only mode the state can be saved at the end of the days on checkpoints (result.checkpoints maps
+# each day to a dictionary with the BATCH_STATE arrays and the day 't') and a run can resume from one of them:
+# the scenarios of the new run must match those of the checkpoint up to that day (same kernels and buffers,
+# same parameters on the days before), which is what scenarios that only differ after a common prefix do;
+# a checkpoint of a single scenario is broadcast to all the scenarios of the new run; stop ends a summary only
+# run at the end of that day (or of its step) instead of tmax, with the kernels and buffers of a tmax run, so
+# that the checkpoints of a shared prefix resume the tmax runs (its summary only covers the days that were run)
+#
+# fast_forward, in summary only mode, is the tolerance of the jump over the linear early phase (see
+# get_fast_forward), as a fraction of M; for tiny seeds and long horizons it skips the days before the
+# susceptibles start to go down, so 1e-4 keeps the summary within about that relative error
+#
+# step is the time step, in days: with step > 1 each iteration covers step days, with the rates multiplied by
+# step, the recovery and incubation kernels turned into kernels in steps (see get_step_kernel), the parameter
+# schedules and the seasonal attenuation averaged over the days of each step and the trigger window counted in
+# steps; the run goes on until the first multiple of step at or after tmax, the series have one value per step
+# (on the days of result.days) and result.get_daily interpolates them to daily values; a weekly step runs a
+# multi-year scenario about 7 times faster, as a preview of the daily run (the days in the summary and on the
+# checkpoints are still days, multiples of step)
+#
+# sink, if given, gets the values of the BATCH_SERIES of every scenario at the end of each day (or step) on its
+# write ( t, values ) method (see viraly_stream.py for sinks that write them to a file, pass them to a callback
+# or keep a decimated series); with summary_only = True the memory needed does not depend on tmax (the schedules
+# are only kept until they become constant), so decades long endemic runs stream their days in flat memory
+
+def run_simulation_batch ( params, tmax, summary_only = False, incubation = None, checkpoints = None, resume = None, fast_forward = None, step = 1, sink = None, stop = None ):
+
+    if ( checkpoints is not None or resume is not None or fast_forward is not None or stop is not None ) and not summary_only:
+        raise ValueError('checkpoints, stop and fast forward are only available in summary only mode')
+
+    if resume is not None and fast_forward is not None:
+        raise ValueError('a run can not both resume and fast forward')
+
+    if step < 1 or int(step) != step:
+        raise ValueError('the time step must be a whole number of days')
+
+    step = int(step)
+    if step > 1 and fast_forward is not None:
+        raise ValueError('fast forward is only available with daily steps')
+
+    if sink is not None and fast_forward is not None:
+        raise ValueError('fast forward skips the days that the sink would get')
+
+    # number of steps and the days they cover, and the last step that is run
+    steps = -(-tmax // step)
+    days  = steps * step
+    end   = steps if stop is None else min(steps, -(-stop // step))
+
+    p_ = get_batch_params ( params, tmax )
+
+    h_schedules, p_schedules = get_batch_schedules ( p_, get_schedule_horizon ( p_, days, step ) )
+    reversed_kernels         = get_batch_kernels ( p_, days, step )
+
+    if step > 1:
+        h_schedules = get_step_average ( h_schedules, step )
+        p_schedules = get_step_average ( p_schedules, step )
+        same_step   = get_batch_same_step ( p_, days, step )
+        own         = (step - 1) / (2 * step)    # infectious fraction of their own step, for the cases of a step
+        incubation  = ( 'fixed', ) if incubation is None else incubation
+
+    # the schedules are constant after their last row
+    last = len(h_schedules) - 1
+
+    size  = len(p_['h'])
+    D     = reversed_kernels.shape[1]
+    every = numpy.arange(0, size)
+
+    M   = p_['M']
+    N0  = p_['N0']
+    T   = p_['T'].astype(float)
+    DR  = p_['DR']
+    ddy = p_['ddy']
+    saa = p_['saa']
+    baf = 1 - p_['bat']
+
+    # incubation delay, in days, and the buffer of exposed cases that covers it
+    delay     = p_['I'] - 1
+    E         = max(1, int(delay.max()) + 1)
+    incubator = numpy.zeros((size, E))
+
+    # or, for a distributed incubation (or coarse steps), the cases that become infectious on each of the next K days
+    if incubation is not None and ( incubation[0] != 'fixed' or step > 1 ):
+        q_kernels = get_batch_incubation_kernels ( p_, days, incubation, step )
+        K         = q_kernels.shape[1]
+        q_offsets = numpy.arange(0, K)
+        q_pending = numpy.zeros((size, K))
+    else:
+        q_kernels = None
+        q_pending = None
+
+    # ring buffer of new cases, written twice so that the last D days are always a contiguous slice
+    nc_buffer = numpy.zeros((size, 2*D))
+
+    # adaptive triggers: running sum of the new cases of the window, with a ring buffer of the last twin days
+    # (the window is rounded to whole steps and its incidence scaled back to twin days)
+    triggered  = p_['ton'] > 0
+    contained  = numpy.zeros(size, dtype=bool)
+    twin       = numpy.maximum(numpy.round(p_['twin'] / step).astype(int), 1)
+    twin_scale = numpy.maximum(p_['twin'], 1) / (twin * step)
+    W          = int(twin.max()) + 1
+    window     = numpy.zeros((size, W))
+    window_sum = N0.copy()
+    contention = numpy.zeros(size, dtype=int)
+    window[:, 0] = N0
+
+    n = N0.copy()
+    i = p_['I0'] + N0
+    m = numpy.maximum(M - N0 - p_['I0'], 0)
+
+    nc_buffer[:, 0] = N0
+    nc_buffer[:, D] = N0
+
+    R0 = h_schedules[0]*p_schedules[0]*T
+
+    peak_day, peak_value, transmissions, deaths, rt_day = get_initial_summary ( N0, R0 )
+
+    # average of the seasonal cosine over the days of a step: the cosine of the middle of the step, damped
+    seasonal_shift   = (step - 1) / 2
+    seasonal_damping = numpy.sin(numpy.pi * step / 365) / (step * numpy.sin(numpy.pi / 365))
+
+    if not summary_only:
+        series = get_initial_series ( steps, N0, m, R0, i )
+
+    start = 0
+    saved = {}
+
+    if fast_forward is not None and q_kernels is None:
+        resume = get_fast_forward ( p_, h_schedules, p_schedules, reversed_kernels, E, tmax, fast_forward )
+
+    if resume is not None:
+        state = get_batch_state ( n, m, i, nc_buffer, incubator, q_pending, contained, window, window_sum, contention,
+                                  peak_day, peak_value, transmissions, deaths, rt_day )
+        for name, value in state.items():
+            if name not in resume or resume[name].shape[1:] != value.shape[1:]:
+                raise ValueError('checkpoint does not match the batch: ' + name)
+            state[name] = numpy.broadcast_to(resume[name], value.shape).copy()
+        n, m, i, nc_buffer, incubator = state['n'], state['m'], state['i'], state['nc_buffer'], state['incubator']
+        q_pending, contained, window  = state.get('q_pending'), state['contained'], state['window']
+        window_sum, contention        = state['window_sum'], state['contention']
+        peak_day, peak_value          = state['peak_day'], state['peak_value']
+        transmissions, deaths, rt_day = state['transmissions'], state['deaths'], state['rt_day']
+        start = resume['t'] // step
+
+    if sink is not None and start == 0:
+        sink.write ( 0, get_day_values ( N0, N0, numpy.zeros(size), DR, m, R0, i ) )
+
+    for k in range (start + 1, end + 1):
+
+        t = k * step
+        h = h_schedules[min(k, last)]
+        p = p_schedules[min(k, last)]
+
+        if triggered.any():
+            h = numpy.where(triggered, numpy.where(contained, p_['h2'], p_['h']), h)
+            p = numpy.where(triggered, numpy.where(contained, p_['p2'], p_['p']), p)
+            contention += contained * step
+
+        # outgoing cases from the last D days of new cases
+        pos      = k % D
+        outgoing = numpy.einsum('ij,ij->i', nc_buffer[:, pos:pos + D], reversed_kernels)
+
+        correction = numpy.maximum(1 - (M - m)/M, 0)
+        saf        = 1 - 0.5 * saa * ( seasonal_damping * numpy.cos ( 2 * numpy.pi / 365 * (t - seasonal_shift - 182 - ddy) ) + 1 )
+        bg_noise   = numpy.where(saa != 0, numpy.minimum(step, m), 0)
+        atf        = saf * baf
+
+        # with coarse steps the new cases of the step are infectious for the last own fraction of it on average (and
+        # their recoveries come as much earlier, see get_batch_recovery_kernels), which makes the exposures of the
+        # step depend on themselves through the incubation of less than a step; the susceptibles go down
+        # exponentially within the step instead of linearly
+        if step == 1:
+            nci = numpy.minimum(n*h*p*atf*correction, m) + bg_noise
+        else:
+            b        = h*p*atf*correction*step
+            pending  = q_pending[:, k % K]
+            implicit = numpy.maximum(1 - own * b * q_kernels[:, 0], 0)
+            with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                linear = numpy.where(implicit > 0, b * (n + own * pending) / implicit, numpy.inf)
+                nci    = numpy.where(m > 0, m * -numpy.expm1(-linear / m), 0) + bg_noise
+        rt  = h*p*T*correction*atf
+
+        # incubation: the cases exposed delay days ago become infectious now
+        if q_kernels is None:
+            incubator[:, t % E] = nci
+            nc = numpy.where(t - delay >= 1, incubator[every, (t - delay) % E], 0)
+        else:
+            q_pending[:, (k + q_offsets) % K] += nci[:, None] * q_kernels
+            nc = q_pending[:, k % K].copy()
+            q_pending[:, k % K] = 0
+
+        # with coarse steps, some of the new cases recover within their own step (and the initial cases in the first one)
+        if step > 1:
+            outgoing = outgoing + same_step * (nc + N0 * (k == 1))
+
+        n = numpy.maximum(n + nc - outgoing, 0)
+        m = numpy.maximum(m - nci, 0)
+        i = i + nci * (1 - DR)
+
+        nc_buffer[:, pos]     = nc
+        nc_buffer[:, pos + D] = nc
+
+        # the triggers decide the parameters of the next day from the incidence up to today
+        if triggered.any():
+            window[:, k % W] = nc
+            window_sum      += nc - numpy.where(k - twin >= 0, window[every, (k - twin) % W], 0)
+            incidence        = window_sum * INCIDENCE_UNIT / M * twin_scale
+            contained        = triggered & numpy.where(contained, incidence > p_['toff'], incidence >= p_['ton'])
+
+        values = get_day_values ( n, nc, outgoing, DR, m, rt, i )
+
+        if sink is not None:
+            sink.write ( t, values )
+
+        if summary_only:
+            peak_day, peak_value, transmissions, deaths, rt_day = get_running_summary ( t, values, peak_day, peak_value, transmissions, deaths, rt_day )
+            if checkpoints is not None and t in checkpoints:
+                saved[t] = get_batch_state ( n, m, i, nc_buffer, incubator, q_pending, contained, window, window_sum, contention,
+                                             peak_day, peak_value, transmissions, deaths, rt_day )
+                saved[t]['t'] = t
+            continue
+
+        for name in BATCH_SERIES:
+            series[name][k] = values[name]
+
+    if summary_only:
+        summary = get_final_summary ( M, m, peak_day, peak_value, transmissions, deaths, rt_day )
+        summary['contention_days'] = get_contention_days ( p_, tmax, triggered, contention )
+        result = BatchResult ( p_, tmax, summary, step = step )
+        result.checkpoints = saved
+        return result
+
+    series, summary = get_series_summary ( series, M, step )
+    summary['contention_days'] = get_contention_days ( p_, tmax, triggered, contention )
+
+    return BatchResult ( p_, tmax, summary, series, step )
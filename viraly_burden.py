@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+# Downstream burden for viraly: hospital admissions, hospital and ICU occupancy and delayed deaths
+#
+# The burden is computed after the run from the new cases, with delay distributions:
+#
+#   admissions     = hospital_rate * ( new cases * admission delay kernel )
+#   hospital       = admissions * P( hospital stay > d )
+#   icu_admissions = icu_rate * admissions
+#   icu            = icu_admissions * P( ICU stay > d )
+#   deaths         = DR * ( new cases * death delay kernel )
+#
+# where * is a convolution; the delays are ( average, standard deviation ) pairs of gamma distributions, in days.
+# The convolutions are FFT based, so the whole pipeline is O(n log n) on the number of days, and they run over
+# all the scenarios of a batch at once.
+#
+# Note: the deaths of run_simulation_web are DR times the cases that go out on the same day; here they are DR
+# times the new cases, delayed by the time from the onset of the infectiousness to death. The totals are the same.
+
+import numpy
+import scipy.signal
+
+from viraly import get_delay_kernel
+
+BURDEN_DEFAULTS = { 'hospital_rate'   : 0.05,       # fraction of the cases that are admitted to a hospital
+                    'admission_delay' : ( 7, 3 ),   # from the onset of the infectiousness to the admission
+                    'hospital_stay'   : ( 10, 5 ),
+                    'icu_rate'        : 0.2,        # fraction of the admissions that go to the ICU
+                    'icu_stay'        : ( 14, 7 ),
+                    'death_delay'     : ( 18, 8 ) } # from the onset of the infectiousness to death
+
+BURDEN_SERIES = [ 'admissions', 'hospital', 'icu_admissions', 'icu', 'deaths' ]
+
+### functions ###
+
+# convolution of the series (on the last axis) with a kernel, cut to the length of the series
+
+def get_convolution ( series, kernel ):
+
+    size   = series.shape[-1]
+    kernel = numpy.reshape(kernel, (1,) * (series.ndim - 1) + (len(kernel),))
+
+    result = scipy.signal.fftconvolve(series, kernel, axes=-1)[..., 0:size]
+
+    # the fft leaves tiny negative values where the result is zero
+    return numpy.maximum(result, 0)
+
+# survival function of a stay kernel: s[d] is the fraction of the admitted which are still there d days later
+
+def get_survival ( kernel ):
+
+    return 1 - numpy.cumsum(kernel)
+
+# burden series from the new cases, of shape ( days, ) or ( scenarios, days ); DR is a scalar or an array with
+# one value per scenario and options overrides the values of BURDEN_DEFAULTS
+# returns a dictionary with the BURDEN_SERIES, with the same shape as new
+
+def get_burden ( new, DR, options = None ):
+
+    burden_options = dict(BURDEN_DEFAULTS)
+    if options is not None:
+        for name in options:
+            if name not in BURDEN_DEFAULTS:
+                raise ValueError('unknown burden option: ' + name)
+        burden_options.update(options)
+
+    new  = numpy.asarray(new, dtype=float)
+    DR   = numpy.asarray(DR, dtype=float)
+    size = new.shape[-1]
+
+    if DR.ndim > 0:
+        DR = DR[:, None]
+
+    admission_kernel = get_delay_kernel ( 'gamma', *burden_options['admission_delay'], size )
+    hospital_kernel  = get_delay_kernel ( 'gamma', *burden_options['hospital_stay'], size )
+    icu_kernel       = get_delay_kernel ( 'gamma', *burden_options['icu_stay'], size )
+    death_kernel     = get_delay_kernel ( 'gamma', *burden_options['death_delay'], size )
+
+    admissions     = burden_options['hospital_rate'] * get_convolution ( new, admission_kernel )
+    icu_admissions = burden_options['icu_rate'] * admissions
+
+    return { 'admissions'     : admissions,
+             'hospital'       : get_convolution ( admissions, get_survival ( hospital_kernel ) ),
+             'icu_admissions' : icu_admissions,
+             'icu'            : get_convolution ( icu_admissions, get_survival ( icu_kernel ) ),
+             'deaths'         : DR * get_convolution ( new, death_kernel ) }
+
+# the same from a run_simulation_web dataset
+
+def get_burden_from_dataset ( dataset, DR, options = None ):
+
+    return get_burden ( dataset[1], DR, options )
@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+# Model calibration for viraly: fits parameters (ex: p for h*p, T, I, N0, tint) to an observed daily series
+#
+# The observed series is a CSV file with day,value rows (a header line is optional) where day 1 is the
+# first simulated day. It is compared either with the new cases or with the deaths of the simulation.
+#
+# The minimization is a differential evolution whose whole population is evaluated at once by the batched
+# engine (viraly_batch.py), and several independent starts run in parallel processes to avoid local minima.
+
+import sys
+import csv
+import argparse
+import multiprocessing
+import numpy
+import scipy.optimize
+
+from viraly import get_params, plot_multiple, PARAM_NAMES_WEB, YLABEL_STR
+from viraly_batch import run_simulation_batch, BATCH_INT_PARAMS
+
+FIT_SERIES = [ 'new', 'deaths' ]
+FIT_LOSSES = [ 'log', 'sse' ]
+
+STARTS_DEFAULT  = 4
+MAXITER_DEFAULT = 200
+POPSIZE_DEFAULT = 15
+
+### functions ###
+
+# load an observed series, returns the days and the values as arrays
+
+def load_observed ( filename ):
+
+    days   = []
+    values = []
+
+    with open(filename, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) == 0:
+                continue
+            try:
+                if len(row) == 1:
+                    day, value = len(days) + 1, float(row[0])
+                else:
+                    day, value = int(float(row[0])), float(row[1])
+            except ValueError:
+                # header line
+                continue
+            days.append(day)
+            values.append(value)
+
+    if len(days) == 0:
+        raise ValueError('no observations on ' + filename)
+
+    days = numpy.array(days)
+    if days.min() < 1:
+        raise ValueError('observed days must start at 1')
+
+    return days, numpy.array(values)
+
+# the simulated counterpart of the observations for every scenario of a batch result, shape ( scenarios, days )
+# deaths are not rounded here, so that the loss is smooth on the parameters
+
+def get_simulated ( result, days, series ):
+
+    if series == 'deaths':
+        return result.outgoing[:, days] * result.params['DR'][:, None]
+
+    return result.new[:, days]
+
+# loss of every scenario: mean squared error of log(1 + x), which weights the growth and the decay
+# phases alike, or mean squared error relative to the mean square of the observations
+
+def get_loss ( simulated, values, loss = 'log' ):
+
+    if loss == 'log':
+        return numpy.mean((numpy.log1p(simulated) - numpy.log1p(values))**2, axis=1)
+
+    return numpy.mean((simulated - values)**2, axis=1) / numpy.mean(values**2)
+
+# vectorized objective for differential evolution: x has shape ( parameters, candidates )
+
+class FitObjective:
+
+    def __init__ ( self, base, names, days, values, series, loss ):
+
+        self.base   = base
+        self.names  = names
+        self.days   = days
+        self.values = values
+        self.series = series
+        self.loss   = loss
+        self.tmax   = int(days.max())
+
+    def __call__ ( self, x ):
+
+        x      = numpy.atleast_2d(x.T).T
+        params = dict(self.base)
+
+        for k, name in enumerate(self.names):
+            params[name] = x[k]
+
+        result = run_simulation_batch ( params, self.tmax )
+
+        return get_loss ( get_simulated ( result, self.days, self.series ), self.values, self.loss )
+
+# one start of the multi start minimization
+
+def run_start ( args ):
+
+    objective, bounds, seed, maxiter, popsize = args
+
+    integrality = [ name in BATCH_INT_PARAMS for name in objective.names ]
+
+    result = scipy.optimize.differential_evolution ( objective, bounds, seed=seed, maxiter=maxiter, popsize=popsize, integrality=integrality,
+                                                     vectorized=True, updating='deferred', polish=False )
+
+    return result.x, float(result.fun)
+
+# fit the parameters with the given bounds ( name -> (low, high) ) to the observations
+# base holds the values of the parameters that are not fitted; returns the best parameters, their loss
+# and the ( parameters, loss ) of every start
+
+def fit ( base, bounds, days, values, series = 'new', loss = 'log', starts = STARTS_DEFAULT, jobs = None, seed = 0, maxiter = MAXITER_DEFAULT, popsize = POPSIZE_DEFAULT ):
+
+    if series not in FIT_SERIES:
+        raise ValueError('series must be one of ' + str(FIT_SERIES))
+
+    if loss not in FIT_LOSSES:
+        raise ValueError('loss must be one of ' + str(FIT_LOSSES))
+
+    names     = list(bounds)
+    objective = FitObjective ( base, names, days, values, series, loss )
+    tasks     = [ (objective, [ bounds[name] for name in names ], seed + k, maxiter, popsize) for k in range(0, starts) ]
+
+    if starts > 1:
+        with multiprocessing.Pool(processes=jobs) as pool:
+            results = pool.map(run_start, tasks)
+    else:
+        results = [ run_start(tasks[0]) ]
+
+    all_starts = [ (dict(zip(names, x.tolist())), fun) for x, fun in results ]
+    best       = min(all_starts, key=lambda start: start[1])
+
+    return best[0], best[1], all_starts
+
+# bounds from a name=low:high specification
+
+def get_bounds ( spec ):
+
+    if '=' not in spec or ':' not in spec:
+        raise ValueError('invalid fit specification: ' + spec)
+
+    name, bounds_str = spec.split('=', 1)
+    name = name.strip()
+
+    if name not in PARAM_NAMES_WEB or name in [ 'tmax', 'progressive', 'prefer_mod4', 'erlang', 'schedule' ]:
+        raise ValueError('can not fit parameter: ' + name)
+
+    low, high = [ float(v) for v in bounds_str.split(':') ]
+
+    return name, ( low, high )
+
+def main_fit ( argv ):
+
+    parser = argparse.ArgumentParser(prog='viraly.py fit', description='Fit parameters to an observed daily series.')
+    parser.add_argument('params', help='base parameters, as a comma separated string in the usual viraly.py format (tmax is ignored)')
+    parser.add_argument('-d', '--data', required=True, help='CSV file with day,value rows')
+    parser.add_argument('-f', '--fit', action='append', required=True, help='fitted parameter and its bounds: name=low:high (repeatable)')
+    parser.add_argument('-s', '--series', default='new', choices=FIT_SERIES, help='simulated series to compare with the data')
+    parser.add_argument('-l', '--loss', default='log', choices=FIT_LOSSES, help='loss function')
+    parser.add_argument('-n', '--starts', type=int, default=STARTS_DEFAULT, help='number of independent starts')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the first start')
+    parser.add_argument('--maxiter', type=int, default=MAXITER_DEFAULT, help='maximum generations per start')
+    parser.add_argument('--plot', action='store_true', help='plot the data against the fitted model')
+
+    args = parser.parse_args(argv)
+
+    base = get_params(args.params)
+    if base is None:
+        parser.error('not enough base parameters')
+    del base['tmax']
+
+    try:
+        bounds      = dict([ get_bounds(spec) for spec in args.fit ])
+        days, values = load_observed(args.data)
+        best, loss, all_starts = fit(base, bounds, days, values, args.series, args.loss, args.starts, args.jobs, args.seed, args.maxiter)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    for params, start_loss in all_starts:
+        print('start', params, start_loss)
+
+    print('best', best, loss)
+
+    if args.plot:
+        params = dict(base)
+        params.update(best)
+        result    = run_simulation_batch ( params, int(days.max()) )
+        simulated = get_simulated ( result, numpy.arange(1, days.max() + 1), args.series )[0]
+        observed  = numpy.full(len(simulated), numpy.nan)
+        observed[days - 1] = values
+
+        plt = plot_multiple( [ observed, simulated ], [ 'Observed', 'Fitted' ], str(best), YLABEL_STR, "upper right" )
+        plt.show(block = True)
+
+    return 0
+
+### Main block ###
+
+if __name__ == "__main__":
+    sys.exit(main_fit(sys.argv[1:]))
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+# Metapopulation engine for viraly: many regions coupled by a sparse mobility / contact matrix
+#
+# Every state variable of the run_simulation_web recurrence is a vector over the regions. The force of
+# infection of region r uses the prevalence that its residents meet through the mobility matrix W:
+#
+#   new exposed in r = h_r * p_r * attenuation_r * M_r * ( W @ ( n / M ) )_r * m_r / M_r
+#
+# where W[r, j] is the share of the contacts of the residents of r that happen with residents of j (rows
+# sum to 1). With W = identity every region evolves exactly as an independent run_simulation_web run.
+# W is a scipy.sparse matrix, so each day costs one sparse matrix-vector product over the nonzeros.
+#
+# Parameters (including the stage schedules) can be given per region, as in the batched engine.
+
+import csv
+import numpy
+import scipy.sparse
+
+from viraly_batch import BatchResult, get_batch_params, get_batch_schedules, get_batch_kernels, get_initial_summary, get_initial_series, get_day_values, get_running_summary, get_final_summary, get_series_summary, check_fixed_stages, BATCH_SERIES
+
+### functions ###
+
+# read a mobility matrix from a CSV edge list with from,to,weight rows (region indices start at 0)
+# the rows are normalized to sum 1; regions without outgoing edges only mix with themselves
+
+def load_mobility ( filename, regions ):
+
+    sources = []
+    targets = []
+    weights = []
+
+    with open(filename, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                source, target, weight = int(row[0]), int(row[1]), float(row[2])
+            except ValueError:
+                # header line
+                continue
+            sources.append(source)
+            targets.append(target)
+            weights.append(weight)
+
+    mobility = scipy.sparse.coo_matrix((weights, (sources, targets)), shape=(regions, regions)).tocsr()
+
+    return get_normalized_mobility ( mobility )
+
+# normalize the rows of a mobility matrix to sum 1
+
+def get_normalized_mobility ( mobility ):
+
+    mobility = scipy.sparse.csr_matrix(mobility, dtype=float)
+    totals   = numpy.asarray(mobility.sum(axis=1)).ravel()
+
+    isolated         = totals == 0
+    totals[isolated] = 1
+
+    mobility = scipy.sparse.diags(1 / totals) @ mobility
+    mobility = mobility + scipy.sparse.diags(isolated.astype(float))
+
+    return mobility.tocsr()
+
+# run the coupled regions for tmax days
+#
+# params maps run_simulation_web parameter names to scalars (same value on every region) or to sequences
+# with one value per region; mobility is a ( regions x regions ) scipy.sparse matrix with rows summing to 1
+# the result is a BatchResult with one "scenario" per region (see get_total_dataset for the aggregate)
+# the adaptive triggers and the distributed incubation of the batched engine are not available (ValueError)
+
+def run_simulation_meta ( params, mobility, tmax, summary_only = False ):
+
+    check_fixed_stages ( params, 'metapopulation' )
+    params = { name : value for name, value in params.items() if name != 'incubation' }
+
+    p_ = get_batch_params ( params, tmax )
+
+    h_schedules, p_schedules = get_batch_schedules ( p_, tmax )
+    reversed_kernels         = get_batch_kernels ( p_, tmax )
+
+    size = len(p_['h'])
+
+    # parameters given as scalars only: the same values on every region
+    if size == 1 and mobility.shape[0] > 1:
+        p_   = { name : numpy.full(mobility.shape[0], value[0]) for name, value in p_.items() }
+        size = mobility.shape[0]
+        h_schedules      = numpy.repeat(h_schedules, size, axis=1)
+        p_schedules      = numpy.repeat(p_schedules, size, axis=1)
+        reversed_kernels = numpy.repeat(reversed_kernels, size, axis=0)
+
+    if mobility.shape != (size, size):
+        raise ValueError('mobility matrix must be ' + str(size) + ' x ' + str(size))
+
+    mobility = scipy.sparse.csr_matrix(mobility)
+
+    D     = reversed_kernels.shape[1]
+    every = numpy.arange(0, size)
+
+    M   = p_['M']
+    N0  = p_['N0']
+    T   = p_['T'].astype(float)
+    DR  = p_['DR']
+    ddy = p_['ddy']
+    saa = p_['saa']
+    baf = 1 - p_['bat']
+
+    delay     = p_['I'] - 1
+    E         = max(1, int(delay.max()) + 1)
+    incubator = numpy.zeros((size, E))
+    nc_buffer = numpy.zeros((size, 2*D))
+
+    n = N0.copy()
+    i = p_['I0'] + N0
+    m = numpy.maximum(M - N0 - p_['I0'], 0)
+
+    nc_buffer[:, 0] = N0
+    nc_buffer[:, D] = N0
+
+    R0 = h_schedules[0]*p_schedules[0]*T
+
+    peak_day, peak_value, transmissions, deaths, rt_day = get_initial_summary ( N0, R0 )
+
+    if not summary_only:
+        series = get_initial_series ( tmax, N0, m, R0, i )
+
+    for t in range (1, tmax + 1):
+
+        h = h_schedules[t]
+        p = p_schedules[t]
+
+        pos      = t % D
+        outgoing = numpy.einsum('ij,ij->i', nc_buffer[:, pos:pos + D], reversed_kernels)
+
+        correction = numpy.maximum(1 - (M - m)/M, 0)
+        saf        = 1 - 0.5 * saa * ( numpy.cos ( 2 * numpy.pi / 365 * (t - 182 - ddy) ) + 1 )
+        bg_noise   = numpy.where(saa != 0, numpy.minimum(1, m), 0)
+        atf        = saf * baf
+
+        # infectious that the residents of each region meet, through the mobility matrix
+        met = M * (mobility @ (n / M))
+
+        nci = numpy.minimum(met*h*p*atf*correction, m) + bg_noise
+        rt  = h*p*T*correction*atf
+
+        incubator[:, t % E] = nci
+        nc = numpy.where(t - delay >= 1, incubator[every, (t - delay) % E], 0)
+
+        n = numpy.maximum(n + nc - outgoing, 0)
+        m = numpy.maximum(m - nci, 0)
+        i = i + nci * (1 - DR)
+
+        nc_buffer[:, pos]     = nc
+        nc_buffer[:, pos + D] = nc
+
+        values = get_day_values ( n, nc, outgoing, DR, m, rt, i )
+
+        if summary_only:
+            peak_day, peak_value, transmissions, deaths, rt_day = get_running_summary ( t, values, peak_day, peak_value, transmissions, deaths, rt_day )
+            continue
+
+        for name in BATCH_SERIES:
+            series[name][t] = values[name]
+
+    if summary_only:
+        return BatchResult ( p_, tmax, get_final_summary ( M, m, peak_day, peak_value, transmissions, deaths, rt_day ) )
+
+    series, summary = get_series_summary ( series, M )
+
+    return BatchResult ( p_, tmax, summary, series )
+
+# aggregate of all the regions of a full result, in the run_simulation_web dataset layout
+# Rt is averaged with the populations as weights
+
+def get_total_dataset ( result ):
+
+    M = result.params['M']
+
+    n_history  = result.active.sum(axis=0)
+    nc_history = result.new.sum(axis=0)
+    r_history  = result.recovered.sum(axis=0)
+    d_history  = result.deaths.sum(axis=0)
+    m_history  = result.susceptible.sum(axis=0)
+    rt_history = (result.rt * M[:, None]).sum(axis=0) / M.sum()
+    i_history  = result.immune.sum(axis=0)
+
+    return [ list(n_history), list(nc_history), list(r_history), list(d_history), list(m_history), list(n_history),
+             list(numpy.cumsum(r_history)), list(numpy.cumsum(d_history)), list(rt_history), list(numpy.cumsum(nc_history)), list(i_history) ]
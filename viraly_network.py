@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+# Contact network engine for viraly: node level propagation over a graph (ex: an idea through a social graph)
+#
+# The graph is a scipy.sparse CSR adjacency matrix where row u holds the nodes that u can infect. Every day
+# each infectious node infects each of its susceptible neighbours with probability h*p, where p follows the
+# usual stage schedule (or an N-stage schedule) and h scales the contacts given by the graph (1 by default). The T/L/I semantics are
+# the ones of run_simulation_web: an exposed node becomes infectious I - 1 days later and stays infectious for
+# T days (model 3), for a normally distributed duration with mean T and standard deviation L (model 4) or for
+# an erlang duration (model 5), after which it recovers or, with probability DR, dies.
+#
+# Each day only the rows of the infectious nodes are visited, so the cost follows the number of their edges
+# and graphs with millions of nodes run on a single machine.
+
+import numpy
+import scipy.sparse
+
+from viraly import get_schedule, get_schedule_object, get_erlang_stages
+from viraly_batch import check_fixed_stages, BATCH_DEFAULTS
+
+# node states
+STATE_SUSCEPTIBLE = 0
+STATE_EXPOSED     = 1
+STATE_INFECTIOUS  = 2
+STATE_RECOVERED   = 3
+STATE_DEAD        = 4
+
+### functions ###
+
+# read a graph from an edge list with one "u v" (or "u,v") pair of node indices per line, starting at 0
+# lines starting with # are ignored; the edges go both ways unless directed is True
+
+def load_graph ( filename, nodes = None, directed = False ):
+
+    with open(filename) as f:
+        delimiter = ',' if ',' in f.readline() else None
+
+    edges = numpy.loadtxt(filename, dtype=numpy.int64, comments='#', delimiter=delimiter, usecols=(0, 1), ndmin=2)
+
+    return get_graph ( edges[:, 0], edges[:, 1], nodes, directed )
+
+# CSR adjacency matrix from arrays of edge sources and targets, without self loops or repeated edges
+
+def get_graph ( sources, targets, nodes = None, directed = False ):
+
+    sources = numpy.asarray(sources, dtype=numpy.int64)
+    targets = numpy.asarray(targets, dtype=numpy.int64)
+
+    if nodes is None:
+        nodes = int(max(sources.max(), targets.max())) + 1 if len(sources) > 0 else 0
+
+    if not directed:
+        sources, targets = numpy.concatenate([ sources, targets ]), numpy.concatenate([ targets, sources ])
+
+    keep    = sources != targets
+    weights = numpy.ones(numpy.count_nonzero(keep), dtype=numpy.int8)
+    graph   = scipy.sparse.csr_matrix((weights, (sources[keep], targets[keep])), shape=(nodes, nodes))
+
+    # repeated edges were summed
+    graph.data[:] = 1
+
+    return graph
+
+# infectious period of every node of a batch: T, a normal duration with standard deviation L of at least 1 day
+# or, for model 5, the sum of the geometric durations of the k stages of the erlang chain
+
+def get_durations ( rng, size, T, L, erlang = False ):
+
+    if erlang:
+        k, rate = get_erlang_stages ( T, L )
+        return (k + rng.negative_binomial(k, rate, size)).astype(numpy.int32)
+
+    if L == 0:
+        return numpy.full(size, T, dtype=numpy.int32)
+
+    return numpy.maximum(1, numpy.round(rng.normal(T, L, size))).astype(numpy.int32)
+
+# run the propagation for tmax days
+#
+# params maps run_simulation_web parameter names to scalar values (M and tmax are not used, the graph gives
+# the population); N0 random nodes are infectious on day 0 (or the nodes on seeds) and I0 random nodes
+# are immune from the start
+# returns the aggregate series in the same dataset layout as run_simulation_web
+# the adaptive triggers and the distributed incubation are not available (ValueError)
+
+def run_simulation_network ( params, graph, tmax, seeds = None, seed = None ):
+
+    check_fixed_stages ( params, 'contact network' )
+
+    all_params = dict(BATCH_DEFAULTS)
+    all_params['tint'] = tmax
+    all_params.update(params)
+
+    T  = int(round(all_params['T']))
+    E5 = bool(all_params['erlang'])
+    L  = int(round(all_params['L'])) if all_params['prefer_mod4'] or E5 else 0
+    I  = int(round(all_params['I']))
+    DR = all_params['DR']
+
+    schedule = get_schedule_object ( all_params['schedule'] )
+
+    if schedule is not None:
+        h_schedule, p_schedule = schedule.compile ( tmax )
+    else:
+        h_schedule, p_schedule = get_schedule ( all_params['h'], all_params['p'], all_params['h2'], all_params['p2'], int(all_params['tint']),
+                                                bool(all_params['progressive']), int(all_params['ttime']), all_params['h3'], all_params['p3'],
+                                                int(all_params['tint2']), int(all_params['ttime2']), tmax )
+
+    graph = scipy.sparse.csr_matrix(graph)
+    nodes = graph.shape[0]
+    rng   = numpy.random.default_rng(seed)
+
+    state = numpy.zeros(nodes, dtype=numpy.int8)
+    timer = numpy.zeros(nodes, dtype=numpy.int32)
+
+    if seeds is None:
+        chosen = rng.choice(nodes, size=min(nodes, int(all_params['N0']) + int(all_params['I0'])), replace=False)
+        seeds  = chosen[:int(all_params['N0'])]
+        immune = chosen[int(all_params['N0']):]
+    else:
+        seeds     = numpy.asarray(seeds, dtype=numpy.int64)
+        available = numpy.setdiff1d(numpy.arange(0, nodes), seeds)
+        immune    = rng.choice(available, size=min(len(available), int(all_params['I0'])), replace=False)
+
+    state[immune] = STATE_RECOVERED
+    state[seeds]  = STATE_INFECTIOUS
+    timer[seeds]  = get_durations ( rng, len(seeds), T, L, E5 )
+
+    N0 = len(seeds)
+
+    n_history  = [ N0 ]
+    nc_history = [ N0 ]
+    r_history  = [ 0 ]
+    d_history  = [ 0 ]
+    m_history  = [ nodes - N0 - len(immune) ]
+    # day 0 has the R0 of run_simulation_web, h p T, with the transmission probability of a contact capped at 1
+    rt_history = [ float(min(1, h_schedule[0] * p_schedule[0]) * T) ]
+    i_history  = [ N0 + len(immune) ]
+
+    infectious = seeds
+    pending    = numpy.zeros(0, dtype=numpy.int64)
+    immune_now = N0 + len(immune)
+
+    for t in range (1, tmax + 1):
+
+        beta = min(1, h_schedule[t] * p_schedule[t])
+
+        # number of infectious neighbours of every node reached by the infectious nodes (their CSR rows)
+        # the nodes that end their infectious period today still count, as the n of the day before does
+        reached = graph[infectious].indices
+        exposed = numpy.zeros(0, dtype=numpy.int64)
+        rt      = 0
+
+        if len(reached) > 0:
+            susceptible = state[reached] == STATE_SUSCEPTIBLE
+            rt          = float(beta * T * numpy.count_nonzero(susceptible) / len(infectious))
+
+            candidates, pressure = numpy.unique(reached[susceptible], return_counts=True)
+            caught  = rng.random(len(candidates)) < 1 - (1 - beta)**pressure
+            exposed = candidates[caught]
+
+        # recoveries and deaths of the nodes that reached the end of their infectious period
+        ending        = infectious[timer[infectious] <= t]
+        dying         = ending[rng.random(len(ending)) < DR]
+        state[ending] = STATE_RECOVERED
+        state[dying]  = STATE_DEAD
+        infectious    = infectious[timer[infectious] > t]
+
+        state[exposed] = STATE_EXPOSED
+        timer[exposed] = t + I - 1
+
+        # exposed nodes that become infectious today (the ones just exposed too when I = 1)
+        pending  = numpy.concatenate([ pending, exposed ])
+        becoming = pending[timer[pending] <= t]
+        pending  = pending[timer[pending] > t]
+
+        state[becoming] = STATE_INFECTIOUS
+        timer[becoming] = t + get_durations ( rng, len(becoming), T, L, E5 )
+
+        infectious  = numpy.concatenate([ infectious, becoming ])
+        immune_now += len(exposed) - len(dying)
+
+        n_history.append(len(infectious))
+        nc_history.append(len(becoming))
+        r_history.append(len(ending) - len(dying))
+        d_history.append(len(dying))
+        m_history.append(m_history[-1] - len(exposed))
+        rt_history.append(rt)
+        i_history.append(immune_now)
+
+    ra_history = list(numpy.cumsum(r_history))
+    da_history = list(numpy.cumsum(d_history))
+    na_history = list(numpy.cumsum(nc_history))
+
+    return [ n_history, nc_history, r_history, d_history, m_history, n_history, ra_history, da_history, rt_history, na_history, i_history ]
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+# Intervention timing optimizer for viraly: which contention start, end and strength give the best compromise
+# between deaths, peak load and days under contention
+#
+# The candidates are drawn from a scrambled Sobol sequence over the bounds of the searched parameters (tint,
+# tint2, the stage betas through p2 and p3, ...) and evaluated by the batched engine in summary only mode.
+# All the candidates share the free expansion until their own tint, so the state at the end of each distinct
+# tint day is computed once by a single scenario run and the candidates of each tint resume from it.
+#
+# The result has the Pareto front of the candidates (no other candidate is better on every objective) and the
+# best candidate for the given objective weights, each objective being divided by its maximum over the candidates.
+
+import sys
+import argparse
+import numpy
+import scipy.stats.qmc
+
+from viraly import get_params
+from viraly_batch import run_simulation_batch, BATCH_INT_PARAMS
+
+# objectives, with the batch summary entry that measures them
+POLICY_OBJECTIVES = { 'deaths' : 'total_deaths', 'peak' : 'peak_active', 'contention' : 'contention_days' }
+
+# parameters that can be searched
+POLICY_PARAMS = [ 'tint', 'tint2', 'ttime', 'ttime2', 'h2', 'p2', 'h3', 'p3' ]
+
+WEIGHTS_DEFAULT = { 'deaths' : 1, 'peak' : 1, 'contention' : 0 }
+SAMPLES_DEFAULT = 4096
+
+SEP_COLUMNS = ' ; '
+
+### functions ###
+
+# state at the end of each of the days for the free expansion of base, from one run that stops at the last day
+# (the kernels and buffers are those of a tmax run, which is what the candidates resume)
+
+def get_prefix_checkpoints ( base, tmax, days ):
+
+    if len(days) == 0:
+        return {}
+
+    free = dict(base)
+    free['tint']  = tmax
+    free['tint2'] = 0
+    free['ton']   = 0
+
+    return run_simulation_batch ( free, tmax, summary_only=True, checkpoints=set(days), stop=max(days) ).checkpoints
+
+# candidates: a Sobol sample of the bounds, with integer days and, when there is a third stage, tint2 after the
+# end of the transition to the second one (tint + ttime, as check_params requires, and at least one day after tint)
+
+def get_candidates ( bounds, samples, seed = 0, base = None ):
+
+    base = {} if base is None else base
+
+    names   = list(bounds)
+    sampler = scipy.stats.qmc.Sobol(d=len(names), scramble=True, seed=seed)
+    unit    = sampler.random(samples)
+
+    candidates = {}
+    for k, name in enumerate(names):
+        low, high = bounds[name]
+        values    = low + unit[:, k] * (high - low)
+        if name in BATCH_INT_PARAMS:
+            values = numpy.round(values).astype(int)
+        candidates[name] = values
+
+    stage_times = [ candidates[name] if name in candidates else numpy.full(samples, base.get(name, 0)) for name in [ 'tint', 'ttime', 'tint2' ] ]
+    tint, ttime, tint2 = stage_times
+
+    if 'tint2' in candidates or ( ( 'tint' in candidates or 'ttime' in candidates ) and base.get('tint2', 0) > 0 ):
+        candidates['tint2'] = numpy.where(tint2 > 0, numpy.maximum(tint2, tint + numpy.maximum(ttime, 1)), 0).astype(int)
+
+    return candidates
+
+# evaluate the candidates, grouped by tint so that each group resumes from the checkpoint of its tint
+
+def evaluate ( base, candidates, tmax ):
+
+    size  = len(next(iter(candidates.values())))
+    tint  = candidates['tint'] if 'tint' in candidates else numpy.full(size, int(base.get('tint', tmax)))
+    days  = sorted(set(tint.tolist()))
+
+    # stage changes at day 0 or after the end need no checkpoint
+    prefix = get_prefix_checkpoints ( base, tmax, [ day for day in days if 0 < day < tmax ] )
+
+    objectives = { name : numpy.zeros(size) for name in POLICY_OBJECTIVES }
+
+    for day in days:
+        columns = numpy.flatnonzero(tint == day)
+        params  = dict(base)
+        for name, values in candidates.items():
+            params[name] = values[columns]
+        params['tint'] = day
+
+        result = run_simulation_batch ( params, tmax, summary_only=True, resume=prefix.get(day) )
+
+        for name, entry in POLICY_OBJECTIVES.items():
+            objectives[name][columns] = result.summary[entry]
+
+    return objectives
+
+# indices of the Pareto front: the candidates that no other candidate beats on every objective
+# (less or equal on all and less on at least one), computed in blocks to bound the memory
+
+def get_pareto_front ( objectives, block = 1024 ):
+
+    values = numpy.column_stack(objectives)
+    size   = len(values)
+    front  = []
+
+    for start in range(0, size, block):
+        chunk     = values[start:start + block]
+        no_worse  = (values[None, :, :] <= chunk[:, None, :]).all(axis=2)
+        better    = (values[None, :, :] <  chunk[:, None, :]).any(axis=2)
+        dominated = (no_worse & better).any(axis=1)
+        front.extend((start + numpy.flatnonzero(~dominated)).tolist())
+
+    return numpy.array(front, dtype=int)
+
+# search the schedule space; base holds the fixed parameters (as for run_simulation_batch), bounds maps the
+# searched parameters to ( low, high ) and weights maps the POLICY_OBJECTIVES to their weights
+# returns a dictionary with the candidates, their objectives, the indices of the Pareto front and of the best
+# weighted candidate, and the parameters of the latter
+
+def optimize_policy ( base, bounds, tmax, weights = WEIGHTS_DEFAULT, samples = SAMPLES_DEFAULT, seed = 0 ):
+
+    for name in bounds:
+        if name not in POLICY_PARAMS:
+            raise ValueError('can not search parameter: ' + name + ', available: ' + str(POLICY_PARAMS))
+
+    for name in weights:
+        if name not in POLICY_OBJECTIVES:
+            raise ValueError('unknown objective: ' + name)
+
+    if base.get('ton', 0) > 0:
+        raise ValueError('the adaptive triggers do not have a timing to optimize')
+
+    if base.get('schedule') is not None:
+        raise ValueError('the optimized timing is the one of the stages, not of an N-stage schedule')
+
+    candidates = get_candidates ( bounds, samples, seed, base )
+    objectives = evaluate ( base, candidates, tmax )
+
+    names = list(POLICY_OBJECTIVES)
+    front = get_pareto_front ( [ objectives[name] for name in names ] )
+
+    score = numpy.zeros(samples)
+    for name, weight in weights.items():
+        scale = objectives[name].max()
+        if scale > 0:
+            score += weight * objectives[name] / scale
+
+    best = int(numpy.argmin(score))
+
+    return { 'candidates' : candidates, 'objectives' : objectives, 'front' : front, 'best' : best,
+             'best_params' : { name : values[best].item() for name, values in candidates.items() } }
+
+def print_front ( result ):
+
+    names      = list(result['candidates'])
+    objectives = list(POLICY_OBJECTIVES)
+
+    print(SEP_COLUMNS.join(names + objectives))
+
+    front = result['front'][numpy.argsort(result['objectives']['deaths'][result['front']])]
+
+    for j in front:
+        values = [ '{:.4g}'.format(result['candidates'][name][j]) for name in names ]
+        values = values + [ '{:.4g}'.format(result['objectives'][name][j]) for name in objectives ]
+        print(SEP_COLUMNS.join(values))
+
+# bounds from a name=low:high specification
+
+def get_bounds ( spec ):
+
+    if '=' not in spec or ':' not in spec:
+        raise ValueError('invalid bounds specification: ' + spec)
+
+    name, bounds_str = spec.split('=', 1)
+    low, high = [ float(v) for v in bounds_str.split(':') ]
+
+    return name.strip(), ( low, high )
+
+# weights from a deaths=1,peak=1,contention=0.1 specification
+
+def get_weights ( spec ):
+
+    weights = {}
+
+    for item in spec.split(','):
+        name, value = item.split('=')
+        weights[name.strip()] = float(value)
+
+    return weights
+
+def main_policy ( argv ):
+
+    parser = argparse.ArgumentParser(prog='viraly.py policy', description='Search the contention timing and strength.')
+    parser.add_argument('params', help='base parameters, as a comma separated string in the usual viraly.py format')
+    parser.add_argument('-b', '--bounds', action='append', required=True, help='searched parameter and its bounds: name=low:high (repeatable), from: ' + ','.join(POLICY_PARAMS))
+    parser.add_argument('-w', '--weights', default=','.join([ name + '=' + str(value) for name, value in WEIGHTS_DEFAULT.items() ]), help='objective weights')
+    parser.add_argument('-N', '--samples', type=int, default=SAMPLES_DEFAULT, help='number of candidates (a power of 2)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    args = parser.parse_args(argv)
+
+    base = get_params(args.params)
+    if base is None:
+        parser.error('not enough base parameters')
+    tmax = base.pop('tmax')
+
+    try:
+        bounds  = dict([ get_bounds(spec) for spec in args.bounds ])
+        weights = get_weights(args.weights)
+        result  = optimize_policy ( base, bounds, tmax, weights, args.samples, args.seed )
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print('pareto front:', len(result['front']), 'of', args.samples, 'candidates')
+    print_front ( result )
+    print('best', result['best_params'], { name : float(values[result['best']]) for name, values in result['objectives'].items() })
+
+    return 0
+
+### Main block ###
+
+if __name__ == "__main__":
+    sys.exit(main_policy(sys.argv[1:]))
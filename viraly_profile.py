@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+# Profiling of viraly runs: time spent in each phase of the engine, call counts and collapsed stacks
+#
+# A Profiler runs a function under a profile hook (sys.setprofile, which only applies to the calling thread)
+# that keeps the stack of calls and charges the time between two events to the function on top of it:
+#
+#   phases - the time of each phase of the engine: the functions of PHASES start their phase, and the functions
+#            they call (scipy, numpy, ...) are charged to it; the rest of the engine loop is 'engine'
+#   calls  - the number of calls of every function, including the hot helpers of HOT_HELPERS
+#   stacks - the time of every stack of calls, written by write_collapsed as a collapsed stack file
+#            ('viraly;viraly.run_simulation;viraly.get_next_model34 1234' lines, in microseconds) for flamegraph.pl or speedscope
+#
+# The engines run under a profiler when their EngineConfig has one (run_simulation_web ( ..., config =
+# EngineConfig ( profiler = Profiler() ) ), and the runs accumulate on it), and viraly.py --profile profiles the
+# CLI run. The hook is only installed while profiling, so there is no cost otherwise; while profiling, every call
+# costs a few microseconds more, which is not charged to the phases but shown apart on the report.
+#
+# A profiler can be shared by threads (as the EngineConfig that carries it is): each run counts on its own and
+# is added to the totals under a lock when it ends, and whether a run is active is kept per thread.
+
+import os
+import sys
+import time
+import threading
+import collections
+
+PROFILE_FILE = 'viraly-profile.folded'
+
+# the phase of each function, by ( module, function name ); c functions by ( type or module, function name )
+PHASES = { ( 'viraly', 'get_parameters' )           : 'schedule',
+           ( 'viraly', 'get_schedule' )             : 'schedule',
+           ( 'viraly', 'get_schedule_basis' )       : 'schedule',
+           ( 'viraly', 'get_schedule_object' )      : 'schedule',
+           ( 'viraly', 'get_legacy_schedule' )      : 'schedule',
+           ( 'viraly', 'compile' )                  : 'schedule',
+           ( 'viraly', 'get_next_model1' )          : 'incidence',
+           ( 'viraly', 'get_next_model2' )          : 'incidence',
+           ( 'viraly', 'get_next_model34' )         : 'incidence',
+           ( 'viraly', 'get_seasonal_attenuation' ) : 'incidence',
+           ( 'viraly', 'get_older_model3' )         : 'recovery',
+           ( 'viraly', 'get_older_model4' )         : 'recovery',
+           ( 'viraly', 'get_older_model5' )         : 'recovery',
+           ( 'viraly', 'get_fraction' )             : 'recovery',
+           ( 'viraly', 'get_recovery_kernel' )      : 'recovery',
+           ( 'viraly', 'get_erlang_stages' )        : 'recovery',
+           ( 'viraly', 'get_incubation_kernel' )    : 'incubation',
+           ( 'viraly', 'get_delay_kernel' )         : 'incubation',
+           ( 'deque', 'appendleft' )                : 'incubation',
+           ( 'deque', 'pop' )                       : 'incubation',
+           ( 'viraly', 'get_accumulated' )          : 'accumulation',
+           ( 'viraly', 'print_output' )             : 'output',
+           ( 'builtins', 'print' )                  : 'output',
+           ( 'viraly', 'plot_multiple' )            : 'plotting',
+           ( 'pyplot', 'show' )                     : 'window' }
+
+# phases in report order; 'window' is the time the plot windows were open
+PHASE_NAMES = [ 'schedule', 'incidence', 'recovery', 'incubation', 'engine', 'accumulation', 'output', 'plotting', 'window' ]
+
+# helpers whose call counts are always reported: name -> call label
+HOT_HELPERS = { 'get_fraction' : 'viraly.get_fraction', 'norm.cdf' : 'norm_gen.cdf' }
+
+# module of the methods shared by the scipy distributions, which are labelled by the type of their distribution
+SCIPY_DISTRIBUTIONS = '_distn_infrastructure'
+
+# most called functions on the report
+REPORT_CALLS = 10
+
+# bottom frame of the collapsed stacks
+ROOT_FRAME = 'viraly'
+
+### functions ###
+
+# ( module, function name ) of a python frame or of a c function
+
+def get_key ( frame, event, arg ):
+
+    if event == 'call':
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+        # ex: norm_gen.cdf rather than the cdf of every distribution
+        if module == SCIPY_DISTRIBUTIONS and frame.f_code.co_varnames[0:1] == ( 'self', ):
+            return ( type(frame.f_locals['self']).__name__, frame.f_code.co_name )
+        return ( module, frame.f_code.co_name )
+
+    owner = getattr(arg, '__self__', None)
+    if owner is not None and not isinstance(owner, type(sys)):
+        return ( type(owner).__name__, arg.__name__ )
+
+    return ( getattr(arg, '__module__', None) or 'builtins', arg.__name__ )
+
+class Profiler:
+
+    def __init__ ( self ):
+
+        self.phases  = collections.defaultdict(float)
+        self.calls   = collections.Counter()
+        self.stacks  = collections.defaultdict(float)
+        self.total   = 0
+        self.runs    = 0
+        self.lock    = threading.Lock()
+        self.local   = threading.local()
+
+    # whether the calling thread is running under this profiler
+
+    @property
+    def active ( self ):
+
+        return getattr(self.local, 'active', False)
+
+    # runs function ( *args, **kwargs ) under the profile hook and returns its result
+
+    def run ( self, function, *args, **kwargs ):
+
+        # the stack of ( collapsed stack, phase ) of the calls, from the profiled function
+        stack = [ ( ROOT_FRAME, 'engine' ) ]
+        last  = [ 0 ]
+
+        # the counts of this run, added to the totals at the end
+        phases = collections.defaultdict(float)
+        calls  = collections.Counter()
+        stacks = collections.defaultdict(float)
+
+        def hook ( frame, event, arg ):
+
+            now = time.perf_counter()
+            path, phase = stack[-1]
+            stacks[path] += now - last[0]
+            phases[phase] += now - last[0]
+
+            if event == 'call' or event == 'c_call':
+                key   = get_key ( frame, event, arg )
+                label = key[0] + '.' + key[1]
+                calls[label] += 1
+                stack.append(( path + ';' + label, PHASES.get(key, phase) ))
+            elif len(stack) > 1:
+                stack.pop()
+
+            # the time of the hook itself is not charged
+            last[0] = time.perf_counter()
+
+        previous          = sys.getprofile()
+        self.local.active = True
+        start             = time.perf_counter()
+        last[0]           = start
+        sys.setprofile(hook)
+        try:
+            return function ( *args, **kwargs )
+        finally:
+            sys.setprofile(previous)
+            self.local.active = False
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                for phase, seconds in phases.items():
+                    self.phases[phase] += seconds
+                for path, seconds in stacks.items():
+                    self.stacks[path] += seconds
+                self.calls.update(calls)
+                self.total += elapsed
+                self.runs  += 1
+
+    # human readable summary: time of each phase, calls of the hot helpers and most called functions
+
+    def get_report ( self ):
+
+        with self.lock:
+            phases, calls, total, runs = dict(self.phases), collections.Counter(self.calls), self.total, self.runs
+
+        charged = max(sum(phases.values()), 1e-12)
+        lines   = [ 'profile of {} run(s), {:.3f} s'.format(runs, total), '', 'phase ; ms ; %' ]
+
+        for phase in PHASE_NAMES + sorted(set(phases) - set(PHASE_NAMES)):
+            if phase in phases:
+                lines.append('{} ; {:.3f} ; {:.1f}'.format(phase, 1000 * phases[phase], 100 * phases[phase] / charged))
+
+        # the time of the hook is left out of the phases, it is the difference to the total
+        lines.append('(profiler) ; {:.3f} ;'.format(1000 * max(total - charged, 0)))
+
+        lines += [ '', 'hot helper ; calls' ]
+        lines += [ '{} ; {}'.format(name, calls[label]) for name, label in HOT_HELPERS.items() ]
+
+        lines += [ '', 'function ; calls' ]
+        lines += [ '{} ; {}'.format(label, count) for label, count in calls.most_common(REPORT_CALLS) ]
+
+        return '\n'.join(lines)
+
+    # writes the stacks as a collapsed stack file, one 'frame;frame;... microseconds' line per stack
+
+    def write_collapsed ( self, path = PROFILE_FILE ):
+
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+
+        with open(path, 'w') as output:
+            for stack, seconds in stacks:
+                microseconds = int(round(seconds * 1e6))
+                if microseconds > 0:
+                    output.write(stack + ' ' + str(microseconds) + '\n')
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+# Global sensitivity analysis for viraly: which inputs drive the peak load, the deaths, etc.
+#
+# Two methods are available:
+#
+#   sobol  - first order and total Sobol indices from a Saltelli design on a scrambled Sobol sequence,
+#            N * ( k + 2 ) evaluations for k parameters (Saltelli 2010 and Jansen estimators)
+#   morris - elementary effects on r random one at a time trajectories over a p level grid,
+#            r * ( k + 1 ) evaluations, mu* (mean absolute effect) and sigma (standard deviation)
+#
+# Evaluations go through the batched engine (viraly_batch.py) in summary only mode, in chunks that can be
+# spread over a process pool, so 10^5 evaluations take seconds to minutes on a single machine.
+
+import sys
+import argparse
+import multiprocessing
+import numpy
+import scipy.stats.qmc
+
+from viraly import get_params, PARAM_NAMES_WEB, SUMMARY_NAMES
+from viraly_batch import run_simulation_batch
+
+SENSITIVITY_METHODS = [ 'sobol', 'morris' ]
+
+# outputs analysed by default
+OUTPUTS_DEFAULT = [ 'peak_active', 'total_deaths' ]
+
+SAMPLES_DEFAULT = 1024
+LEVELS_DEFAULT  = 4
+CHUNK_DEFAULT   = 8192
+
+SEP_COLUMNS = ' ; '
+
+### functions ###
+
+# scale samples from the unit hypercube to the parameter ranges
+
+def scale_samples ( unit_samples, ranges ):
+
+    low  = numpy.array([ r[0] for r in ranges ])
+    high = numpy.array([ r[1] for r in ranges ])
+
+    return low + unit_samples * (high - low)
+
+# evaluate one chunk of samples, returns the summary columns
+
+def run_samples ( args ):
+
+    base, names, samples, tmax, outputs = args
+
+    params = dict(base)
+    for k, name in enumerate(names):
+        params[name] = samples[:, k]
+
+    result = run_simulation_batch ( params, tmax, summary_only=True )
+
+    return { output : result.summary[output].astype(float) for output in outputs }
+
+# evaluate all the samples, in chunks and optionally over a process pool
+
+def evaluate ( base, names, samples, tmax, outputs, chunk_size = CHUNK_DEFAULT, jobs = 1 ):
+
+    tasks = [ (base, names, samples[start:start + chunk_size], tmax, outputs) for start in range(0, len(samples), chunk_size) ]
+
+    if jobs == 1 or len(tasks) == 1:
+        parts = [ run_samples(task) for task in tasks ]
+    else:
+        with multiprocessing.Pool(processes=jobs) as pool:
+            parts = pool.map(run_samples, tasks)
+
+    return { output : numpy.concatenate([ part[output] for part in parts ]) for output in outputs }
+
+# Saltelli design: A, B and the k matrices AB_i (A with column i taken from B), stacked
+
+def get_sobol_samples ( k, N, seed = 0 ):
+
+    sampler = scipy.stats.qmc.Sobol(d=2*k, scramble=True, seed=seed)
+    AB      = sampler.random(N)
+
+    A = AB[:, :k]
+    B = AB[:, k:]
+
+    blocks = [ A, B ]
+    for i in range(0, k):
+        ABi       = A.copy()
+        ABi[:, i] = B[:, i]
+        blocks.append(ABi)
+
+    return numpy.vstack(blocks)
+
+# first order and total indices from the outputs of a Saltelli design
+
+def get_sobol_indices ( y, k, N ):
+
+    fA  = y[0:N]
+    fB  = y[N:2*N]
+    var = numpy.var(numpy.concatenate([ fA, fB ]))
+
+    first = numpy.zeros(k)
+    total = numpy.zeros(k)
+
+    if var == 0:
+        return first, total
+
+    for i in range(0, k):
+        fABi     = y[(2 + i)*N:(3 + i)*N]
+        first[i] = numpy.mean(fB * (fABi - fA)) / var
+        total[i] = 0.5 * numpy.mean((fA - fABi)**2) / var
+
+    return first, total
+
+# Morris trajectories: r random starting points on a p level grid, one parameter moving by delta at each step
+
+def get_morris_samples ( k, r, p = LEVELS_DEFAULT, seed = 0 ):
+
+    rng   = numpy.random.default_rng(seed)
+    delta = p / (2 * (p - 1))
+
+    # starting points on the levels that allow a step of +delta
+    levels = numpy.arange(0, p // 2) / (p - 1)
+
+    trajectories = []
+    for j in range(0, r):
+        x     = rng.choice(levels, size=k)
+        order = rng.permutation(k)
+        points = [ x.copy() ]
+        for i in order:
+            x       = x.copy()
+            x[i]    = x[i] + delta
+            points.append(x)
+        trajectories.append(numpy.array(points))
+
+    return numpy.vstack(trajectories), delta
+
+# mu* and sigma of the elementary effects, in units of the output per unit of the (scaled) parameter range
+
+def get_morris_indices ( samples, y, k, r, delta ):
+
+    effects = [ [] for i in range(0, k) ]
+
+    for j in range(0, r):
+        points  = samples[j*(k + 1):(j + 1)*(k + 1)]
+        outputs = y[j*(k + 1):(j + 1)*(k + 1)]
+        for step in range(0, k):
+            i = int(numpy.argmax(numpy.abs(points[step + 1] - points[step])))
+            effects[i].append((outputs[step + 1] - outputs[step]) / delta)
+
+    mu_star = numpy.array([ numpy.mean(numpy.abs(e)) for e in effects ])
+    sigma   = numpy.array([ numpy.std(e) for e in effects ])
+
+    return mu_star, sigma
+
+# run a sensitivity analysis; ranges maps parameter names to ( low, high )
+# returns { output : { 'names' : ..., index name : array } } where the index names are
+# 'first' and 'total' for sobol and 'mu_star' and 'sigma' for morris
+
+def run_sensitivity ( base, ranges, tmax, method = 'sobol', samples = SAMPLES_DEFAULT, outputs = OUTPUTS_DEFAULT, seed = 0, jobs = 1, chunk_size = CHUNK_DEFAULT ):
+
+    names = list(ranges)
+    k     = len(names)
+
+    for output in outputs:
+        if output not in SUMMARY_NAMES:
+            raise ValueError('unknown output: ' + output)
+
+    if method == 'sobol':
+        unit_samples = get_sobol_samples ( k, samples, seed )
+    elif method == 'morris':
+        unit_samples, delta = get_morris_samples ( k, samples, LEVELS_DEFAULT, seed )
+    else:
+        raise ValueError('method must be one of ' + str(SENSITIVITY_METHODS))
+
+    scaled = scale_samples ( unit_samples, [ ranges[name] for name in names ] )
+    y      = evaluate ( base, names, scaled, tmax, outputs, chunk_size, jobs )
+
+    indices = {}
+    for output in outputs:
+        if method == 'sobol':
+            first, total    = get_sobol_indices ( y[output], k, samples )
+            indices[output] = { 'names' : names, 'first' : first, 'total' : total }
+        else:
+            mu_star, sigma  = get_morris_indices ( unit_samples, y[output], k, samples, delta )
+            indices[output] = { 'names' : names, 'mu_star' : mu_star, 'sigma' : sigma }
+
+    indices['evaluations'] = len(scaled)
+
+    return indices
+
+def print_indices ( indices, outputs ):
+
+    for output in outputs:
+        print()
+        print(output)
+        columns = [ key for key in indices[output] if key != 'names' ]
+        print('parameter', SEP_COLUMNS.join(columns))
+        for j, name in enumerate(indices[output]['names']):
+            print(name, SEP_COLUMNS.join([ '{:.4g}'.format(indices[output][column][j]) for column in columns ]))
+
+# range from a name=low:high specification
+
+def get_range ( spec ):
+
+    if '=' not in spec or ':' not in spec:
+        raise ValueError('invalid range specification: ' + spec)
+
+    name, range_str = spec.split('=', 1)
+    name = name.strip()
+
+    if name not in PARAM_NAMES_WEB or name in [ 'tmax', 'progressive', 'prefer_mod4', 'erlang', 'schedule' ]:
+        raise ValueError('can not analyse parameter: ' + name)
+
+    low, high = [ float(v) for v in range_str.split(':') ]
+
+    return name, ( low, high )
+
+def main_sensitivity ( argv ):
+
+    parser = argparse.ArgumentParser(prog='viraly.py sensitivity', description='Global sensitivity analysis over parameter ranges.')
+    parser.add_argument('params', help='base parameters, as a comma separated string in the usual viraly.py format')
+    parser.add_argument('-r', '--range', action='append', required=True, help='analysed parameter and its range: name=low:high (repeatable)')
+    parser.add_argument('-m', '--method', default='sobol', choices=SENSITIVITY_METHODS, help='analysis method')
+    parser.add_argument('-N', '--samples', type=int, default=SAMPLES_DEFAULT, help='base samples (sobol, a power of 2) or trajectories (morris)')
+    parser.add_argument('-o', '--outputs', default=','.join(OUTPUTS_DEFAULT), help='comma separated outputs, from: ' + ','.join(SUMMARY_NAMES))
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    args = parser.parse_args(argv)
+
+    base = get_params(args.params)
+    if base is None:
+        parser.error('not enough base parameters')
+    tmax = base.pop('tmax')
+
+    outputs = args.outputs.split(',')
+
+    try:
+        ranges  = dict([ get_range(spec) for spec in args.range ])
+        indices = run_sensitivity ( base, ranges, tmax, args.method, args.samples, outputs, args.seed, args.jobs )
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print(args.method, 'evaluations:', indices['evaluations'])
+    print_indices ( indices, outputs )
+
+    return 0
+
+### Main block ###
+
+if __name__ == "__main__":
+    sys.exit(main_sensitivity(sys.argv[1:]))
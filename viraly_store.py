@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+# Memory mapped scenario store for large sweeps
+#
+# Layout of the store directory:
+#
+#   store.json   - metadata: number of runs, days, series and parameter names, sweep manifest
+#   series.dat   - raw array of shape ( runs, series, tmax + 1 ), memory mapped, never loaded as a whole
+#   summary.npy  - structured array with one record per run: parameters plus summary values
+#   done.npy     - one flag per chunk of runs, for resuming interrupted sweeps
+#
+# Queries on the summary (ex: all runs with peak_active < X and total_deaths < Y) only read summary.npy,
+# the bulk per day data is only touched when the series of a given run are requested.
+
+import os
+import json
+import numbers
+import numpy
+
+from viraly import SUMMARY_NAMES
+
+STORE_FILE   = 'store.json'
+SERIES_FILE  = 'series.dat'
+SUMMARY_FILE = 'summary.npy'
+DONE_FILE    = 'done.npy'
+
+# single precision is plenty for plotting and halves the size of the bulk file
+SERIES_DTYPE = 'float32'
+
+# series that get_dataset rebuilds a run_simulation_web dataset from
+DATASET_SERIES = [ 'active', 'new', 'recovered', 'deaths', 'susceptible', 'rt', 'immune' ]
+
+### functions ###
+
+# whether a base parameter of the store has the given value: numbers up to rounding, others (ex: schedule strings) exactly
+
+def is_same_value ( stored, value ):
+
+    if isinstance(stored, numbers.Number) and isinstance(value, numbers.Number):
+        return bool(numpy.isclose(stored, value))
+
+    return stored == value
+
+class ScenarioStore:
+
+    def __init__ ( self, path, mode = 'r' ):
+
+        with open(os.path.join(path, STORE_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.path    = path
+        self.names   = self.meta['names']
+        self.series  = self.meta['series']
+        self.runs    = self.meta['runs']
+        self.tmax    = self.meta['tmax']
+        self.base    = self.meta['base']
+
+        shape = ( self.runs, len(self.series), self.tmax + 1 )
+
+        self.summary = numpy.load(os.path.join(path, SUMMARY_FILE), mmap_mode=mode)
+        self.done    = numpy.load(os.path.join(path, DONE_FILE),    mmap_mode=mode)
+        self.data    = numpy.memmap(os.path.join(path, SERIES_FILE), dtype=self.meta['dtype'], mode=mode, shape=shape)
+
+    # write consecutive runs starting at position start, columns as produced by viraly_sweep.run_chunk
+
+    def write ( self, start, columns ):
+
+        count = len(columns[SUMMARY_NAMES[0]])
+
+        for name in self.names + SUMMARY_NAMES:
+            self.summary[name][start:start + count] = columns[name]
+
+        for k, name in enumerate(self.series):
+            self.data[start:start + count, k, :] = columns[name]
+
+    # mark a chunk as complete, after its data was flushed to disk
+
+    def set_done ( self, index ):
+
+        self.data.flush()
+        self.summary.flush()
+        self.done[index] = True
+        self.done.flush()
+
+    # indices of the runs that match all the given ranges, each given as name = ( low, high ) with
+    # None meaning unbounded; low is inclusive and high is exclusive, ex: select( total_deaths = (None, 500) )
+
+    def select ( self, **ranges ):
+
+        mask = numpy.ones(self.runs, dtype=bool)
+
+        for name, ( low, high ) in ranges.items():
+            column = self.summary[name]
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column < high
+
+        return numpy.nonzero(mask)[0]
+
+    # index of the run with the given parameters or -1 if the store does not have it
+    # parameters which were not swept must match the base parameters of the sweep
+
+    def lookup ( self, params ):
+
+        for name, value in params.items():
+            if name not in self.names and name in self.base and not is_same_value(self.base[name], value):
+                return -1
+
+        mask = numpy.ones(self.runs, dtype=bool)
+        for name in self.names:
+            if name in params:
+                mask &= numpy.isclose(self.summary[name], params[name])
+
+        matches = numpy.nonzero(mask)[0]
+
+        if len(matches) == 0:
+            return -1
+
+        return int(matches[0])
+
+    # one series (ex: 'active') of one run, as a regular array
+
+    def get_series ( self, index, name ):
+
+        return numpy.array(self.data[index, self.series.index(name)], dtype=float)
+
+    # whether the store has the series of get_dataset (a summary only sweep has none)
+
+    def has_datasets ( self ):
+
+        return all([ name in self.series for name in DATASET_SERIES ])
+
+    # rebuild the run_simulation_web dataset layout from the stored series, for the web apps
+
+    def get_dataset ( self, index ):
+
+        n_history  = self.get_series(index, 'active')
+        nc_history = self.get_series(index, 'new')
+        r_history  = self.get_series(index, 'recovered')
+        d_history  = self.get_series(index, 'deaths')
+        m_history  = self.get_series(index, 'susceptible')
+        rt_history = self.get_series(index, 'rt')
+        i_history  = self.get_series(index, 'immune')
+
+        ra_history = numpy.cumsum(r_history)
+        da_history = numpy.cumsum(d_history)
+        na_history = numpy.cumsum(nc_history)
+
+        return [ list(n_history), list(nc_history), list(r_history), list(d_history), list(m_history), list(n_history),
+                 list(ra_history), list(da_history), list(rt_history), list(na_history), list(i_history) ]
+
+# create an empty store (or open an existing one with the same sweep manifest, for resuming)
+
+def create_store ( path, manifest, series, dtype = SERIES_DTYPE ):
+
+    meta = { 'names' : manifest['names'], 'series' : series, 'runs' : manifest['runs'], 'tmax' : manifest['base']['tmax'],
+             'base' : manifest['base'], 'dtype' : dtype, 'manifest' : manifest }
+
+    meta_path = os.path.join(path, STORE_FILE)
+
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) != meta:
+                raise ValueError(path + ' contains a different sweep, refusing to resume')
+        return ScenarioStore(path, 'r+')
+
+    os.makedirs(path, exist_ok=True)
+
+    fields = [ (name, 'f8') for name in manifest['names'] + SUMMARY_NAMES ]
+    shape  = ( manifest['runs'], len(series), manifest['base']['tmax'] + 1 )
+
+    numpy.lib.format.open_memmap(os.path.join(path, SUMMARY_FILE), mode='w+', dtype=fields, shape=(manifest['runs'],)).flush()
+    numpy.lib.format.open_memmap(os.path.join(path, DONE_FILE),    mode='w+', dtype=bool,   shape=(manifest['chunks'],)).flush()
+    numpy.memmap(os.path.join(path, SERIES_FILE), dtype=dtype, mode='w+', shape=shape).flush()
+
+    # the metadata goes last, a store without it is not a store
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    return ScenarioStore(path, 'r+')
+
+def open_store ( path ):
+
+    return ScenarioStore(path, 'r')
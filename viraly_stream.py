@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+# Output sinks for viraly: where the batched engine streams the values of each day
+#
+# run_simulation_batch ( ..., summary_only=True, sink=sink ) keeps only the ring buffers that the recurrence
+# needs (the recovery kernel and incubation windows) and hands the values of the BATCH_SERIES of every scenario
+# to sink.write ( t, values ) at the end of each day, so the memory of the run does not depend on tmax:
+#
+#   FileSink       - one CSV row per day and scenario: day, scenario and the series
+#   CallbackSink   - calls a function with the day and the values
+#   DecimatedSink  - keeps at most 2 * points days in memory, halving the resolution whenever it is full
+#
+# The values are the arrays of the engine, which are reused: a sink that keeps them must copy them.
+
+import csv
+import numpy
+
+from viraly_batch import BATCH_SERIES
+
+DECIMATED_POINTS = 1000
+
+### functions ###
+
+# writes the days to a CSV file, with a header of day, scenario and the series
+
+class FileSink:
+
+    def __init__ ( self, path, names = BATCH_SERIES ):
+
+        self.names  = list(names)
+        self.file   = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+
+        self.writer.writerow([ 'day', 'scenario' ] + self.names)
+
+    def write ( self, t, values ):
+
+        columns = numpy.column_stack([ values[name] for name in self.names ])
+
+        self.writer.writerows([ [ t, j ] + row for j, row in enumerate(columns.tolist()) ])
+
+    def close ( self ):
+
+        self.file.close()
+
+# calls function ( t, values ) on each day
+
+class CallbackSink:
+
+    def __init__ ( self, function ):
+
+        self.function = function
+
+    def write ( self, t, values ):
+
+        self.function ( t, values )
+
+    def close ( self ):
+
+        pass
+
+# keeps every stride-th day of the series; when 2 * points days are kept, every other one is dropped and the
+# stride doubles, so that the memory is bounded and the kept days are evenly spaced over the whole run
+
+class DecimatedSink:
+
+    def __init__ ( self, names = BATCH_SERIES, points = DECIMATED_POINTS ):
+
+        self.names  = list(names)
+        self.points = points
+        self.stride = 1
+        self.count  = 0
+        self.days   = []
+        self.values = { name : [] for name in self.names }
+
+    def write ( self, t, values ):
+
+        if self.count % self.stride == 0:
+            self.days.append(t)
+            for name in self.names:
+                self.values[name].append(numpy.array(values[name], dtype=float))
+
+            if len(self.days) >= 2 * self.points:
+                self.days   = self.days[::2]
+                self.values = { name : kept[::2] for name, kept in self.values.items() }
+                self.stride = self.stride * 2
+
+        self.count += 1
+
+    def close ( self ):
+
+        pass
+
+    # the kept days and, for each series, an array of shape ( scenarios, kept days ) as on BatchResult
+
+    def get_series ( self ):
+
+        series = { name : numpy.column_stack(kept) if len(kept) > 0 else None for name, kept in self.values.items() }
+
+        return numpy.array(self.days, dtype=int), series
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+
+# Parameter sweeps for viraly: runs a grid (or a CSV list) of scenarios on a process pool
+# and stores the results on a chunked columnar directory which can be resumed after an interruption
+#
+# Layout of the output directory:
+#
+#   sweep.json         - manifest with the base parameters, the swept columns and the chunking
+#   chunk-000000.npz   - one numpy archive per chunk, one array per column (parameters, summary and series)
+#
+# With the summary option only the scalar summary columns are stored and the runs skip the per day histories.
+#
+# Chunks are written atomically, so a chunk file either exists complete or does not exist at all.
+#
+# Alternatively, with the store option, the results go to a memory mapped store (see viraly_store.py)
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+import numpy
+
+from viraly_store import create_store
+from viraly import run_simulation_web, get_params, check_params, get_summary_from_dataset, PARAM_NAMES_WEB, SUMMARY_NAMES, INCIDENCE_WINDOW
+
+# types of the parameters that can be swept, anything not listed here is a float
+PARAM_TYPES = { 'T' : int, 'L' : int, 'I' : int, 'tint' : int, 'tmax' : int, 'ttime' : int, 'tint2' : int, 'ttime2' : int,
+                'twin' : int, 'progressive' : bool, 'prefer_mod4' : bool, 'erlang' : bool, 'schedule' : str }
+
+# defaults for the parameters that are not part of the CLI string
+PARAM_DEFAULTS_WEB = { 'I0' : 0, 'ddy' : 0, 'saa' : 0, 'bat' : 0, 'erlang' : False, 'ton' : 0, 'toff' : 0, 'twin' : INCIDENCE_WINDOW }
+
+# series that are stored for each run, with their position on the run_simulation_web dataset
+SERIES_COLUMNS = [ ('active', 0), ('new', 1), ('recovered', 2), ('deaths', 3), ('susceptible', 4), ('rt', 8), ('immune', 10) ]
+
+MANIFEST_FILE = 'sweep.json'
+CHUNK_FORMAT  = 'chunk-{:06d}.npz'
+
+CHUNK_SIZE_DEFAULT = 256
+
+### functions ###
+
+def get_param_value ( name, value_str ):
+
+    ptype = PARAM_TYPES.get(name, float)
+
+    if ptype == bool:
+        value_str = value_str.strip().lower()
+        try:
+            # numbers (ex: 1.0 from a spreadsheet) are true when not zero
+            return float(value_str) != 0
+        except ValueError:
+            return value_str in [ 'true', 'yes', 'y', 'on' ]
+
+    if ptype == int:
+        return int(float(value_str))
+
+    if ptype == str:
+        return value_str.strip()
+
+    return float(value_str)
+
+# parse a grid specification of the form name=start:stop:step (stop included) or name=v1,v2,v3
+
+def get_grid_values ( spec ):
+
+    if '=' not in spec:
+        raise ValueError('invalid grid specification: ' + spec)
+
+    name, values_str = spec.split('=', 1)
+    name = name.strip()
+
+    if name not in PARAM_NAMES_WEB:
+        raise ValueError('unknown parameter: ' + name)
+
+    if ':' in values_str and PARAM_TYPES.get(name, float) == bool:
+        raise ValueError('a boolean parameter takes a list of values, not a range: ' + spec)
+
+    if ':' in values_str and PARAM_TYPES.get(name, float) != str:
+        start, stop, step = [ float(v) for v in values_str.split(':') ]
+        if step <= 0:
+            raise ValueError('grid step must be positive: ' + spec)
+        count  = int(round((stop - start) / step)) + 1
+        values = [ get_param_value(name, str(start + j*step)) for j in range(0, count) ]
+    else:
+        values = [ get_param_value(name, v) for v in values_str.split(',') ]
+
+    return name, values
+
+# scenario rows from the grid specifications (cartesian product, last parameter varies fastest)
+
+def get_grid_rows ( grid_specs ):
+
+    names  = []
+    values = []
+
+    for spec in grid_specs:
+        name, name_values = get_grid_values(spec)
+        if name in names:
+            raise ValueError('parameter specified twice: ' + name)
+        names.append(name)
+        values.append(name_values)
+
+    rows = [ list(row) for row in itertools.product(*values) ]
+
+    return names, rows
+
+# scenario rows from a CSV file whose header contains parameter names
+
+def get_csv_rows ( filename ):
+
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        names  = [ name.strip() for name in next(reader) ]
+
+        for name in names:
+            if name not in PARAM_NAMES_WEB:
+                raise ValueError('unknown parameter on ' + filename + ': ' + name)
+
+        rows = []
+        for row in reader:
+            if len(row) == 0:
+                continue
+            # a short row would leave its last parameters at the base values
+            if len(row) != len(names):
+                raise ValueError('line {} of {} has {} values, the header has {}'.format(reader.line_num, filename, len(row), len(names)))
+            rows.append([ get_param_value(name, value) for name, value in zip(names, row) ])
+
+    return names, rows
+
+# run all the scenarios of a chunk, returns the chunk index and its columns
+
+def run_chunk ( args ):
+
+    index, base, names, rows, summary_only = args
+
+    tmax    = base['tmax']
+    columns = {}
+
+    for k, name in enumerate(names):
+        columns[name] = numpy.array([ row[k] for row in rows ])
+
+    for column in SUMMARY_NAMES:
+        columns[column] = numpy.zeros(len(rows))
+
+    if not summary_only:
+        for column, position in SERIES_COLUMNS:
+            columns[column] = numpy.zeros((len(rows), tmax + 1))
+
+    for j in range(0, len(rows)):
+        params = dict(base)
+        params.update(zip(names, rows[j]))
+
+        if summary_only:
+            summary = run_simulation_web(**params, summary_only=True)
+        else:
+            dataset = run_simulation_web(**params)
+            summary = get_summary_from_dataset(dataset, params['M'])
+            for column, position in SERIES_COLUMNS:
+                columns[column][j] = dataset[position]
+
+        for column in SUMMARY_NAMES:
+            columns[column][j] = summary[column]
+
+    return index, columns
+
+def get_chunk_path ( outdir, index ):
+
+    return os.path.join(outdir, CHUNK_FORMAT.format(index))
+
+# write the chunk to a temporary file and move it into place so that partial chunks never exist
+
+def write_chunk ( outdir, index, columns ):
+
+    path     = get_chunk_path(outdir, index)
+    path_tmp = path + '.tmp.npz'
+
+    numpy.savez(path_tmp, **columns)
+    os.replace(path_tmp, path)
+
+# the manifest identifies the sweep; resuming into a directory with a different manifest is refused
+
+def write_manifest ( outdir, manifest ):
+
+    path = os.path.join(outdir, MANIFEST_FILE)
+
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f) != manifest:
+                raise ValueError(outdir + ' contains a different sweep, refusing to resume')
+        return
+
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def print_progress ( done, total, start_time ):
+
+    elapsed = time.time() - start_time
+    percent = 100 * done / max(total, 1)
+
+    sys.stderr.write('\r[ {:6d} / {:6d} chunks ] {:5.1f}% {:8.1f}s'.format(done, total, percent, elapsed))
+    sys.stderr.flush()
+
+# run a sweep; returns the number of chunks that were computed (as opposed to skipped)
+
+def run_sweep ( base, names, rows, outdir, chunk_size = CHUNK_SIZE_DEFAULT, jobs = None, progress = True, summary_only = False, store = False ):
+
+    if 'tmax' in names and not summary_only:
+        raise ValueError('tmax can not be swept because all the stored series have the same length')
+
+    for k, row in enumerate(rows):
+        if len(row) != len(names):
+            raise ValueError('scenario {} has {} values for {} parameters'.format(k, len(row), len(names)))
+
+    n_chunks = (len(rows) + chunk_size - 1) // chunk_size
+    # the hash of the rows tells apart sweeps with the same shape but different values
+    rows_hash = hashlib.sha1(json.dumps(rows).encode()).hexdigest()
+    series    = [] if summary_only else [ column for column, position in SERIES_COLUMNS ]
+
+    manifest = { 'base' : base, 'names' : names, 'runs' : len(rows), 'rows_hash' : rows_hash, 'chunk_size' : chunk_size, 'chunks' : n_chunks,
+                 'summary' : SUMMARY_NAMES, 'series' : series }
+
+    # resume: completed chunks are skipped
+    if store:
+        scenario_store = create_store(outdir, manifest, series)
+        pending        = [ index for index in range(0, n_chunks) if not scenario_store.done[index] ]
+    else:
+        os.makedirs(outdir, exist_ok=True)
+        write_manifest(outdir, manifest)
+        pending = [ index for index in range(0, n_chunks) if not os.path.exists(get_chunk_path(outdir, index)) ]
+
+    tasks = [ (index, base, names, rows[index*chunk_size:(index+1)*chunk_size], summary_only) for index in pending ]
+
+    done       = n_chunks - len(pending)
+    start_time = time.time()
+
+    if progress:
+        print_progress(done, n_chunks, start_time)
+
+    with multiprocessing.Pool(processes=jobs) as pool:
+        for index, columns in pool.imap_unordered(run_chunk, tasks):
+            if store:
+                scenario_store.write(index*chunk_size, columns)
+                scenario_store.set_done(index)
+            else:
+                write_chunk(outdir, index, columns)
+            done = done + 1
+            if progress:
+                print_progress(done, n_chunks, start_time)
+
+    if progress:
+        sys.stderr.write('\n')
+
+    return len(pending)
+
+# load a complete sweep, chunks are concatenated in order
+
+def load_sweep ( outdir ):
+
+    with open(os.path.join(outdir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    parts = []
+    for index in range(0, manifest['chunks']):
+        path = get_chunk_path(outdir, index)
+        if not os.path.exists(path):
+            raise ValueError('sweep is incomplete, missing ' + path)
+        with numpy.load(path) as chunk:
+            parts.append({ column : chunk[column] for column in chunk.files })
+
+    columns = {}
+    for column in parts[0]:
+        columns[column] = numpy.concatenate([ part[column] for part in parts ])
+
+    return manifest, columns
+
+def main_sweep ( argv ):
+
+    parser = argparse.ArgumentParser(prog='viraly.py sweep', description='Run a parameter sweep on a process pool.')
+    parser.add_argument('params', help='base parameters, as a comma separated string in the usual viraly.py format')
+    parser.add_argument('-g', '--grid', action='append', default=[], help='swept parameter: name=start:stop:step or name=v1,v2,... (repeatable)')
+    parser.add_argument('-c', '--csv', help='CSV file with one scenario per row and parameter names on the header')
+    parser.add_argument('-o', '--output', required=True, help='output directory (resumed if it already exists)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE_DEFAULT, help='scenarios per chunk')
+    parser.add_argument('-s', '--summary', action='store_true', help='store only the summary columns (faster, much smaller output)')
+    parser.add_argument('--store', action='store_true', help='write to a memory mapped scenario store (see viraly_store.py) instead of npz chunks')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress indicator')
+
+    args = parser.parse_args(argv)
+
+    try:
+        base = get_params(args.params)
+        if base is None:
+            parser.error('not enough base parameters')
+        base.update(PARAM_DEFAULTS_WEB)
+
+        if args.csv and args.grid:
+            raise ValueError('use either --grid or --csv')
+        if args.csv:
+            names, rows = get_csv_rows(args.csv)
+        else:
+            names, rows = get_grid_rows(args.grid)
+
+        if args.store and 'schedule' in names:
+            raise ValueError('the scenario store only holds numeric parameters, sweep the schedules with npz chunks')
+
+        # check the stage times of every scenario before spending time on them
+        for row in rows:
+            params = dict(base)
+            params.update(zip(names, row))
+            error = check_params(params)
+            if error:
+                raise ValueError(error)
+
+        run_sweep(base, names, rows, args.output, args.chunk_size, args.jobs, not args.quiet, args.summary, args.store)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    return 0
+
+### Main block ###
+
+if __name__ == "__main__":
+    sys.exit(main_sweep(sys.argv[1:]))
@@ -7,5 +7,5 @@ MYORIGIN=`hostname -f`
 MYORIGIN_STAGING=$HOSTNAME_COMP.staging.`hostname -d`
 
 cd $MYDIR
-bokeh serve --disable-index --allow-websocket-origin=$MYORIGIN --allow-websocket-origin=$MYORIGIN_STAGING viral.py viral2.py viral-long.py viral-staging.py viral-marketing.py viral-simple.py viral-xmas.py viral-seasonal.py viral-delta.py hw.py lgc.py
+bokeh serve --disable-index --allow-websocket-origin=$MYORIGIN --allow-websocket-origin=$MYORIGIN_STAGING viral.py viral2.py viral-long.py viral-staging.py viral-marketing.py viral-simple.py viral-xmas.py viral-seasonal.py viral-delta.py viral-sensitivity.py hw.py lgc.py
 
@@ -13,6 +13,7 @@ from bokeh.plotting import figure
 
 # imports from separate  file
 from viraly import *
+from viraly_analytic import get_critical_immunity
 
 ### Configuration
 
@@ -181,11 +182,13 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
                                                                                                                                                   tint=tint, tmax=tmax, M=M, N0=N0, DR=DR,           \
                                                                                                                                                   progressive=progressive, ttime=ttime, h3=h3, p3=p3,\
                                                                                                                                                   tint2=tint2, ttime2=ttime2, prefer_mod4=prefer_mod4, I0=I0)
+    # the stages as an N-stage schedule, which is what the engine runs (the CLI string above has the stages)
+    schedule   = get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
     print(str_params)
 
     # this function is included from viraly.py
-    silent = True
-    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4, I0 )
+    config = EngineConfig ( prefer_mod4 = prefer_mod4 )
+    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, I0=I0, schedule=schedule, config=config )
 
     # dataset from viraly.py: [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history, i_history ]
     # we chop the first element because it is the initial condition (ex: new cases don't make sense there, especially on a second wave simulation )
@@ -327,8 +330,9 @@ def reset_data():
     update_data('xxxx',0,0)
 
 def vaccinate_data():
-    R0       = h1.value * (p1.value / 100) * period.value
-    im.value  = max ((1 - 1 / (R0)) * 100, 0)
+    # critical proportion of the model in use (not 1 - 1/R0)
+    beta      = h1.value * (p1.value / 100)
+    im.value  = float(get_critical_immunity ( beta, period.value, period_stdev.value )) * 100
 
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
@@ -8,7 +8,7 @@ import numpy as np
 
 from bokeh.io import curdoc
 from bokeh.layouts import column, row
-from bokeh.models import ColumnDataSource, Slider, TextInput, BoxAnnotation, HoverTool, Button, Spacer, Div
+from bokeh.models import ColumnDataSource, Slider, TextInput, BoxAnnotation, HoverTool, Button, Toggle, Spacer, Div
 from bokeh.plotting import figure
 
 # imports from separate  file
@@ -61,6 +61,9 @@ T_STDEV_MIN   = 0
 T_STDEV_MAX   = 3
 T_STDEV_START = 0
 
+# the standard deviation runs model 4 by default, the toggle switches to model 5 (erlang stages, much faster)
+MODEL5_START = False
+
 # Latent period
 # Not the same as incubation period, and can be shorter:
 # https://en.wikipedia.org/wiki/Latent_period_(epidemiology)
@@ -128,7 +131,9 @@ PLOT8_TITLE =str(INCIDENCE_PERIOD) + ' day incidence per 100m habitants'
 PLOT9_TITLE ='Prevalence'
 
 T_LABEL       = 'Infectious Period'
+SCHEDULE_LABEL = 'Schedule (day:h:p[:linear|smooth];... replaces the stages)'
 T_STDEV_LABEL = 'Infectious Period Standard Deviation'
+MODEL5_LABEL  = 'Fast standard deviation (model 5)'
 L_LABEL       = 'Latent Period'
 POP_LABEL     = 'Population (Millions)'
 IIF_LABEL     = 'Initial number of infections'
@@ -154,7 +159,7 @@ TEXT_NOTES    ='<b>Notes:</b><br/>\
 ### Functions
 
 # the function that we are plotting
-def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change ):
+def get_data(x, pop, n0, period, period_stdev, model5, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, schedule_str = '' ):
 
     h  = 1
     p  = float (b1 / 10) # input is multiplied by 10 for precision on the sliders
@@ -176,21 +181,32 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
     ttime2 = tr2
 
     # decide which model to use based on the value of L
+    # the distributed recovery time uses model 4, or model 5 (much faster on a long simulation) with the toggle
     if L == 0:
         prefer_mod4 = False
+        erlang      = False
     else:
-        prefer_mod4 = True
+        prefer_mod4 = not model5
+        erlang      = model5
 
     # prepare debug friendly string for CLI troubleshoot
     str_params = '{h},{p},{T},{L},{I},{h2},{p2},{tint},{tmax},{M},{N0},{DR},{progressive},{ttime},{h3},{p3},{tint2},{ttime2},{prefer_mod4}'.format(h=h, p=p, T=T, L=L, I=I, h2=h2,p2=p2,       \
                                                                                                                                             tint=tint, tmax=tmax, M=M, N0=N0, DR=DR,           \
                                                                                                                                             progressive=progressive, ttime=ttime, h3=h3, p3=p3,\
                                                                                                                                             tint2=tint2, ttime2=ttime2, prefer_mod4=prefer_mod4)
+    # a schedule typed by the user replaces the stages of the sliders, which the CLI string above has;
+    # otherwise the stages run as an N-stage schedule, which is what the engine runs
+    user_schedule, error = get_schedule_input ( schedule_str )
+    if user_schedule is None:
+        schedule = get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
+    else:
+        schedule   = user_schedule
+        str_params = str_params + ',schedule=' + str(schedule)
     print(str_params)
 
     # this function is included from viraly.py
-    silent = True
-    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4 )
+    config = EngineConfig ( prefer_mod4 = prefer_mod4, erlang = erlang )
+    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, schedule=schedule, config=config )
 
     # dataset from viraly.py: [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history ]
     # we chop the first element because it is the initial condition (ex: new cases don't make sense there, especially on a second wave simulation )
@@ -235,7 +251,7 @@ def update_data(attrname, old, new):
 
     # Generate the new curve with the slider values
     x = np.linspace(0, DAYS, DAYS)
-    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True )
+    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, model5.active, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True, schedule_str=schedule_input.value )
 
     # Only the global variable data sources need to be updated
     source_active.data = dict(x=x, y=y1)
@@ -267,11 +283,18 @@ def update_data(attrname, old, new):
     stats_str     = 'Transmissions: ' + str(ar_stats[0]) + '<br/>Recoveries: ' + str(ar_stats[1]) + '<br/>Deaths: ' + str(ar_stats[2])
     stats.text = stats_str
 
+# the schedule input shows why a schedule is not valid (the stages run instead)
+def update_schedule(attrname, old, new):
+    user_schedule, error = get_schedule_input ( schedule_input.value )
+    schedule_input.title = SCHEDULE_LABEL if error is None else SCHEDULE_LABEL + ': ' + error
+    update_data(attrname, old, new)
+
 def reset_data():
     population.value   = POP_START
     iinfections.value  = IIF_START
     period.value       = T_START
     period_stdev.value = T_STDEV_START
+    model5.active      = MODEL5_START
     latent.value   = L_START
     duration1.value    = DUR1_START
     duration2.value    = DUR2_START
@@ -282,6 +305,8 @@ def reset_data():
     beta3.value        = BETA3_START
     drate.value        = DRATE_START
 
+    schedule_input.value = ''
+
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
 
@@ -293,6 +318,7 @@ iinfections = Slider(title=IIF_LABEL, value=IIF_START, start=IIF_MIN, end=IIF_MA
 
 period       = Slider(title=T_LABEL,       value=T_START,       start=T_MIN,       end=T_MAX,       step=1)
 period_stdev = Slider(title=T_STDEV_LABEL, value=T_STDEV_START, start=T_STDEV_MIN, end=T_STDEV_MAX, step=1)
+model5       = Toggle(label=MODEL5_LABEL, active=MODEL5_START)
 
 latent = Slider(title=L_LABEL, value=L_START, start=L_MIN, end=L_MAX, step=1)
 
@@ -308,6 +334,9 @@ beta3 = Slider(title=BETA3_LABEL, value=BETA3_START, start=BETA_MIN, end=BETA3_M
 
 drate = Slider(title=DRATE_LABEL, value=DRATE_START, start=DRATE_MIN, end=DRATE_MAX, step=DRATE_STEP)
 
+# N-stage schedule, in the string form of the CLI (see viraly.Schedule)
+schedule_input = TextInput(title=SCHEDULE_LABEL, value='')
+
 button = Button(label="Reset", button_type="default")
 
 # text widgets
@@ -321,12 +350,16 @@ notes   = Div(text='', width=TEXT_WIDTH)
 for w in [population, iinfections, period, period_stdev, latent, duration1, duration2, transition1, transition2, beta1, beta2, beta3, drate ]:
     w.on_change('value_throttled', update_data)
 
+model5.on_change('active', update_data)
+
+schedule_input.on_change('value', update_schedule)
+
 # reset button call back
 button.on_click(reset_data)
 
 # initial plot
 x = np.linspace(1, DAYS, DAYS)
-y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True )
+y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, model5.active, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True, schedule_str=schedule_input.value )
 
 # Active, New, Recovered, Dead, Rt, % Immunine
 source_active = ColumnDataSource(data=dict(x=x, y=y1))
@@ -528,9 +561,7 @@ notes.text    = TEXT_NOTES
 
 # Set up layouts and add to document
 notespacer = Spacer(width=TEXT_WIDTH, height=10, width_policy='auto', height_policy='fixed')
-#inputs = column(intro, population, iinfections, period, period_stdev, latent, duration1, transition1, duration2, transition2, beta1, beta2, beta3, drate, button, summary, stats, notespacer, notes)
-# not adding STDEV as it is too slow on a long simulation
-inputs = column(intro, population, iinfections, period,                latent, duration1, transition1, duration2, transition2, beta1, beta2, beta3, drate, button, summary, stats, notespacer, notes)
+inputs = column(intro, population, iinfections, period, period_stdev, model5, latent, duration1, transition1, duration2, transition2, beta1, beta2, beta3, drate, schedule_input, button, summary, stats, notespacer, notes)
 
 curdoc().title = PAGE_TITLE
 
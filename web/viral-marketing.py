@@ -115,6 +115,7 @@ PLOT8_TITLE =str(INCIDENCE_PERIOD) + ' day incidence per 100m'
 PLOT9_TITLE ='Prevalence'
 
 T_LABEL       = 'Stickyness period'
+SCHEDULE_LABEL = 'Schedule (day:h:p[:linear|smooth];... replaces the stages)'
 T_STDEV_LABEL = 'NOT IN USE Infectious Period Standard Deviation'
 L_LABEL       = 'Latent Period'
 POP_LABEL     = 'Relevant audience size (Millions)'
@@ -136,7 +137,7 @@ TEXT_NOTES    ='<b>Notes:</b><br/>\
 ### Functions
 
 # the function that we are plotting
-def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change ):
+def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, schedule_str = '' ):
 
     h  = 1
     p  = float (b1 / 100) # input is multiplied by 100 for precision on the sliders
@@ -168,11 +169,19 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
                                                                                                                                             tint=tint, tmax=tmax, M=M, N0=N0, DR=DR,           \
                                                                                                                                             progressive=progressive, ttime=ttime, h3=h3, p3=p3,\
                                                                                                                                             tint2=tint2, ttime2=ttime2, prefer_mod4=prefer_mod4)
+    # a schedule typed by the user replaces the stages of the sliders, which the CLI string above has;
+    # otherwise the stages run as an N-stage schedule, which is what the engine runs
+    user_schedule, error = get_schedule_input ( schedule_str )
+    if user_schedule is None:
+        schedule = get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
+    else:
+        schedule   = user_schedule
+        str_params = str_params + ',schedule=' + str(schedule)
     print(str_params)
 
     # this function is included from viraly.py
-    silent = True
-    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4 )
+    config = EngineConfig ( prefer_mod4 = prefer_mod4 )
+    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, schedule=schedule, config=config )
 
     # dataset from viraly.py: [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history ]
     # we chop the first element because it is the initial condition (ex: new cases don't make sense there, especially on a second wave simulation )
@@ -217,7 +226,7 @@ def update_data(attrname, old, new):
 
     # Generate the new curve with the slider values
     x = np.linspace(0, DAYS, DAYS)
-    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True )
+    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, schedule_str=schedule_input.value )
 
     # Only the global variable data sources need to be updated
     source_active.data = dict(x=x, y=y1)
@@ -241,6 +250,12 @@ def update_data(attrname, old, new):
     stats_str     = pre_str + '<br/>Transmissions: ' + str(ar_stats[0]) + '<br/>Recoveries: ' + str(ar_stats[1]) + '<br/>Customers: ' + str(ar_stats[2]) + extra_str
     stats.text = stats_str
 
+# the schedule input shows why a schedule is not valid (the stages run instead)
+def update_schedule(attrname, old, new):
+    user_schedule, error = get_schedule_input ( schedule_input.value )
+    schedule_input.title = SCHEDULE_LABEL if error is None else SCHEDULE_LABEL + ': ' + error
+    update_data(attrname, old, new)
+
 def reset_data():
     population.value   = POP_START
     iinfections.value  = IIF_START
@@ -252,6 +267,8 @@ def reset_data():
     drate.value        = DRATE_START
     cpc.value          = CPC_START
 
+    schedule_input.value = ''
+
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
 
@@ -272,6 +289,9 @@ p1 = Slider(title=P1_LABEL, value=P1_START, start=P1_MIN, end=P1_MAX, step=P1_ST
 drate = Slider(title=DRATE_LABEL, value=DRATE_START, start=DRATE_MIN, end=DRATE_MAX, step=DRATE_STEP)
 cpc   = Slider(title=CPC_LABEL,   value=CPC_START,   start=CPC_MIN,   end=CPC_MAX,   step=CPC_STEP)
 
+# N-stage schedule, in the string form of the CLI (see viraly.Schedule)
+schedule_input = TextInput(title=SCHEDULE_LABEL, value='')
+
 button = Button(label="Reset", button_type="default")
 
 # text widgets
@@ -285,12 +305,14 @@ notes   = Div(text='', width=TEXT_WIDTH)
 for w in [population, iinfections, period, period_stdev, latent, h1, p1, drate, cpc ]:
     w.on_change('value_throttled', update_data)
 
+schedule_input.on_change('value', update_schedule)
+
 # reset button call back
 button.on_click(reset_data)
 
 # initial plot
 x = np.linspace(1, DAYS, DAYS)
-y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True )
+y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, schedule_str=schedule_input.value )
 
 # Active, New, Recovered, Dead, Rt, % Immunine
 source_active = ColumnDataSource(data=dict(x=x, y=y1))
@@ -453,7 +475,7 @@ notes.text    = TEXT_NOTES
 notespacer = Spacer(width=TEXT_WIDTH, height=10, width_policy='auto', height_policy='fixed')
 
 # simplified set for the marketing simulation
-inputs = column(intro, population, iinfections, period, h1, p1, drate, cpc, button, summary, stats, notespacer, notes)
+inputs = column(intro, population, iinfections, period, h1, p1, drate, cpc, schedule_input, button, summary, stats, notespacer, notes)
 
 curdoc().title = PAGE_TITLE
 
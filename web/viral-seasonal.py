@@ -13,6 +13,7 @@ from bokeh.plotting import figure
 
 # imports from separate  file
 from viraly import *
+from viraly_analytic import get_critical_immunity
 
 ### Configuration
 
@@ -134,6 +135,7 @@ PLOT8_TITLE =str(INCIDENCE_PERIOD) + ' day incidence per 100m'
 PLOT9_TITLE ='Prevalence'
 
 T_LABEL       = 'Infectious period'
+SCHEDULE_LABEL = 'Schedule (day:h:p[:linear|smooth];... replaces the stages)'
 T_STDEV_LABEL = 'NOT IN USE Infectious Period Standard Deviation'
 L_LABEL       = 'Latent Period'
 POP_LABEL     = 'Population (Millions)'
@@ -158,7 +160,7 @@ TEXT_NOTES    ='<b>Notes:</b><br/>\
 ### Functions
 
 # the function that we are plotting
-def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, IM = 0, ddy = 0, saa = 0, bat = 0 ):
+def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, IM = 0, ddy = 0, saa = 0, bat = 0, schedule_str = '' ):
 
     h  = 1
     p  = float (b1 / 100) # input is multiplied by 100 for precision on the sliders
@@ -192,11 +194,19 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
                                                                                                                                                             progressive=progressive, ttime=ttime, h3=h3, p3=p3, \
                                                                                                                                                             tint2=tint2, ttime2=ttime2, prefer_mod4=prefer_mod4,\
                                                                                                                                                             I0=I0, ddy=ddy, saa=saa, bat=bat)
+    # a schedule typed by the user replaces the stages of the sliders, which the CLI string above has;
+    # otherwise the stages run as an N-stage schedule, which is what the engine runs
+    user_schedule, error = get_schedule_input ( schedule_str )
+    if user_schedule is None:
+        schedule = get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
+    else:
+        schedule   = user_schedule
+        str_params = str_params + ',schedule=' + str(schedule)
     print(str_params)
 
     # this function is included from viraly.py
-    silent = True
-    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4, I0, ddy, saa, bat )
+    config = EngineConfig ( prefer_mod4 = prefer_mod4 )
+    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, I0=I0, ddy=ddy, saa=saa, bat=bat, schedule=schedule, config=config )
 
     # dataset from viraly.py: [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history, i_history ]
     # we chop the first element because it is the initial condition (ex: new cases don't make sense there, especially on a second wave simulation )
@@ -245,7 +255,7 @@ def update_data(attrname, old, new):
 
     # Generate the new curve with the slider values
     x = np.linspace(0, DAYS, DAYS)
-    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value, ddy.value, saa.value, bat.value )
+    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value, ddy.value, saa.value, bat.value, schedule_str=schedule_input.value )
 
     beta          = round ( h1.value * p1.value / 100 , 4)
     R0            = round ( beta * period.value , 4)
@@ -274,6 +284,12 @@ def update_data(attrname, old, new):
     stats_str     = pre_str + '<br/>Transmissions: ' + str(ar_stats[0]) + ' / ' + str(ar_stats[3]) + '%' '<br/>Recoveries: ' + str(ar_stats[1]) + '<br/>Deaths: ' + str(ar_stats[2]) + extra_str
     stats.text = stats_str
 
+# the schedule input shows why a schedule is not valid (the stages run instead)
+def update_schedule(attrname, old, new):
+    user_schedule, error = get_schedule_input ( schedule_input.value )
+    schedule_input.title = SCHEDULE_LABEL if error is None else SCHEDULE_LABEL + ': ' + error
+    update_data(attrname, old, new)
+
 def reset_data():
     population.value   = POP_START
     iinfections.value  = IIF_START
@@ -288,12 +304,15 @@ def reset_data():
     saa.value          = SAA_START
     bat.value          = BAT_START
 
+    schedule_input.value = ''
+
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
 
 def vaccinate_data():
-    R0       = h1.value * (p1.value / 100) * period.value
-    im.value  = max ((1 - 1 / (R0)) * 100, 0)
+    # critical proportion of the model in use (not 1 - 1/R0), for the season with the most transmissions
+    beta      = h1.value * (p1.value / 100)
+    im.value  = float(get_critical_immunity ( beta, period.value, period_stdev.value, attenuation = 1 - bat.value )) * 100
 
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
@@ -347,6 +366,9 @@ saa = Slider(title=SAA_LABEL, value=SAA_START, start=SAA_MIN, end=SAA_MAX, step=
 # baseline attenuation
 bat = Slider(title=BAT_LABEL, value=BAT_START, start=BAT_MIN, end=BAT_MAX, step=BAT_STEP)
 
+# N-stage schedule, in the string form of the CLI (see viraly.Schedule)
+schedule_input = TextInput(title=SCHEDULE_LABEL, value='')
+
 button  = Button(label="Reset",                         button_type="default")
 button2 = Button(label="Vaccinate critical proportion", button_type="default")
 button3 = Button(label="Vaccinate 50%",                 button_type="default")
@@ -362,6 +384,8 @@ notes   = Div(text='', width=TEXT_WIDTH)
 for w in [population, iinfections, period, period_stdev, latent, h1, p1, drate, im, ddy, saa, bat ]:
     w.on_change('value_throttled', update_data)
 
+schedule_input.on_change('value', update_schedule)
+
 # reset button call back
 button.on_click(reset_data)
 
@@ -371,7 +395,7 @@ button3.on_click(vaccinate50_data)
 
 # initial plot
 x = np.linspace(1, DAYS, DAYS)
-y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value, ddy.value, saa.value, bat.value )
+y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value, ddy.value, saa.value, bat.value, schedule_str=schedule_input.value )
 
 # aux calculations
 beta          = round ( h1.value * p1.value / 100 , 4)
@@ -561,7 +585,7 @@ plot10.add_layout(quadrant4)
 notespacer = Spacer(width=TEXT_WIDTH, height=10, width_policy='auto', height_policy='fixed')
 
 # simplified set
-inputs = column(intro, population, iinfections, period, latent, h1, p1, drate, ddy, saa, bat, im, button2, button3, button, summary, stats, notespacer, notes)
+inputs = column(intro, population, iinfections, period, latent, h1, p1, drate, ddy, saa, bat, im, schedule_input, button2, button3, button, summary, stats, notespacer, notes)
 
 curdoc().title = PAGE_TITLE
 
@@ -0,0 +1,199 @@
+'''
+Present a global sensitivity analysis of the epidemic simulation
+
+'''
+import numpy as np
+
+from bokeh.io import curdoc
+from bokeh.layouts import column, row
+from bokeh.models import ColumnDataSource, Slider, HoverTool, Button, Spacer, Div
+from bokeh.plotting import figure
+from bokeh.transform import dodge
+
+# imports from separate  file
+from viraly import *
+from viraly_sensitivity import run_sensitivity
+
+### Configuration
+
+# Geometry and visuals
+PLOT_TOOLS    ='save,reset'
+PLOT_HEIGHT   = 300
+PLOT_WIDTH    = 500
+TEXT_WIDTH    = 300
+LMARGIN_WIDTH = 20
+
+BAR_WIDTH = 0.35
+BAR_ALPHA = 0.6
+
+PLOT_X_LABEL  = 'Parameter'
+PLOT_Y_LABEL  = 'Index'
+
+PLOT_BAR_FIRST_COLOR = 'blue'
+PLOT_BAR_TOTAL_COLOR = 'red'
+
+# Simulation time
+DAYS = 365
+
+# Fixed parameters of the simulation
+POPULATION = 10.2 * 1000000
+IINFECTIONS = 100
+
+# Analysed parameters and their ranges
+#
+# Note:
+#   BETA = hp, with h = 1
+#   R0   = hpT
+#
+RANGES = { 'p'  : ( 0.1, 0.6 ),    # beta
+           'T'  : ( 5, 20 ),       # infectious period
+           'I'  : ( 1, 10 ),       # latent period
+           'DR' : ( 0.001, 0.02 ), # death rate
+           'I0' : ( 0, 0.5 * POPULATION ) } # pre immunized
+
+RANGE_LABELS = { 'p' : 'beta', 'T' : 'T', 'I' : 'latent', 'DR' : 'death rate', 'I0' : 'immune' }
+
+# log2 of the number of base samples, the number of evaluations is N * ( number of parameters + 2 )
+SAMPLES_MIN   = 6
+SAMPLES_MAX   = 13
+SAMPLES_START = 9
+
+# labels and strings
+PAGE_TITLE  ='Epidemic sensitivity analysis'
+PLOT_TITLE  ='Sensitivity of the peak of active cases'
+PLOT2_TITLE ='Sensitivity of the total deaths'
+
+SAMPLES_LABEL = 'Samples (log2)'
+
+TEXT_INTRO    = 'Sobol indices of the simulation outputs over the parameter ranges below:'
+TEXT_SUMMARY  = 'Stats:'
+TEXT_NOTES    ='<b>Notes:</b><br/>\
+              &bull; First order index: share of the output variance due to the parameter alone.<br/>\
+              &bull; Total index: share of the output variance due to the parameter, including interactions.<br/>\
+              &bull; &beta; = hp<br/>\
+              &bull; More info at <a href="https://github.com/ghomem/viraly">github.com/ghomem/viraly</a>'
+### End of configuration
+
+### Functions
+
+# the indices that we are plotting
+def get_data( log2_samples ):
+
+    base = { 'h' : 1, 'p' : 0, 'T' : 0, 'M' : POPULATION, 'N0' : IINFECTIONS }
+
+    indices = run_sensitivity ( base, RANGES, DAYS, 'sobol', 2**log2_samples, [ 'peak_active', 'total_deaths' ] )
+
+    return indices
+
+def get_source_data ( indices, output ):
+
+    names = [ RANGE_LABELS[name] for name in indices[output]['names'] ]
+
+    return dict(x=names, first=indices[output]['first'], total=indices[output]['total'])
+
+def get_ranges_text ():
+
+    lines = [ RANGE_LABELS[name] + ': ' + str(low) + ' - ' + str(high) for name, ( low, high ) in RANGES.items() ]
+
+    return '<br/>'.join(lines)
+
+# callback function for updating the data
+def update_data(attrname, old, new):
+
+    indices = get_data( samples.value )
+
+    source_peak.data   = get_source_data( indices, 'peak_active' )
+    source_deaths.data = get_source_data( indices, 'total_deaths' )
+
+    stats.text = 'Evaluations: ' + str(indices['evaluations'])
+
+def reset_data():
+    samples.value = SAMPLES_START
+
+    # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
+    update_data('xxxx',0,0)
+
+# set properties common to all the plots
+def set_plot_details ( aplot, ahover ):
+    aplot.toolbar.active_drag    = None
+    aplot.toolbar.active_scroll  = None
+    aplot.toolbar.active_tap     = None
+
+    # add the hover tool
+    aplot.add_tools(ahover)
+    aplot.toolbar.active_inspect = ahover
+
+    # control placement / visibility of toolbar
+    aplot.toolbar_location       = None
+
+    aplot.xaxis.axis_label = PLOT_X_LABEL
+    aplot.yaxis.axis_label = PLOT_Y_LABEL
+
+    aplot.y_range.start = 0
+    aplot.legend.location = 'top_right'
+
+def add_bars ( aplot, asource ):
+    aplot.vbar(x=dodge('x', -BAR_WIDTH/2, range=aplot.x_range), top='first', width=BAR_WIDTH, source=asource, fill_alpha=BAR_ALPHA, color=PLOT_BAR_FIRST_COLOR, legend_label='First order')
+    aplot.vbar(x=dodge('x',  BAR_WIDTH/2, range=aplot.x_range), top='total', width=BAR_WIDTH, source=asource, fill_alpha=BAR_ALPHA, color=PLOT_BAR_TOTAL_COLOR, legend_label='Total')
+
+### Main
+
+# Set up widgets
+samples = Slider(title=SAMPLES_LABEL, value=SAMPLES_START, start=SAMPLES_MIN, end=SAMPLES_MAX, step=1)
+
+button = Button(label="Reset", button_type="default")
+
+# text widgets
+intro   = Div(text='', width=TEXT_WIDTH)
+ranges  = Div(text='', width=TEXT_WIDTH)
+summary = Div(text='', width=TEXT_WIDTH)
+stats   = Div(text='', width=TEXT_WIDTH)
+notes   = Div(text='', width=TEXT_WIDTH)
+
+# updates are on value_throtled because this is too slow for realtime updates
+samples.on_change('value_throttled', update_data)
+
+# reset button call back
+button.on_click(reset_data)
+
+# initial plot
+indices = get_data( samples.value )
+
+source_peak   = ColumnDataSource(data=get_source_data( indices, 'peak_active' ))
+source_deaths = ColumnDataSource(data=get_source_data( indices, 'total_deaths' ))
+
+factors = source_peak.data['x']
+
+# plot 1
+
+hover = HoverTool(tooltips=[ (PLOT_X_LABEL, "@x"), ('First order', "@first{0.000}"), ('Total', "@total{0.000}")] )
+
+plot = figure(plot_height=PLOT_HEIGHT, plot_width=PLOT_WIDTH, title=PLOT_TITLE, tools=PLOT_TOOLS, x_range=factors, )
+add_bars(plot, source_peak)
+set_plot_details(plot, hover)
+
+# plot 2
+
+hover2 = HoverTool(tooltips=[ (PLOT_X_LABEL, "@x"), ('First order', "@first{0.000}"), ('Total', "@total{0.000}")] )
+
+plot2 = figure(plot_height=PLOT_HEIGHT, plot_width=PLOT_WIDTH, title=PLOT2_TITLE, tools=PLOT_TOOLS, x_range=factors, )
+add_bars(plot2, source_deaths)
+set_plot_details(plot2, hover2)
+
+# misc text
+intro.text    = TEXT_INTRO
+ranges.text   = get_ranges_text()
+summary.text  = TEXT_SUMMARY
+summary.style = { 'font-weight' : 'bold' }
+stats.text    = 'Evaluations: ' + str(indices['evaluations'])
+notes.text    = TEXT_NOTES
+
+# Set up layouts and add to document
+notespacer = Spacer(width=TEXT_WIDTH, height=10, width_policy='auto', height_policy='fixed')
+inputs = column(intro, ranges, samples, button, summary, stats, notespacer, notes)
+
+curdoc().title = PAGE_TITLE
+
+# useful for mobile scrolling on the left side
+leftmargin = Spacer(width=LMARGIN_WIDTH, height=400, width_policy='fixed', height_policy='auto')
+curdoc().add_root( row(leftmargin, inputs, column(plot, plot2)) )
@@ -13,6 +13,7 @@ from bokeh.plotting import figure
 
 # imports from separate  file
 from viraly import *
+from viraly_analytic import get_final_size, get_critical_immunity
 
 ### Configuration
 
@@ -119,6 +120,7 @@ PLOT8_TITLE =str(INCIDENCE_PERIOD) + ' day incidence per 100m'
 PLOT9_TITLE ='Prevalence'
 
 T_LABEL       = 'Infectious period'
+SCHEDULE_LABEL = 'Schedule (day:h:p[:linear|smooth];... replaces the stages)'
 T_STDEV_LABEL = 'NOT IN USE Infectious Period Standard Deviation'
 L_LABEL       = 'Latent Period'
 POP_LABEL     = 'Population (Millions)'
@@ -139,7 +141,7 @@ TEXT_NOTES    ='<b>Notes:</b><br/>\
 ### Functions
 
 # the function that we are plotting
-def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, IM = 0 ):
+def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, IM = 0, schedule_str = '' ):
 
     h  = 1
     p  = float (b1 / 100) # input is multiplied by 100 for precision on the sliders
@@ -172,11 +174,19 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
                                                                                                                                                   tint=tint, tmax=tmax, M=M, N0=N0, DR=DR,           \
                                                                                                                                                   progressive=progressive, ttime=ttime, h3=h3, p3=p3,\
                                                                                                                                                   tint2=tint2, ttime2=ttime2, prefer_mod4=prefer_mod4, I0=I0)
+    # a schedule typed by the user replaces the stages of the sliders, which the CLI string above has;
+    # otherwise the stages run as an N-stage schedule, which is what the engine runs
+    user_schedule, error = get_schedule_input ( schedule_str )
+    if user_schedule is None:
+        schedule = get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
+    else:
+        schedule   = user_schedule
+        str_params = str_params + ',schedule=' + str(schedule)
     print(str_params)
 
     # this function is included from viraly.py
-    silent = True
-    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4, I0 )
+    config = EngineConfig ( prefer_mod4 = prefer_mod4 )
+    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, I0=I0, schedule=schedule, config=config )
 
     # dataset from viraly.py: [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history, i_history ]
     # we chop the first element because it is the initial condition (ex: new cases don't make sense there, especially on a second wave simulation )
@@ -225,7 +235,7 @@ def update_data(attrname, old, new):
 
     # Generate the new curve with the slider values
     x = np.linspace(0, DAYS, DAYS)
-    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value )
+    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value, schedule_str=schedule_input.value )
 
     # Only the global variable data sources need to be updated
     source_active.data = dict(x=x, y=y1)
@@ -249,15 +259,8 @@ def update_data(attrname, old, new):
     im_threshold_f = ( 1 - 1/R0 )
     im_threshold  = max (round ( im_threshold_f*100, 2 ),0)
 
-    # ft = fine tuning
-    ft_constant            = (period.value / 2) / 100
-    ft                     = ft_constant*(R0-1)
-
-    # empirical constant
-    emp_constant          = 0.72 * (1 + ft)
-
-    # estimated transmissions (expectations vs reality)
-    est_transmissions     = round( im_threshold_f * (1+1/(R0 ** emp_constant) ) * 100 ,2)
+    # estimated transmissions (expectations vs reality), from the final size relation with the pre immunized
+    est_transmissions     = round( float(get_final_size ( R0, im.value / 100 )) * 100 ,2)
     est_transmissions_err = round( est_transmissions - ar_stats[3], 2)
 
     pre_str = '&beta;: ' + str(beta) + '<br/>R<sub>0</sub>: ' + str(R0) + '<br/>Immunity threshold: ' + str(im_threshold)+'%'
@@ -270,6 +273,12 @@ def update_data(attrname, old, new):
     stats_str   = pre_str + '<br/>Transmissions: ' + str(ar_stats[0]) + ' / ' + str(ar_stats[3]) + '%' '<br/>Recoveries: ' + str(ar_stats[1]) + '<br/>Deaths: ' + str(ar_stats[2]) + extra_str
     stats.text = stats_str
 
+# the schedule input shows why a schedule is not valid (the stages run instead)
+def update_schedule(attrname, old, new):
+    user_schedule, error = get_schedule_input ( schedule_input.value )
+    schedule_input.title = SCHEDULE_LABEL if error is None else SCHEDULE_LABEL + ': ' + error
+    update_data(attrname, old, new)
+
 def reset_data():
     population.value   = POP_START
     iinfections.value  = IIF_START
@@ -281,12 +290,15 @@ def reset_data():
     drate.value        = DRATE_START
     im.value           = IM_START
 
+    schedule_input.value = ''
+
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
 
 def vaccinate_data():
-    R0       = h1.value * (p1.value / 100) * period.value
-    im.value  = max ((1 - 1 / (R0)) * 100, 0)
+    # critical proportion of the model in use (not 1 - 1/R0)
+    beta      = h1.value * (p1.value / 100)
+    im.value  = float(get_critical_immunity ( beta, period.value, period_stdev.value )) * 100
 
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
@@ -331,6 +343,9 @@ drate = Slider(title=DRATE_LABEL, value=DRATE_START, start=DRATE_MIN, end=DRATE_
 
 im = Slider(title=IM_LABEL, value=IM_START, start=IM_MIN, end=IM_MAX, step=IM_STEP)
 
+# N-stage schedule, in the string form of the CLI (see viraly.Schedule)
+schedule_input = TextInput(title=SCHEDULE_LABEL, value='')
+
 button  = Button(label="Reset",                         button_type="default")
 button2 = Button(label="Vaccinate critical proportion", button_type="default")
 button3 = Button(label="Vaccinate 50%",                 button_type="default")
@@ -346,6 +361,8 @@ notes   = Div(text='', width=TEXT_WIDTH)
 for w in [population, iinfections, period, period_stdev, latent, h1, p1, drate, im ]:
     w.on_change('value_throttled', update_data)
 
+schedule_input.on_change('value', update_schedule)
+
 # reset button call back
 button.on_click(reset_data)
 
@@ -355,7 +372,7 @@ button3.on_click(vaccinate50_data)
 
 # initial plot
 x = np.linspace(1, DAYS, DAYS)
-y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value )
+y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, DAYS, 0, 0, 0, h1.value*p1.value, 0, 0, DAYS, drate.value, True, im.value, schedule_str=schedule_input.value )
 
 # Active, New, Recovered, Dead, Rt, % Immunine
 source_active = ColumnDataSource(data=dict(x=x, y=y1))
@@ -542,7 +559,7 @@ plot10.add_layout(quadrant4)
 notespacer = Spacer(width=TEXT_WIDTH, height=10, width_policy='auto', height_policy='fixed')
 
 # simplified set
-inputs = column(intro, population, iinfections, period, latent, h1, p1, drate, im, button2, button3, button, summary, stats, notespacer, notes)
+inputs = column(intro, population, iinfections, period, latent, h1, p1, drate, im, schedule_input, button2, button3, button, summary, stats, notespacer, notes)
 
 curdoc().title = PAGE_TITLE
 
@@ -13,6 +13,7 @@ from bokeh.plotting import figure
 
 # imports from separate  file
 from viraly import *
+from viraly_burden import get_burden_from_dataset
 
 ### Configuration
 
@@ -34,6 +35,7 @@ PLOT_LINE_ACTIVE_COLOR    = 'blue'
 PLOT_LINE_NEW_COLOR       = 'red'
 PLOT_LINE_RECOVERED_COLOR = 'green'
 PLOT_LINE_DEAD_COLOR      = 'black'
+PLOT_LINE_ICU_COLOR       = 'purple'
 
 # Bureaucracy :-)
 APP_DIR    = '/home/gustavo/viral'
@@ -115,6 +117,9 @@ DRATE_STEP  = 0.05
 # for the incidence plot
 INCIDENCE_PERIOD = 14
 
+# hospital burden options, see BURDEN_DEFAULTS on viraly_burden.py (None for the defaults)
+BURDEN_OPTIONS = None
+
 # labels and strings
 PAGE_TITLE  ='3 stage epidemic simulator'
 PLOT_TITLE  ='Active'
@@ -126,8 +131,11 @@ PLOT6_TITLE ='Accumulated cases / recoveries'
 PLOT7_TITLE ='Accumulated deaths'
 PLOT8_TITLE =str(INCIDENCE_PERIOD) + ' day incidence per 100m habitants'
 PLOT9_TITLE ='Prevalence'
+PLOT10_TITLE='Hospital occupancy'
+PLOT11_TITLE='Admissions, delayed deaths'
 
 T_LABEL       = 'Infectious Period'
+SCHEDULE_LABEL = 'Schedule (day:h:p[:linear|smooth];... replaces the stages)'
 T_STDEV_LABEL = 'Infectious Period Standard Deviation'
 L_LABEL       = 'Latent Period'
 POP_LABEL     = 'Population (Millions)'
@@ -154,7 +162,7 @@ TEXT_NOTES    ='<b>Notes:</b><br/>\
 ### Functions
 
 # the function that we are plotting
-def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change ):
+def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,b3, tmax, dr, prog_change, schedule_str = '' ):
 
     h  = 1
     p  = float (b1 / 10) # input is multiplied by 10 for precision on the sliders
@@ -186,11 +194,19 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
                                                                                                                                             tint=tint, tmax=tmax, M=M, N0=N0, DR=DR,           \
                                                                                                                                             progressive=progressive, ttime=ttime, h3=h3, p3=p3,\
                                                                                                                                             tint2=tint2, ttime2=ttime2, prefer_mod4=prefer_mod4)
+    # a schedule typed by the user replaces the stages of the sliders, which the CLI string above has;
+    # otherwise the stages run as an N-stage schedule, which is what the engine runs
+    user_schedule, error = get_schedule_input ( schedule_str )
+    if user_schedule is None:
+        schedule = get_legacy_schedule ( h, p, h2, p2, tint, progressive, ttime, h3, p3, tint2, ttime2, tmax )
+    else:
+        schedule   = user_schedule
+        str_params = str_params + ',schedule=' + str(schedule)
     print(str_params)
 
     # this function is included from viraly.py
-    silent = True
-    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, silent, prefer_mod4 )
+    config = EngineConfig ( prefer_mod4 = prefer_mod4 )
+    top_level = run_simulation_web ( h, p, T, L, I, h2, p2, tint, tmax, M, N0, DR, progressive, ttime, h3, p3, tint2, ttime2, schedule=schedule, config=config )
 
     # dataset from viraly.py: [ n_history, nc_history, list(r_history), list(d_history), m_history, n_history, ra_history, da_history, rt_history, na_history ]
     # we chop the first element because it is the initial condition (ex: new cases don't make sense there, especially on a second wave simulation )
@@ -221,21 +237,28 @@ def get_data(x, pop, n0, period, period_stdev, latent, d1, d2, tr1, tr2, b1, b2,
         my_prevalence = ( n_history[j] / ( population.value * 1000000 ) ) * 100
         pr_history.append ( my_prevalence )
 
+    # hospital burden, from the new cases
+    burden     = get_burden_from_dataset ( top_level, DR, BURDEN_OPTIONS )
+    ho_history = list(burden['hospital'][1:])
+    iu_history = list(burden['icu'][1:])
+    ad_history = list(burden['admissions'][1:])
+    dd_history = list(burden['deaths'][1:])
+
     t_transmissions = int(numpy.array(nc_history).sum())
     t_recoveries    = int(numpy.array(r_history).sum())
     t_deaths        = int(numpy.array(d_history).sum())
 
     ar_stats = [ t_transmissions, t_recoveries, t_deaths ]
 
-    # Active, New, Recovered, Dead, Rt, Immunized + accumulated Cases, Recoveries and Deaths + Stats
-    return n_history, nc_history, r_history, d_history, rt_history, im_history, na_history, ra_history, da_history, ic_history, pr_history, ar_stats
+    # Active, New, Recovered, Dead, Rt, Immunized + accumulated Cases, Recoveries and Deaths + Incidence, Prevalence + Hospital, ICU, Admissions, Delayed deaths + Stats
+    return n_history, nc_history, r_history, d_history, rt_history, im_history, na_history, ra_history, da_history, ic_history, pr_history, ho_history, iu_history, ad_history, dd_history, ar_stats
 
 # callback function dor updating the data
 def update_data(attrname, old, new):
 
     # Generate the new curve with the slider values
     x = np.linspace(0, DAYS, DAYS)
-    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True )
+    y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, y13, y14, y15, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True, schedule_str=schedule_input.value )
 
     # Only the global variable data sources need to be updated
     source_active.data = dict(x=x, y=y1)
@@ -249,6 +272,10 @@ def update_data(attrname, old, new):
     source_da.data     = dict(x=x, y=y9)
     source_ic.data     = dict(x=x, y=y10)
     source_pr.data     = dict(x=x, y=y11)
+    source_ho.data     = dict(x=x, y=y12)
+    source_iu.data     = dict(x=x, y=y13)
+    source_ad.data     = dict(x=x, y=y14)
+    source_dd.data     = dict(x=x, y=y15)
 
     transition1_begin = duration1.value
     transition1_end   = transition1_begin + transition1.value
@@ -267,6 +294,12 @@ def update_data(attrname, old, new):
     stats_str     = 'Transmissions: ' + str(ar_stats[0]) + '<br/>Recoveries: ' + str(ar_stats[1]) + '<br/>Deaths: ' + str(ar_stats[2])
     stats.text = stats_str
 
+# the schedule input shows why a schedule is not valid (the stages run instead)
+def update_schedule(attrname, old, new):
+    user_schedule, error = get_schedule_input ( schedule_input.value )
+    schedule_input.title = SCHEDULE_LABEL if error is None else SCHEDULE_LABEL + ': ' + error
+    update_data(attrname, old, new)
+
 def reset_data():
     population.value   = POP_START
     iinfections.value  = IIF_START
@@ -282,6 +315,8 @@ def reset_data():
     beta3.value        = BETA3_START
     drate.value        = DRATE_START
 
+    schedule_input.value = ''
+
     # we seem to need to pass something here because the slider callback needs to have a declaration of 3 parameters
     update_data('xxxx',0,0)
 
@@ -324,6 +359,9 @@ beta3 = Slider(title=BETA3_LABEL, value=BETA3_START, start=BETA_MIN, end=BETA3_M
 
 drate = Slider(title=DRATE_LABEL, value=DRATE_START, start=DRATE_MIN, end=DRATE_MAX, step=DRATE_STEP)
 
+# N-stage schedule, in the string form of the CLI (see viraly.Schedule)
+schedule_input = TextInput(title=SCHEDULE_LABEL, value='')
+
 button = Button(label="Reset", button_type="default")
 
 # text widgets
@@ -337,12 +375,14 @@ notes   = Div(text='', width=TEXT_WIDTH)
 for w in [population, iinfections, period, period_stdev, latent, duration1, duration2, transition1, transition2, beta1, beta2, beta3, drate ]:
     w.on_change('value_throttled', update_data)
 
+schedule_input.on_change('value', update_schedule)
+
 # reset button call back
 button.on_click(reset_data)
 
 # initial plot
 x = np.linspace(1, DAYS, DAYS)
-y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True )
+y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, y13, y14, y15, ar_stats = get_data(x, population.value, iinfections.value, period.value, period_stdev.value, latent.value, duration1.value, duration2.value, transition1.value, transition2.value, beta1.value, beta2.value, beta3.value, DAYS, drate.value, True, schedule_str=schedule_input.value )
 
 # Active, New, Recovered, Dead, Rt, % Immunine
 source_active = ColumnDataSource(data=dict(x=x, y=y1))
@@ -356,6 +396,10 @@ source_ra     = ColumnDataSource(data=dict(x=x, y=y8))
 source_da     = ColumnDataSource(data=dict(x=x, y=y9))
 source_ic     = ColumnDataSource(data=dict(x=x, y=y10))
 source_pr     = ColumnDataSource(data=dict(x=x, y=y11))
+source_ho     = ColumnDataSource(data=dict(x=x, y=y12))
+source_iu     = ColumnDataSource(data=dict(x=x, y=y13))
+source_ad     = ColumnDataSource(data=dict(x=x, y=y14))
+source_dd     = ColumnDataSource(data=dict(x=x, y=y15))
 
 # plot 1
 
@@ -474,6 +518,34 @@ plot9.line('x', 'y', source=source_pr, line_width=PLOT_LINE_WIDTH, line_alpha=PL
 
 set_plot_details(plot9, hover9, PLOT_Y_LABEL2)
 
+# plot 10
+
+# using mode="mouse" because the vline mode produces overlapping tooltips when multiple lines are used
+hover10 = HoverTool(tooltips=[ (PLOT_X_LABEL, "@x{0}"), (PLOT_Y_LABEL, "@y{0}")], mode="mouse" )
+hover10.point_policy='snap_to_data'
+hover10.line_policy='nearest'
+
+plot10 = figure(plot_height=PLOT_HEIGHT, plot_width=PLOT_WIDTH, title=PLOT10_TITLE, tools=PLOT_TOOLS, x_range=[0, DAYS], )
+
+plot10.line('x', 'y', source=source_ho, line_width=PLOT_LINE_WIDTH, line_alpha=PLOT_LINE_ALPHA, line_color=PLOT_LINE_ACTIVE_COLOR, legend_label='Hospital' )
+plot10.line('x', 'y', source=source_iu, line_width=PLOT_LINE_WIDTH, line_alpha=PLOT_LINE_ALPHA, line_color=PLOT_LINE_ICU_COLOR,    legend_label='ICU' )
+
+set_plot_details(plot10, hover10)
+
+# plot 11
+
+# using mode="mouse" because the vline mode produces overlapping tooltips when multiple lines are used
+hover11 = HoverTool(tooltips=[ (PLOT_X_LABEL, "@x{0}"), (PLOT_Y_LABEL, "@y{0}")], mode="mouse" )
+hover11.point_policy='snap_to_data'
+hover11.line_policy='nearest'
+
+plot11 = figure(plot_height=PLOT_HEIGHT, plot_width=PLOT_WIDTH, title=PLOT11_TITLE, tools=PLOT_TOOLS, x_range=[0, DAYS], )
+
+plot11.line('x', 'y', source=source_ad, line_width=PLOT_LINE_WIDTH, line_alpha=PLOT_LINE_ALPHA, line_color=PLOT_LINE_NEW_COLOR,  legend_label='Admissions' )
+plot11.line('x', 'y', source=source_dd, line_width=PLOT_LINE_WIDTH, line_alpha=PLOT_LINE_ALPHA, line_color=PLOT_LINE_DEAD_COLOR, legend_label='Deaths' )
+
+set_plot_details(plot11, hover11)
+
 # highlight phases with boxes
 transition1_begin = duration1.value
 transition1_end   = transition1_begin + transition1.value
@@ -522,6 +594,14 @@ plot9.add_layout(transition1_box)
 plot9.add_layout(confinement_box)
 plot9.add_layout(transition2_box)
 
+plot10.add_layout(transition1_box)
+plot10.add_layout(confinement_box)
+plot10.add_layout(transition2_box)
+
+plot11.add_layout(transition1_box)
+plot11.add_layout(confinement_box)
+plot11.add_layout(transition2_box)
+
 # misc text
 intro.text    = TEXT_INTRO
 summary.text  = TEXT_SUMMARY
@@ -532,10 +612,10 @@ notes.text    = TEXT_NOTES
 
 # Set up layouts and add to document
 notespacer = Spacer(width=TEXT_WIDTH, height=10, width_policy='auto', height_policy='fixed')
-inputs = column(intro, population, iinfections, period, period_stdev, latent, duration1, transition1, duration2, transition2, beta1, beta2, beta3, drate, button, summary, stats, notespacer, notes)
+inputs = column(intro, population, iinfections, period, period_stdev, latent, duration1, transition1, duration2, transition2, beta1, beta2, beta3, drate, schedule_input, button, summary, stats, notespacer, notes)
 
 curdoc().title = PAGE_TITLE
 
 # useful for mobile scrolling on the left side
 leftmargin = Spacer(width=LMARGIN_WIDTH, height=400, width_policy='fixed', height_policy='auto')
-curdoc().add_root( row(leftmargin,inputs, column(plot, plot2, plot5), column(plot4, plot6, plot7), column(plot3, plot8, plot9)) )
+curdoc().add_root( row(leftmargin,inputs, column(plot, plot2, plot5, plot10), column(plot4, plot6, plot7, plot11), column(plot3, plot8, plot9)) )